@@ -0,0 +1,138 @@
+"""
+Indice delle date disponibili per collezione e area.
+
+Trovare l'ultima acquisizione disponibile provando un giorno alla volta
+costa una richiesta Process (e un'attesa) per ogni giorno. L'indice tiene
+in un file JSON l'ultima data nota per ogni coppia (collezione, area):
+la risposta è una lettura di dizionario. Le date arrivano dalle ricerche
+nel catalogo (solo metadati) e dalle richieste andate a buon fine.
+
+- indice aggiornato: la data si usa così com'è
+- indice vecchio di più di `max_age_s`: la data si usa subito e il catalogo
+  viene interrogato in background, l'indice aggiornato serve alla prossima
+  esecuzione
+- nessuna data nota: ricerca nel catalogo; se non risponde, prova diretta
+  di `parallel` giorni alla volta, dal più recente
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+from raster_cube import bbox_key
+
+# Dopo quanto tempo una data nota va ricontrollata (in background)
+MAX_AGE_S = 6 * 3600
+
+
+class AvailabilityIndex:
+    """
+    Ultima data disponibile per (collezione, area), salvata in `path`.
+
+    Ogni voce: {"latest": "AAAA-MM-GG", "checked": epoch, "source": ...}
+    """
+
+    def __init__(self, path, max_age_s=MAX_AGE_S):
+        self.path = path
+        self.max_age_s = max_age_s
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(collection, bbox):
+        return f"{collection}|{bbox_key(bbox)}"
+
+    def latest(self, collection, bbox):
+        """Ultima data nota (datetime.date), None se la coppia non è nell'indice."""
+        entry = self.entries.get(self.key(collection, bbox))
+        return datetime.date.fromisoformat(entry["latest"]) if entry else None
+
+    def is_fresh(self, collection, bbox):
+        entry = self.entries.get(self.key(collection, bbox))
+        return bool(entry) and time.time() - entry["checked"] < self.max_age_s
+
+    def record(self, collection, bbox, day, source, checked=True):
+        """
+        Registra una data disponibile; l'indice avanza solo verso date più
+        recenti. `checked` False per le date che non sono per forza le ultime
+        (es. una richiesta riuscita): la voce resta da ricontrollare.
+        """
+        entry = self.entries.setdefault(self.key(collection, bbox), {"latest": "", "checked": 0, "source": source})
+        if day.isoformat() > entry["latest"]:
+            entry["latest"] = day.isoformat()
+            entry["source"] = source
+        if checked:
+            entry["checked"] = time.time()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+async def probe_days(probe, days, parallel):
+    """
+    Prova i giorni (dal più recente) a gruppi di `parallel` richieste
+    contemporanee; si ferma al primo gruppo con un giorno disponibile.
+    """
+    for start in range(0, len(days), parallel):
+        group = days[start:start + parallel]
+        available = await asyncio.gather(*(probe(day) for day in group))
+        found = [day for day, ok in zip(group, available) if ok]
+        if found:
+            return max(found)
+    return None
+
+
+async def refresh(index, collection, bbox, search, days):
+    """Aggiorna l'indice dal catalogo, restituisce la data più recente trovata o None."""
+    found = await search(min(days), max(days))
+    if not found:
+        return None
+    latest = max(found)
+    index.record(collection, bbox, latest, "catalog")
+    return latest
+
+
+async def refresh_in_background(index, collection, bbox, search, days):
+    """
+    `refresh` per il task in background: un errore non deve interrompere
+    l'esecuzione che lo attende, l'indice resta com'è e si riprova la
+    prossima volta.
+    """
+    try:
+        return await refresh(index, collection, bbox, search, days)
+    except Exception as e:
+        print(f"⚠️ Aggiornamento dell'indice delle date fallito: {e!r}")
+        return None
+
+
+async def latest_available_date(index, collection, bbox, search, probe, days_back=10, parallel=4):
+    """
+    Ultima data disponibile per collezione e area.
+
+    `search(primo, ultimo)` restituisce le date con acquisizioni secondo il
+    catalogo (None se il catalogo non risponde), `probe(giorno)` se la
+    richiesta diretta per quel giorno riesce.
+    Restituisce (data o None, task): il task è l'aggiornamento in background
+    da attendere prima di chiudere il client, None se non serve.
+    """
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=i) for i in range(days_back)]
+
+    latest = index.latest(collection, bbox)
+    if latest is not None:
+        task = None
+        if not index.is_fresh(collection, bbox):
+            task = asyncio.create_task(refresh_in_background(index, collection, bbox, search, days))
+        return latest, task
+
+    latest = await refresh(index, collection, bbox, search, days)
+    if latest is None:
+        latest = await probe_days(probe, days, parallel)
+        if latest is not None:
+            index.record(collection, bbox, latest, "probe")
+    return latest, None
@@ -0,0 +1,276 @@
+"""
+Data cube locale dei raster Sentinel (Sentinel-5P, Sentinel-2).
+
+Ogni prodotto (es. "S5P_NO2") ha un cubo per area (bbox): una pila di
+griglie float32 indicizzate per istante di acquisizione. Le nuove
+acquisizioni si aggiungono in coda senza riscrivere le precedenti, le
+interrogazioni (valore in un punto, statistiche in un'area, ultimo valore
+valido in una coordinata) leggono i file in memory map e non usano la rete.
+
+Struttura su disco (<root>/<prodotto>/<bbox>/):
+- meta.json: bbox, dimensione della griglia, valore nodata, slot per chunk
+- times.npy: istante di acquisizione di ogni slot (datetime64[s])
+- chunk_00000.npy, ...: blocchi di `chunk` griglie (slot, righe, colonne)
+
+Interrogazione da riga di comando, dalla cartella API_test:
+    python src/raster_cube.py S5P_NO2 --lat 44.4836 --lon 11.3740
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import numpy as np
+
+# Griglie per file: un chunk di 256x256 float32 occupa 8 MB
+CHUNK = 32
+
+
+def to_time(value):
+    """datetime, date o stringa ISO (anche con "Z") -> datetime64[s] in UTC."""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "s")
+
+
+def bbox_key(bbox):
+    """Nome della cartella di un'area [ovest, sud, est, nord]."""
+    return "_".join(f"{v:.4f}" for v in bbox)
+
+
+class RasterCube:
+    """
+    Pila di griglie di un prodotto su un'area, ordinate per tempo.
+
+    Parameters:
+    -----------
+    root : str
+        Cartella che contiene tutti i cubi
+    product : str
+        Nome del prodotto, es. "S5P_NO2"
+    bbox : list
+        [ovest, sud, est, nord] in gradi
+    nodata : float
+        Valore che indica assenza di dato oltre a NaN (gli evalscript
+        restituiscono 0 dove il dato manca)
+    """
+
+    def __init__(self, root, product, bbox, nodata=None, chunk=CHUNK):
+        self.product = product
+        self.bbox = [float(v) for v in bbox]
+        self.directory = os.path.join(root, product, bbox_key(self.bbox))
+        self.nodata = nodata
+        self.chunk = chunk
+        self.shape = None
+        self.times = np.zeros(0, dtype="datetime64[s]")
+        self._chunks = {}
+
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.shape = tuple(meta["shape"])
+            self.nodata = meta["nodata"]
+            self.chunk = meta["chunk"]
+            self.times = np.load(os.path.join(self.directory, "times.npy"))
+        self._order = np.argsort(self.times, kind="stable")
+
+    @classmethod
+    def find(cls, root, product, lat, lon):
+        """Cubi già scaricati del prodotto la cui area contiene il punto."""
+        cubes = []
+        for meta_path in sorted(glob.glob(os.path.join(root, product, "*", "meta.json"))):
+            with open(meta_path, encoding="utf-8") as f:
+                west, south, east, north = json.load(f)["bbox"]
+            if west <= lon <= east and south <= lat <= north:
+                cubes.append(cls(root, product, [west, south, east, north]))
+        return cubes
+
+    def __len__(self):
+        return len(self.times)
+
+    # === SCRITTURA ===
+    def append(self, time, values):
+        """
+        Aggiunge la griglia acquisita all'istante `time`. Se l'istante è già
+        presente la griglia viene sostituita (stesso giorno scaricato di nuovo).
+        """
+        values = np.asarray(values, dtype=np.float32)
+        if values.ndim != 2:
+            raise ValueError(f"Attesa una griglia 2D, ricevuto shape {values.shape}")
+        if self.shape is None:
+            self.shape = values.shape
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_json("meta.json", {
+                "product": self.product,
+                "bbox": self.bbox,
+                "shape": list(self.shape),
+                "nodata": self.nodata,
+                "chunk": self.chunk,
+            })
+        elif values.shape != self.shape:
+            raise ValueError(f"Griglia {values.shape} diversa da quella del cubo {self.shape}")
+
+        time = to_time(time)
+        existing = np.flatnonzero(self.times == time)
+        slot = int(existing[0]) if len(existing) else len(self.times)
+        path = self._chunk_path(slot // self.chunk)
+        if os.path.exists(path):
+            block = np.load(path, mmap_mode="r+")
+        else:
+            # chunk nuovo, riempito di NaN fino a quando gli slot non vengono scritti
+            block = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.float32, shape=(self.chunk, *self.shape)
+            )
+            block[:] = np.nan
+        block[slot % self.chunk] = values
+        block.flush()
+        del block
+
+        # l'indice dei tempi si aggiorna solo dopo che i dati sono su disco
+        if not len(existing):
+            self.times = np.append(self.times, time)
+            self._save_times()
+            self._order = np.argsort(self.times, kind="stable")
+        self._chunks.pop(slot // self.chunk, None)
+        return slot
+
+    def _write_json(self, name, data):
+        tmp = os.path.join(self.directory, name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, os.path.join(self.directory, name))
+
+    def _save_times(self):
+        tmp = os.path.join(self.directory, "times.tmp.npy")
+        np.save(tmp, self.times)
+        os.replace(tmp, os.path.join(self.directory, "times.npy"))
+
+    # === LETTURA ===
+    def _chunk_path(self, index):
+        return os.path.join(self.directory, f"chunk_{index:05d}.npy")
+
+    def _block(self, index):
+        if index not in self._chunks:
+            self._chunks[index] = np.load(self._chunk_path(index), mmap_mode="r")
+        return self._chunks[index]
+
+    def grid(self, slot):
+        """Griglia (in memory map) dello slot."""
+        return self._block(slot // self.chunk)[slot % self.chunk]
+
+    def slot_at(self, time=None):
+        """Slot dell'acquisizione più recente non successiva a `time` (None = l'ultima)."""
+        if not len(self.times):
+            return None
+        if time is None:
+            return int(self._order[-1])
+        sorted_times = self.times[self._order]
+        position = np.searchsorted(sorted_times, to_time(time), side="right")
+        return int(self._order[position - 1]) if position else None
+
+    def valid(self, values):
+        """Maschera dei valori validi (né NaN né nodata)."""
+        mask = ~np.isnan(values)
+        if self.nodata is not None:
+            mask &= values != self.nodata
+        return mask
+
+    def pixel(self, lat, lon):
+        """Riga e colonna della griglia che contiene il punto."""
+        west, south, east, north = self.bbox
+        if not (west <= lon <= east and south <= lat <= north):
+            raise ValueError(f"Punto ({lat}, {lon}) fuori dall'area {self.bbox}")
+        rows, cols = self.shape
+        row = min(int((north - lat) / (north - south) * rows), rows - 1)
+        col = min(int((lon - west) / (east - west) * cols), cols - 1)
+        return row, col
+
+    def window(self, bbox):
+        """Righe e colonne (slice) dell'intersezione con l'area [ovest, sud, est, nord]."""
+        west, south, east, north = bbox
+        top, left = self.pixel(min(north, self.bbox[3]), max(west, self.bbox[0]))
+        bottom, right = self.pixel(max(south, self.bbox[1]), min(east, self.bbox[2]))
+        return slice(top, bottom + 1), slice(left, right + 1)
+
+    def point(self, lat, lon, time=None):
+        """(istante, valore) nel punto per l'acquisizione `slot_at(time)`; NaN se non valido."""
+        slot = self.slot_at(time)
+        if slot is None:
+            return None, float("nan")
+        value = np.float32(self.grid(slot)[self.pixel(lat, lon)])
+        return self.times[slot], float(value) if self.valid(value) else float("nan")
+
+    def series(self, lat, lon):
+        """Serie temporale nel punto: istanti ordinati e valori (NaN dove non validi)."""
+        row, col = self.pixel(lat, lon)
+        values = np.full(len(self.times), np.nan, dtype=np.float32)
+        for index in range((len(self.times) + self.chunk - 1) // self.chunk):
+            start = index * self.chunk
+            stop = min(start + self.chunk, len(self.times))
+            values[start:stop] = self._block(index)[:stop - start, row, col]
+        values[~self.valid(values)] = np.nan
+        return self.times[self._order], values[self._order]
+
+    def latest_valid(self, lat, lon, before=None):
+        """(istante, valore) dell'ultimo dato valido nel punto, (None, NaN) se non c'è."""
+        times, values = self.series(lat, lon)
+        candidates = ~np.isnan(values)
+        if before is not None:
+            candidates &= times <= to_time(before)
+        found = np.flatnonzero(candidates)
+        if not len(found):
+            return None, float("nan")
+        return times[found[-1]], float(values[found[-1]])
+
+    def bbox_values(self, bbox=None, time=None):
+        """(istante, finestra della griglia) sull'area richiesta (None = tutto il cubo)."""
+        slot = self.slot_at(time)
+        if slot is None:
+            return None, None
+        grid = self.grid(slot)
+        if bbox is not None:
+            grid = grid[self.window(bbox)]
+        return self.times[slot], grid
+
+    def bbox_stats(self, bbox=None, time=None):
+        """Media, minimo e massimo dei valori validi nell'area, None se il cubo è vuoto."""
+        acquired, grid = self.bbox_values(bbox, time)
+        if grid is None:
+            return None
+        values = np.asarray(grid)[self.valid(grid)]
+        return {
+            "time": str(acquired),
+            "mean": float(values.mean()) if values.size else None,
+            "min": float(values.min()) if values.size else None,
+            "max": float(values.max()) if values.size else None,
+            "valid_fraction": round(values.size / grid.size, 4),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interroga i cubi raster locali, senza rete")
+    parser.add_argument("product", help="Prodotto, es. S5P_NO2 o S2_cloud_cover")
+    parser.add_argument("--lat", type=float, required=True)
+    parser.add_argument("--lon", type=float, required=True)
+    parser.add_argument("--before", type=str, default=None, help="Solo acquisizioni fino a questa data (ISO)")
+    parser.add_argument("--root", type=str, default=os.path.join("data", "cube"),
+                        help="Cartella dei cubi (default: data/cube)")
+    args = parser.parse_args()
+
+    cubes = RasterCube.find(args.root, args.product, args.lat, args.lon)
+    if not cubes:
+        print(f"Nessun cubo {args.product} contiene ({args.lat}, {args.lon})")
+    for cube in cubes:
+        acquired, value = cube.latest_valid(args.lat, args.lon, args.before)
+        print(json.dumps({
+            "product": args.product,
+            "bbox": cube.bbox,
+            "acquisitions": len(cube),
+            "latest_valid_time": None if acquired is None else str(acquired),
+            "latest_valid_value": None if acquired is None else value,
+        }))
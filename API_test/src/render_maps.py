@@ -0,0 +1,54 @@
+"""
+Mappe PNG dei gas a partire dal data cube locale, senza rete.
+
+Passo facoltativo e separato dalla raccolta dati di temperatures_api.py:
+per ogni gas prende l'acquisizione più recente (o l'ultima fino a --date)
+dei cubi che contengono il punto e salva data/<gas>_map.png.
+
+Dalla cartella API_test:
+    python src/render_maps.py --gas NO2 CO --date 2025-05-20
+"""
+import argparse
+import os
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from raster_cube import RasterCube
+
+
+def render_gas_map(cube, gas_name, out_file, time=None):
+    """Salva la mappa PNG della griglia del gas, restituisce il percorso o None."""
+    acquired, grid = cube.bbox_values(time=time)
+    if grid is None:
+        return None
+    values = np.where(cube.valid(grid), grid, np.nan)
+    plt.figure(figsize=(8, 8))
+    plt.imshow(values, cmap='jet')  # Usa colormap 'jet' per evidenziare le differenze
+    plt.colorbar(label=f'Concentrazione {gas_name}')
+    plt.title(f"Concentrazione {gas_name} - {str(acquired)[:10]}")
+    plt.axis('off')
+    plt.savefig(out_file, dpi=150, bbox_inches='tight')
+    plt.close()
+    return out_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mappe PNG dei gas dal data cube locale")
+    parser.add_argument("--gas", nargs="+", default=["NO2", "CO", "O3"], help="Gas da disegnare")
+    parser.add_argument("--lat", type=float, default=44.483619, help="Punto contenuto nell'area (default: Bologna)")
+    parser.add_argument("--lon", type=float, default=11.374042)
+    parser.add_argument("--date", type=str, default=None, help="Ultima acquisizione fino a questa data (ISO)")
+    parser.add_argument("--data", type=str, default="data", help="Cartella dei dati (default: data)")
+    args = parser.parse_args()
+
+    for gas in args.gas:
+        cubes = RasterCube.find(os.path.join(args.data, "cube"), f"S5P_{gas}", args.lat, args.lon)
+        if not cubes:
+            print(f"⚠️ Nessun dato locale per {gas}")
+            continue
+        for index, cube in enumerate(cubes):
+            suffix = f"_{index}" if len(cubes) > 1 else ""
+            out_file = render_gas_map(cube, gas, os.path.join(args.data, f"{gas}_map{suffix}.png"), args.date)
+            if out_file:
+                print(f"✅ {gas} salvato in {out_file}")
@@ -0,0 +1,181 @@
+"""
+Client asincrono per le Process e Catalog API di Sentinel Hub (Copernicus).
+
+Una sola sessione HTTP con connessioni riusate (keep-alive) per tutte le
+richieste, token OAuth tenuto in cache fino alla scadenza e condiviso tra le
+istanze del processo, limite di frequenza (token bucket) e retry con backoff
+esponenziale su errori di rete, 429 e 5xx (rispettando Retry-After).
+
+Gli URL si possono sostituire, ad esempio per provare tutto contro il
+server locale di sentinel_standin.py:
+    SENTINELHUB_TOKEN_URL=http://localhost:8765/oauth/token
+    SENTINELHUB_PROCESS_URL=http://localhost:8765/api/v1/process
+    SENTINELHUB_CATALOG_URL=http://localhost:8765/api/v1/catalog/1.0.0/search
+"""
+import asyncio
+import os
+import random
+import time
+import httpx
+
+TOKEN_URL = os.environ.get("SENTINELHUB_TOKEN_URL", "https://services.sentinel-hub.com/oauth/token")
+PROCESS_URL = os.environ.get("SENTINELHUB_PROCESS_URL", "https://creodias.sentinel-hub.com/api/v1/process")
+CATALOG_URL = os.environ.get("SENTINELHUB_CATALOG_URL", "https://creodias.sentinel-hub.com/api/v1/catalog/1.0.0/search")
+
+# Risposte per cui vale la pena ritentare
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Il token si rinnova poco prima della scadenza dichiarata
+TOKEN_MARGIN_S = 60
+
+
+class SentinelHubError(Exception):
+    """Autenticazione fallita o richiesta non riuscita dopo tutti i tentativi."""
+
+
+class RateLimiter:
+    """Token bucket asincrono: in media `rate` richieste al secondo, raffiche fino a `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SentinelHubClient:
+    """
+    Sessione verso Sentinel Hub, da usare come context manager asincrono:
+
+        async with SentinelHubClient(client_id, client_secret) as client:
+            responses = await asyncio.gather(client.process(body_a), client.process(body_b))
+
+    Parameters:
+    -----------
+    max_connections : int
+        Richieste contemporanee (dimensione del pool di connessioni)
+    rate : float
+        Richieste al secondo al massimo, retry compresi
+    retries : int
+        Tentativi aggiuntivi per errori di rete, 429 e 5xx
+    transport : httpx.AsyncBaseTransport, optional
+        Trasporto alternativo (es. httpx.MockTransport)
+    """
+
+    # token OAuth condivisi tra le istanze: (token_url, client_id) -> (token, scadenza)
+    _tokens = {}
+
+    def __init__(self, client_id, client_secret, token_url=TOKEN_URL, process_url=PROCESS_URL,
+                 catalog_url=CATALOG_URL, max_connections=8, rate=10.0, retries=3, backoff_s=0.5, timeout_s=30.0, transport=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.process_url = process_url
+        self.catalog_url = catalog_url
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.limiter = RateLimiter(rate)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        # l'attesa di una connessione libera non è un timeout
+        self._timeout = httpx.Timeout(timeout_s, pool=None)
+        self._transport = transport
+        self._http = None
+        self._token_lock = None
+        self.requests = 0
+        self.retried = 0
+
+    async def __aenter__(self):
+        self._http = httpx.AsyncClient(limits=self._limits, timeout=self._timeout, transport=self._transport)
+        self._token_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._http.aclose()
+
+    async def token(self, rejected=None):
+        """
+        Token OAuth valido, richiesto solo se assente o in scadenza.
+
+        `rejected` è un token rifiutato dal server (401): si rinnova solo se
+        è ancora quello in cache; se un'altra richiesta l'ha già rinnovato
+        si usa il nuovo.
+        """
+        key = (self.token_url, self.client_id)
+        async with self._token_lock:
+            cached = self._tokens.get(key)
+            if cached and cached[0] != rejected and cached[1] > time.time():
+                return cached[0]
+            response = await self._send("POST", self.token_url, data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "grant_type": "client_credentials",
+            })
+            if response.status_code != 200:
+                raise SentinelHubError(f"Errore autenticazione Sentinel Hub: {response.text}")
+            payload = response.json()
+            expires = time.time() + payload.get("expires_in", 3600) - TOKEN_MARGIN_S
+            self._tokens[key] = (payload["access_token"], expires)
+            return payload["access_token"]
+
+    async def process(self, body):
+        """
+        Richiesta alle Process API. Restituisce la risposta (anche se non ok,
+        dopo i retry); SentinelHubError per token non ottenibile o rete
+        irraggiungibile.
+        """
+        return await self._authorized(self.process_url, body)
+
+    async def catalog_search(self, body):
+        """
+        Ricerca STAC nelle Catalog API (solo metadati delle acquisizioni,
+        nessun raster). Stessa gestione di errori e retry di `process`.
+        """
+        return await self._authorized(self.catalog_url, body)
+
+    async def _authorized(self, url, body):
+        rejected = None
+        for _ in range(2):
+            token = await self.token(rejected)
+            response = await self._send("POST", url, json=body, headers={"Authorization": f"Bearer {token}"})
+            # 401: token revocato o scaduto prima del previsto, si rinnova una
+            # volta (una sola per tutte le richieste parallele che lo usavano)
+            if response.status_code != 401:
+                break
+            rejected = token
+        return response
+
+    async def _send(self, method, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            self.requests += 1
+            try:
+                response = await self._http.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise SentinelHubError(f"Errore di rete verso {url}: {e}") from e
+                delay = self.backoff_s * 2 ** attempt
+            else:
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return response
+                delay = _retry_after(response) or self.backoff_s * 2 ** attempt
+            self.retried += 1
+            # jitter: i retry delle richieste parallele non ripartono insieme
+            await asyncio.sleep(delay * random.uniform(1, 1.5))
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.replace(".", "", 1).isdigit() else None
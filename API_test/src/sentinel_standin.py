@@ -0,0 +1,147 @@
+"""
+Server locale che imita le API di Sentinel Hub usate da temperatures_api.py,
+per provare il client senza credenziali né rete.
+
+- POST /oauth/token: token con scadenza `--expires` secondi
+- POST /api/v1/process: dopo `--latency` secondi risponde con una griglia
+  JSON o un TIFF float32 della dimensione richiesta; 401 con token
+  sconosciuti, 503 (Retry-After) ogni `--fail-every` richieste, 400 per le
+  date più recenti di `--lag-days` giorni (dato non ancora disponibile)
+- POST /api/v1/catalog/1.0.0/search: un'acquisizione al giorno nell'intervallo
+  richiesto, fino a `--lag-days` giorni fa
+- GET /stats: richieste, token emessi, massimo di richieste contemporanee
+
+Avvio:
+    python src/sentinel_standin.py --port 8765 --latency 0.5
+    SENTINELHUB_TOKEN_URL=http://localhost:8765/oauth/token \
+    SENTINELHUB_PROCESS_URL=http://localhost:8765/api/v1/process \
+    SENTINELHUB_CATALOG_URL=http://localhost:8765/api/v1/catalog/1.0.0/search python src/temperatures_api.py
+"""
+import argparse
+import datetime
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+
+stats = {"token_requests": 0, "process_requests": 0, "catalog_requests": 0, "failures_injected": 0, "in_flight": 0, "max_in_flight": 0}
+tokens = set()
+lock = threading.Lock()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, come il servizio reale
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with lock:
+                self._reply(200, dict(stats))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/oauth/token":
+            with lock:
+                stats["token_requests"] += 1
+                token = f"standin-{stats['token_requests']}"
+                tokens.add(token)
+            self._reply(200, {"access_token": token, "expires_in": self.config.expires, "token_type": "Bearer"})
+        elif self.path == "/api/v1/process":
+            self._process(json.loads(body))
+        elif self.path == "/api/v1/catalog/1.0.0/search":
+            self._catalog(json.loads(body))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _catalog(self, request):
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in tokens:
+            self._reply(401, {"error": "invalid token"})
+            return
+        with lock:
+            stats["catalog_requests"] += 1
+        time.sleep(self.config.latency)
+        start, end = (datetime.date.fromisoformat(v[:10]) for v in request["datetime"].split("/"))
+        newest = datetime.date.today() - datetime.timedelta(days=self.config.lag_days)
+        days = [start + datetime.timedelta(days=i) for i in range((min(end, newest) - start).days + 1)]
+        features = [
+            {"id": f"S5P_{day.isoformat()}", "properties": {"datetime": f"{day.isoformat()}T12:00:00Z"}}
+            for day in days[:request.get("limit", 10)]
+        ]
+        self._reply(200, {"type": "FeatureCollection", "features": features, "context": {"returned": len(features)}})
+
+    def _process(self, request):
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in tokens:
+            self._reply(401, {"error": "invalid token"})
+            return
+        with lock:
+            stats["process_requests"] += 1
+            count = stats["process_requests"]
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            time.sleep(self.config.latency)
+            if self.config.fail_every and count % self.config.fail_every == 0:
+                with lock:
+                    stats["failures_injected"] += 1
+                self._reply(503, {"error": "busy"}, headers={"Retry-After": "0.1"})
+                return
+
+            data = request["input"]["data"][0]
+            time_range = data.get("dataFilter", {}).get("timeRange", {})
+            day = datetime.date.fromisoformat(time_range.get("from", "1970-01-01")[:10])
+            newest = datetime.date.today() - datetime.timedelta(days=self.config.lag_days)
+            if day > newest:
+                self._reply(400, {"error": {"message": "No data available for the requested time range"}})
+                return
+
+            output = request.get("output", {})
+            width, height = output.get("width", 10), output.get("height", 10)
+            rng = np.random.default_rng(count)
+            values = rng.random((height, width), dtype=np.float32)
+            response_format = (output.get("responses") or [{}])[0].get("format", {}).get("type", "image/tiff")
+            if response_format == "json":
+                self._reply(200, {
+                    "data": [values.ravel().tolist()],
+                    "meta": {"timestamps": [f"{newest.isoformat()}T10:30:00Z"]},
+                })
+            else:
+                buffer = io.BytesIO()
+                Image.fromarray(values, mode="F").save(buffer, format="TIFF")
+                self._reply(200, buffer.getvalue(), content_type="image/tiff")
+        finally:
+            with lock:
+                stats["in_flight"] -= 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server locale che imita Sentinel Hub")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Latenza di ogni richiesta Process (s)")
+    parser.add_argument("--expires", type=int, default=3600, help="Durata dei token (s)")
+    parser.add_argument("--fail-every", type=int, default=0, help="Un 503 ogni N richieste (0 = mai)")
+    parser.add_argument("--lag-days", type=int, default=2, help="Giorni di ritardo dei dati più recenti")
+    StandinHandler.config = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", StandinHandler.config.port), StandinHandler)
+    print(f"Stand-in Sentinel Hub su http://127.0.0.1:{StandinHandler.config.port}")
+    server.serve_forever()
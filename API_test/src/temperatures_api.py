@@ -1,106 +1,131 @@
-import requests
+import asyncio
 import datetime
+import io
 import os
 import json
-import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
-import io
-import time
+import requests
+from availability import AvailabilityIndex, latest_available_date
+from raster_cube import RasterCube
+from sentinel_client import SentinelHubClient, SentinelHubError
 
 # === CONFIGURA LE CREDENZIALI ===
-SENTINELHUB_CLIENT_ID = "aeae719a-8d31-4a2d-b7a4-8505ac59acbc"
-SENTINELHUB_CLIENT_SECRET = "H8ynQ3MCMCm8PBdCopOaBwp51UWtaLdf"
+SENTINELHUB_CLIENT_ID = os.environ.get("SENTINELHUB_CLIENT_ID", "aeae719a-8d31-4a2d-b7a4-8505ac59acbc")
+SENTINELHUB_CLIENT_SECRET = os.environ.get("SENTINELHUB_CLIENT_SECRET", "H8ynQ3MCMCm8PBdCopOaBwp51UWtaLdf")
 
 # === COORDINATE PREDEFINITE ===
 lat = 44.483619  # Bologna
 lon = 11.374042
+bbox = [lon - 0.05, lat - 0.05, lon + 0.05, lat + 0.05]
+
+# Gas di Sentinel-5P da scaricare
+GASES = ["NO2", "CO", "O3"]
 
 # === CREA LA DIRECTORY PER I DATI ===
 data_dir = os.path.join('data')
 os.makedirs(data_dir, exist_ok=True)
+# Data cube locale dei raster scaricati (vedi raster_cube.py)
+cube_dir = os.path.join(data_dir, 'cube')
+# Indice delle date disponibili per collezione e area (vedi availability.py)
+availability_path = os.path.join(data_dir, 'availability.json')
 
-# === TROVA L'ULTIMA DATA DISPONIBILE ===
-def get_latest_available_date():
-    # Inizia con la data attuale e cerca indietro fino a 10 giorni
-    current_date = datetime.datetime.now()
-    
-    for days_back in range(10):  # Prova fino a 10 giorni indietro
-        test_date = current_date - datetime.timedelta(days=days_back)
-        date_str = test_date.strftime("%Y-%m-%d")
-        
-        # Verifica disponibilità attraverso Sentinel Hub
-        token = get_sentinel_token()
-        if not token:
-            continue
-            
-        # Prova a recuperare dati ERA5 della data specificata tramite Sentinel Hub
-        url = "https://creodias.sentinel-hub.com/api/v1/process"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        bbox_small = [lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01]
-        
-        body = {
-            "input": {
-                "bounds": {"bbox": bbox_small},
-                "data": [{
-                    "type": "S5PL2",
-                    "dataFilter": {
-                        "timeRange": {
-                            "from": f"{date_str}T00:00:00Z",
-                            "to": f"{date_str}T23:59:59Z"
-                        }
-                    },
-                    "datasetId": "S5P_L2_NO2"
-                }]
-            },
-            "output": {"width": 10, "height": 10}
-        }
-        
-        response = requests.post(url, headers=headers, json=body)
-        if response.ok:
-            print(f"✅ Data disponibile trovata: {date_str}")
-            return test_date
-            
-        time.sleep(1)  # Pausa per non sovraccaricare l'API
-    
-    # Se nessuna data è disponibile, usa 3 giorni fa come fallback
-    fallback = current_date - datetime.timedelta(days=3)
-    print(f"⚠️ Nessuna data confermata disponibile. Uso {fallback.strftime('%Y-%m-%d')} come fallback")
-    return fallback
+# Collezione del catalogo con i prodotti Sentinel-5P L2
+S5P_COLLECTION = "sentinel-5p-l2"
+
+def sentinel_client():
+    """Sessione Sentinel Hub: connessioni riusate, token in cache, richieste parallele limitate."""
+    return SentinelHubClient(SENTINELHUB_CLIENT_ID, SENTINELHUB_CLIENT_SECRET)
 
-def get_sentinel_token():
-    url = "https://services.sentinel-hub.com/oauth/token"
-    payload = {
-        "client_id": SENTINELHUB_CLIENT_ID,
-        "client_secret": SENTINELHUB_CLIENT_SECRET,
-        "grant_type": "client_credentials"
+# === TROVA L'ULTIMA DATA DISPONIBILE ===
+async def search_available_dates(client, first_day, last_day):
+    """Giorni con acquisizioni S5P NO2 sull'area secondo il catalogo (solo metadati), None se non risponde."""
+    body = {
+        "collections": [S5P_COLLECTION],
+        "bbox": bbox,
+        "datetime": f"{first_day.isoformat()}T00:00:00Z/{last_day.isoformat()}T23:59:59Z",
+        "filter": "s5p:type = 'NO2'",
+        "filter-lang": "cql2-text",
+        "fields": {"include": ["properties.datetime"], "exclude": ["geometry", "assets", "links"]},
+        "limit": 100
     }
-    res = requests.post(url, data=payload)
-    if res.status_code != 200:
-        print(f"❌ Errore autenticazione Sentinel Hub: {res.text}")
+    try:
+        response = await client.catalog_search(body)
+    except SentinelHubError as e:
+        print(f"⚠️ Catalogo non raggiungibile: {e}")
+        return None
+    if not response.is_success:
+        print(f"⚠️ Errore catalogo: {response.status_code}")
+        return None
+    try:
+        return {
+            datetime.date.fromisoformat(feature["properties"]["datetime"][:10])
+            for feature in response.json().get("features", [])
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        # Risposta non JSON o feature senza data: come un catalogo che non risponde
+        print(f"⚠️ Risposta del catalogo non valida: {e!r}")
         return None
-    return res.json()["access_token"]
 
-# Ottieni l'ultima data disponibile
-date_obj = get_latest_available_date()
-date_str = date_obj.strftime("%Y-%m-%d")
-next_day = (date_obj + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+async def probe_date(client, day):
+    """Richiesta Process minima per il giorno: True se i dati S5P ci sono."""
+    date_str = day.isoformat()
+    bbox_small = [lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01]
+    
+    # Prova a recuperare dati S5P della data specificata tramite Sentinel Hub
+    body = {
+        "input": {
+            "bounds": {"bbox": bbox_small},
+            "data": [{
+                "type": "S5PL2",
+                "dataFilter": {
+                    "timeRange": {
+                        "from": f"{date_str}T00:00:00Z",
+                        "to": f"{date_str}T23:59:59Z"
+                    }
+                },
+                "datasetId": "S5P_L2_NO2"
+            }]
+        },
+        "output": {"width": 10, "height": 10}
+    }
+    
+    try:
+        response = await client.process(body)
+    except SentinelHubError as e:
+        print(f"❌ {e}")
+        return False
+    return response.is_success
 
-print(f"Utilizzo dati per: lat={lat}, lon={lon}, data={date_str}")
-bbox = [lon - 0.05, lat - 0.05, lon + 0.05, lat + 0.05]
+async def get_latest_available_date(client, index):
+    """
+    Ultima data con dati S5P: dall'indice se nota, altrimenti dal catalogo o
+    provando più giorni in parallelo. Restituisce (data, aggiornamento
+    dell'indice in background o None).
+    """
+    latest, refresh = await latest_available_date(
+        index, S5P_COLLECTION, bbox,
+        search=lambda first_day, last_day: search_available_dates(client, first_day, last_day),
+        probe=lambda day: probe_date(client, day),
+    )
+    if latest is None:
+        # Se nessuna data è disponibile, usa 3 giorni fa come fallback
+        latest = datetime.date.today() - datetime.timedelta(days=3)
+        print(f"⚠️ Nessuna data confermata disponibile. Uso {latest.isoformat()} come fallback")
+    else:
+        print(f"✅ Data disponibile trovata: {latest.isoformat()}")
+    return latest, refresh
 
 # === SENTINEL HUB: RECUPERA GAS ===
-def query_sentinel_5p_gas(gas_name, token):
+async def query_sentinel_5p_gas(gas_name, client, day):
+    """Scarica i dati grezzi (TIFF) di un gas per il giorno, restituisce i byte o None."""
+    date_str = day.isoformat()
+    next_day = (day + datetime.timedelta(days=1)).isoformat()
     gas_map = {
         "NO2": "NO2",
         "CO": "CO",
         "O3": "O3"
     }
-
     # Modificato per ottenere dati grezzi invece che un'immagine
     evalscript = f"""
     //VERSION=3
@@ -124,13 +149,6 @@ def query_sentinel_5p_gas(gas_name, token):
     }}
     """
 
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-
-    url = "https://creodias.sentinel-hub.com/api/v1/process"
-    
     body = {
         "input": {
             "bounds": {"bbox": bbox},
@@ -158,80 +176,40 @@ def query_sentinel_5p_gas(gas_name, token):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=body)
-        if response.ok:
-            # Salva i dati grezzi nella directory API_test/data
-            tiff_path = os.path.join(data_dir, f"{gas_name}_data.tiff")
-            with open(tiff_path, "wb") as f:
-                f.write(response.content)
-            
-            # Tenta di creare un'immagine a partire dai dati
-            try:
-                # Usa matplotlib per creare una visualizzazione dei dati
-                img = Image.open(tiff_path)
-                plt.figure(figsize=(8, 8))
-                plt.imshow(img, cmap='jet')  # Usa colormap 'jet' per evidenziare le differenze
-                plt.colorbar(label=f'Concentrazione {gas_name}')
-                plt.title(f"Concentrazione {gas_name} - {date_str}")
-                plt.axis('off')
-                
-                out_file = os.path.join(data_dir, f"{gas_name}_map.png")
-                plt.savefig(out_file, dpi=150, bbox_inches='tight')
-                plt.close()
-                
-                print(f"✅ {gas_name} salvato in {out_file}")
-                return True
-            except Exception as img_err:
-                print(f"⚠️ Immagine non visualizzabile, ma dati salvati: {img_err}")
-                return True
-        else:
-            print(f"❌ Errore API: {response.text}")
-            return False
-    except Exception as e:
+        response = await client.process(body)
+    except SentinelHubError as e:
         print(f"❌ Errore nella richiesta: {e}")
-        return False
+        return None
+    if not response.is_success:
+        print(f"❌ Errore API: {response.text}")
+        return None
+    return response.content
+
+def store_gas_data(gas_name, content, day, index):
+    """Aggiunge la griglia grezza (TIFF) di un gas al data cube locale."""
+    values = np.asarray(Image.open(io.BytesIO(content)), dtype=np.float32)
+    # Gli evalscript restituiscono 0 dove il dato manca
+    cube = RasterCube(cube_dir, f"S5P_{gas_name}", bbox, nodata=0)
+    cube.append(day, values)
+    if cube.valid(values).any():
+        # Richiesta riuscita: il giorno è disponibile (ma non per forza l'ultimo)
+        index.record(S5P_COLLECTION, bbox, day, "process", checked=False)
+    acquired, value = cube.latest_valid(lat, lon)
+    print(f"✅ {gas_name} aggiunto al data cube ({len(cube)} acquisizioni), "
+          f"ultimo valore valido nel punto: {value} ({acquired})")
+    return cube
 
 # === SENTINEL HUB: RECUPERA DATI METEO ===
-def get_sentinel_weather_data(token):
-    print("ℹ️ Recupero dati meteo da satellite (dati più recenti disponibili)...")
-    
-    # Dizionario di mapping tra i parametri meteo e le bande/indici Sentinel
-    params = {
-        "cloud_cover": {
-            "collection": "sentinel-2-l2a",
-            "band": "CLP",  # Cloud probability
-            "description": "Copertura nuvolosa"
-        },
-        "moisture": {
-            "collection": "sentinel-2-l2a", 
-            "band": "moisture",  # Calcolato dall'indice NDMI
-            "description": "Umidità terreno"
-        },
-        "surface_temperature": {
-            "collection": "sentinel-2-l1c",
-            "band": "B12",  # Banda infrarossa termica
-            "description": "Temperatura superficiale (correlata)"
-        }
-    }
-    
-    weather_data = {
-        "location": {
-            "latitude": lat,
-            "longitude": lon,
-            "name": "Bologna" if lat == 44.483619 and lon == 11.374042 else f"Custom({lat},{lon})"
-        },
-        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "data_collection_time": None,  # Sarà aggiornato con il timestamp effettivo dei dati
-        "parameters": {}
-    }
-    
-    # Ottieni i dati per ogni parametro
-    for param_name, param_info in params.items():
-        try:
-            # Prepara l'evalscript specifico per il parametro
-            if param_name == "moisture":
-                # Per l'umidità calcoliamo l'indice NDMI
-                evalscript = """
+# Lato della griglia scaricata per i parametri meteo
+WEATHER_GRID = 10
+
+# Gli evalscript meteo restituiscono NaN dove manca il dato (dataMask 0):
+# lo 0 è un valore reale (es. copertura nuvolosa 0 = cielo sereno)
+
+# Evalscript per ogni parametro meteo
+WEATHER_EVALSCRIPTS = {
+    # Per l'umidità calcoliamo l'indice NDMI
+    "moisture": """
                 //VERSION=3
                 function setup() {
                   return {
@@ -241,7 +219,7 @@ def get_sentinel_weather_data(token):
                 }
                 
                 function evaluatePixel(sample) {
-                  if (sample.dataMask == 0) { return [0]; }
+                  if (sample.dataMask == 0) { return [NaN]; }
                   
                   // Calcolo dell'indice NDMI (Normalized Difference Moisture Index)
                   let ndmi = (sample.B8 - sample.B11) / (sample.B8 + sample.B11);
@@ -249,10 +227,9 @@ def get_sentinel_weather_data(token):
                   // Normalizzazione per restituire un valore tra 0 e 1
                   return [(ndmi + 1) / 2];
                 }
-                """
-            elif param_name == "cloud_cover":
-                # Per la copertura nuvolosa usiamo direttamente la banda CLP
-                evalscript = """
+                """,
+    # Per la copertura nuvolosa usiamo direttamente la banda CLP
+    "cloud_cover": """
                 //VERSION=3
                 function setup() {
                   return {
@@ -262,12 +239,12 @@ def get_sentinel_weather_data(token):
                 }
                 
                 function evaluatePixel(sample) {
-                  if (sample.dataMask == 0) { return [0]; }
+                  if (sample.dataMask == 0) { return [NaN]; }
                   return [sample.CLP];
                 }
-                """
-            else:  # Temperatura superficiale (approssimazione dalla banda B12)
-                evalscript = """
+                """,
+    # Temperatura superficiale (approssimazione dalla banda B12)
+    "surface_temperature": """
                 //VERSION=3
                 function setup() {
                   return {
@@ -277,114 +254,195 @@ def get_sentinel_weather_data(token):
                 }
                 
                 function evaluatePixel(sample) {
-                  if (sample.dataMask == 0) { return [0]; }
+                  if (sample.dataMask == 0) { return [NaN]; }
                   
                   // B12 è correlata alla temperatura superficiale, ma non è una misura diretta
                   return [sample.B12 / 10000]; // Normalizzazione
                 }
-                """
-            
-            # Configura la richiesta - IMPORTANTE: modifica per ottenere dati sempre aggiornati
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-            
-            url = "https://creodias.sentinel-hub.com/api/v1/process"
-            
-            # Ottieni data corrente per il limite superiore
-            now = datetime.datetime.now()
-            # Calcola data di 30 giorni fa per avere un buon range di ricerca
-            thirty_days_ago = now - datetime.timedelta(days=30)
-            
-            from_date = thirty_days_ago.strftime("%Y-%m-%d")
-            to_date = now.strftime("%Y-%m-%d")
-            
-            body = {
-                "input": {
-                    "bounds": {"bbox": bbox},
-                    "data": [{
-                        "type": param_info["collection"],
-                        "dataFilter": {
-                            "timeRange": {
-                                "from": f"{from_date}T00:00:00Z",
-                                "to": f"{to_date}T23:59:59Z"
-                            },
-                            "mosaickingOrder": "mostRecent"  # Cruciale: prende sempre l'immagine più recente
-                        }
-                    }]
-                },
-                "output": {
-                    "width": 10,
-                    "height": 10,
-                    "responses": [{
-                        "identifier": "default",
-                        "format": {"type": "json"}
-                    }]
-                },
-                "evalscript": evalscript
-            }
-            
-            # Invia la richiesta con gestione errori più robusta
-            try:
-                # Aggiungi timeout più lungo per evitare timeout con server occupati
-                response = requests.post(url, headers=headers, json=body, timeout=30)
-                
-                if response.ok:
-                    # Verifica che la risposta sia JSON valido
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'application/json' in content_type:
-                        # Elabora i dati ricevuti
-                        data = response.json()
-                        
-                        # Verifica se ci sono dati disponibili
-                        if "data" in data and data["data"] and len(data["data"]) > 0:
-                            # Calcola il valore medio del parametro nell'area
-                            values = data["data"][0]
-                            if values:
-                                avg_value = sum(values) / len(values)
-                                
-                                # Ottieni l'ora di acquisizione se disponibile
-                                acquisition_time = None
-                                if "meta" in data and "timestamps" in data["meta"] and data["meta"]["timestamps"]:
-                                    # Estrai il timestamp dalla risposta API
-                                    acquisition_time = data["meta"]["timestamps"][0]
-                                    
-                                    # Aggiorna il campo data_collection_time se è più recente
-                                    if weather_data["data_collection_time"] is None or acquisition_time > weather_data["data_collection_time"]:
-                                        weather_data["data_collection_time"] = acquisition_time
-                                
-                                # Salva il valore nel dizionario dei risultati
-                                weather_data["parameters"][param_name] = {
-                                    "description": param_info["description"],
-                                    "value": avg_value,
-                                    "source": "Sentinel-2",
-                                    "acquisition_time": acquisition_time
-                                }
-                                print(f"✅ Parametro {param_name} recuperato - Timestamp: {acquisition_time}")
-                            else:
-                                print(f"⚠️ Nessun valore valido per {param_name}")
-                        else:
-                            print(f"⚠️ Nessun dato disponibile per {param_name}")
-                    else:
-                        print(f"⚠️ Risposta non in formato JSON per {param_name}: {content_type}")
-                else:
-                    print(f"❌ Errore API per {param_name}: {response.status_code}")
-                    # Tenta di estrarre il messaggio di errore
-                    try:
-                        error_msg = response.json().get('error', response.text)
-                        print(f"Dettaglio errore: {error_msg}")
-                    except:
-                        print(f"Contenuto risposta: {response.text[:200]}...")
-                        
-            except requests.exceptions.RequestException as req_err:
-                print(f"❌ Errore di rete per {param_name}: {req_err}")
-        
-        except Exception as e:
-            print(f"❌ Errore generale per {param_name}: {e}")
+                """,
+}
+
+async def query_weather_parameter(param_name, param_info, client):
+    """
+    Griglia di un parametro meteo nell'area e istante di acquisizione (None
+    se la risposta non lo riporta); None se il parametro non è disponibile.
+    """
+    # Ottieni data corrente per il limite superiore
+    now = datetime.datetime.now()
+    # Calcola data di 30 giorni fa per avere un buon range di ricerca
+    thirty_days_ago = now - datetime.timedelta(days=30)
+    
+    from_date = thirty_days_ago.strftime("%Y-%m-%d")
+    to_date = now.strftime("%Y-%m-%d")
+    
+    body = {
+        "input": {
+            "bounds": {"bbox": bbox},
+            "data": [{
+                "type": param_info["collection"],
+                "dataFilter": {
+                    "timeRange": {
+                        "from": f"{from_date}T00:00:00Z",
+                        "to": f"{to_date}T23:59:59Z"
+                    },
+                    "mosaickingOrder": "mostRecent"  # Cruciale: prende sempre l'immagine più recente
+                }
+            }]
+        },
+        "output": {
+            "width": WEATHER_GRID,
+            "height": WEATHER_GRID,
+            "responses": [{
+                "identifier": "default",
+                "format": {"type": "json"}
+            }]
+        },
+        "evalscript": WEATHER_EVALSCRIPTS[param_name]
+    }
+    
+    try:
+        response = await client.process(body)
+    except SentinelHubError as e:
+        print(f"❌ Errore di rete per {param_name}: {e}")
+        return None
+    
+    if not response.is_success:
+        print(f"❌ Errore API per {param_name}: {response.status_code}")
+        # Tenta di estrarre il messaggio di errore
+        try:
+            error_msg = response.json().get('error', response.text)
+            print(f"Dettaglio errore: {error_msg}")
+        except ValueError:
+            print(f"Contenuto risposta: {response.text[:200]}...")
+        return None
+    
+    # Verifica che la risposta sia JSON valido
+    content_type = response.headers.get('Content-Type', '')
+    if 'application/json' not in content_type:
+        print(f"⚠️ Risposta non in formato JSON per {param_name}: {content_type}")
+        return None
+    
+    # Elabora i dati ricevuti
+    data = response.json()
+    
+    # Verifica se ci sono dati disponibili
+    if not ("data" in data and data["data"] and len(data["data"]) > 0):
+        print(f"⚠️ Nessun dato disponibile per {param_name}")
+        return None
+    
+    values = data["data"][0]
+    if not values:
+        print(f"⚠️ Nessun valore valido per {param_name}")
+        return None
+    
+    # Ottieni l'ora di acquisizione se disponibile
+    acquisition_time = None
+    if "meta" in data and "timestamps" in data["meta"] and data["meta"]["timestamps"]:
+        # Estrai il timestamp dalla risposta API
+        acquisition_time = data["meta"]["timestamps"][0]
+    
+    # NaN e null nel JSON diventano NaN
+    grid = np.array(values, dtype=np.float32).reshape(WEATHER_GRID, WEATHER_GRID)
+    return grid, acquisition_time
+
+def store_weather_parameter(param_name, param_info, grid, acquisition_time):
+    """
+    Aggiunge la griglia di un parametro meteo al data cube locale e ne
+    restituisce la media nell'area (pixel validi), None se non ce ne sono.
+    """
+    cube = RasterCube(cube_dir, f"S2_{param_name}", bbox)
+    if acquisition_time is None:
+        # Senza istante di acquisizione la griglia non va nel cubo: l'ora
+        # corrente aggiungerebbe uno slot nuovo a ogni esecuzione
+        print(f"⚠️ Acquisizione di {param_name} senza timestamp, non aggiunta al data cube")
+        values = grid[cube.valid(grid)]
+        avg_value = float(values.mean()) if values.size else None
+    else:
+        cube.append(acquisition_time, grid)
+        avg_value = cube.bbox_stats(time=acquisition_time)["mean"]
+    if avg_value is None:
+        print(f"⚠️ Nessun valore valido per {param_name}")
+        return None
+    
+    print(f"✅ Parametro {param_name} recuperato - Timestamp: {acquisition_time}")
+    return {
+        "description": param_info["description"],
+        "value": avg_value,
+        "source": "Sentinel-2",
+        "acquisition_time": acquisition_time
+    }
+
+def cached_weather_parameter(param_name, param_info):
+    """Ultimo valore del parametro già presente nel data cube, senza rete."""
+    cube = RasterCube(cube_dir, f"S2_{param_name}", bbox)
+    stats = cube.bbox_stats()
+    if stats is None or stats["mean"] is None:
+        return None
+    print(f"ℹ️ Parametro {param_name} dal data cube locale - Timestamp: {stats['time']}")
+    return {
+        "description": param_info["description"],
+        "value": stats["mean"],
+        "source": "Sentinel-2",
+        "acquisition_time": f"{stats['time']}Z"
+    }
+
+async def get_sentinel_weather_data(client):
+    print("ℹ️ Recupero dati meteo da satellite (dati più recenti disponibili)...")
+    
+    # Dizionario di mapping tra i parametri meteo e le bande/indici Sentinel
+    params = {
+        "cloud_cover": {
+            "collection": "sentinel-2-l2a",
+            "band": "CLP",  # Cloud probability
+            "description": "Copertura nuvolosa"
+        },
+        "moisture": {
+            "collection": "sentinel-2-l2a", 
+            "band": "moisture",  # Calcolato dall'indice NDMI
+            "description": "Umidità terreno"
+        },
+        "surface_temperature": {
+            "collection": "sentinel-2-l1c",
+            "band": "B12",  # Banda infrarossa termica
+            "description": "Temperatura superficiale (correlata)"
+        }
+    }
+    
+    weather_data = {
+        "location": {
+            "latitude": lat,
+            "longitude": lon,
+            "name": "Bologna" if lat == 44.483619 and lon == 11.374042 else f"Custom({lat},{lon})"
+        },
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "data_collection_time": None,  # Sarà aggiornato con il timestamp effettivo dei dati
+        "parameters": {}
+    }
+    
+    # Ottieni i dati di tutti i parametri in parallelo
+    results = await asyncio.gather(*(
+        query_weather_parameter(param_name, param_info, client) for param_name, param_info in params.items()
+    ))
+    # Le scritture nel data cube sono I/O su disco: dopo i download, in un
+    # thread per non fermare le richieste dei gas ancora in corso
+    parameters = await asyncio.to_thread(lambda: [
+        store_weather_parameter(param_name, params[param_name], *result) if result is not None else None
+        for param_name, result in zip(params, results)
+    ])
+    for param_name, parameter in zip(params, parameters):
+        if parameter is None:
+            # Senza risposta si usa l'ultima acquisizione già scaricata
+            parameter = cached_weather_parameter(param_name, params[param_name])
+        if parameter is None:
+            continue
+        weather_data["parameters"][param_name] = parameter
+        # Aggiorna il campo data_collection_time se è più recente
+        acquisition_time = parameter["acquisition_time"]
+        if acquisition_time and (weather_data["data_collection_time"] is None or acquisition_time > weather_data["data_collection_time"]):
+            weather_data["data_collection_time"] = acquisition_time
 
     # Integriamo con i dati ERA5 in tempo reale per i parametri meteo non disponibili direttamente da Sentinel
-    era5_data = get_era5_realtime_data(token)
+    era5_data = get_era5_realtime_data()
     if era5_data:
         for param_name, param_data in era5_data.items():
             weather_data["parameters"][param_name] = param_data
@@ -399,7 +457,7 @@ def get_sentinel_weather_data(token):
     return weather_data
 
 # === RECUPERA DATI ERA5 DA COPERNICUS (VERSIONE TEMPO REALE) ===
-def get_era5_realtime_data(token):
+def get_era5_realtime_data():
     print("ℹ️ Recupero dati ERA5 più recenti disponibili...")
     
     # Trova la data più recente disponibile per ERA5-T
@@ -449,8 +507,9 @@ def get_era5_realtime_data(token):
     return era5_params
 
 # === OTTIENI ANCHE DATI STANDARD OPEN-METEO PER CONFRONTO ===
-def get_openmeteo_weather_data():
+def get_openmeteo_weather_data(day):
     print("ℹ️ Recupero dati meteo da Open-Meteo per confronto...")
+    date_str = day.isoformat()
     url = f"https://archive-api.open-meteo.com/v1/archive"
     params = {
         "latitude": lat,
@@ -522,21 +581,47 @@ def get_openmeteo_weather_data():
         return None
 
 # === ESECUZIONE ===
-print("\n=== 🛰️ Raccolta dati ambientali da satelliti ===\n")
-
-# Recupera token Sentinel Hub
-token = get_sentinel_token()
-if token:
-    # Recupera dati inquinanti da Sentinel-5P
-    for gas in ["NO2", "CO", "O3"]:
-        query_sentinel_5p_gas(gas, token)
-    
-    # Recupera dati meteo da Sentinel-2 e Copernicus ERA5
-    sentinel_weather = get_sentinel_weather_data(token)
+async def refresh_environment():
+    """
+    Gas, meteo Sentinel-2 e Open-Meteo in parallelo sulla stessa sessione:
+    il tempo totale è circa quello della richiesta più lenta.
+    """
+    index = AvailabilityIndex(availability_path)
+    async with sentinel_client() as client:
+        # Recupera token Sentinel Hub
+        try:
+            await client.token()
+        except SentinelHubError as e:
+            print(f"❌ {e}")
+            print("❌ Impossibile procedere senza token Sentinel Hub valido")
+            return False
+        
+        # Ottieni l'ultima data disponibile
+        day, availability_refresh = await get_latest_available_date(client, index)
+        print(f"Utilizzo dati per: lat={lat}, lon={lon}, data={day.isoformat()}")
+        
+        # Recupera dati inquinanti da Sentinel-5P, meteo da Sentinel-2 e
+        # Copernicus ERA5 e, per confronto, da Open-Meteo
+        gases, sentinel_weather, openmeteo_weather = await asyncio.gather(
+            asyncio.gather(*(query_sentinel_5p_gas(gas, client, day) for gas in GASES)),
+            get_sentinel_weather_data(client),
+            asyncio.to_thread(get_openmeteo_weather_data, day),
+        )
+        # L'indice si aggiorna dal catalogo mentre si scaricano i dati,
+        # il risultato vale dalla prossima esecuzione
+        if availability_refresh is not None:
+            await availability_refresh
     
-    # Ottieni anche dati Open-Meteo per confronto
-    openmeteo_weather = get_openmeteo_weather_data()
+    # Griglie dei gas nel data cube; le mappe PNG sono un passo separato
+    # e facoltativo (render_maps.py)
+    for gas, content in zip(GASES, gases):
+        if content is not None:
+            store_gas_data(gas, content, day, index)
+    index.save()
+    return True
+
+if __name__ == "__main__":
+    print("\n=== 🛰️ Raccolta dati ambientali da satelliti ===\n")
     
-    print("\n✅ Elaborazione completata.")
-else:
-    print("❌ Impossibile procedere senza token Sentinel Hub valido")
+    if asyncio.run(refresh_environment()):
+        print("\n✅ Elaborazione completata.")
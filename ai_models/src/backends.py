@@ -0,0 +1,58 @@
+"""
+Backend di inferenza su CPU, comuni a Whisper e BLIP.
+
+- "fp32": PyTorch a precisione piena, come in origine (anche su GPU)
+- "int8": quantizzazione dinamica dei layer Linear (pesi int8, attivazioni
+  quantizzate al volo), solo CPU
+- "torchscript": l'encoder (audio o immagine) esportato con torch.jit.trace
+  e congelato; il decoder resta in PyTorch perché la generazione token per
+  token (beam search, kv-cache) non si presta al tracing. Solo CPU.
+
+Il backend si sceglie per modello con AIRA_WHISPER_BACKEND e
+AIRA_BLIP_BACKEND, i thread intra-op con AIRA_THREADS (0 = default di
+PyTorch, un thread per core).
+"""
+import os
+import warnings
+import torch
+from torch.ao.quantization import quantize_dynamic
+
+BACKENDS = ("fp32", "int8", "torchscript")
+# Thread intra-op di PyTorch per l'inferenza su CPU
+THREADS = int(os.environ.get("AIRA_THREADS", 0))
+
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend sconosciuto: {backend} (disponibili: {', '.join(BACKENDS)})")
+
+
+def set_threads(threads=THREADS):
+    """Imposta i thread intra-op (0 lascia il default)."""
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def quantize_int8(model):
+    """Quantizzazione dinamica int8 dei layer nn.Linear del modello."""
+    with warnings.catch_warnings():
+        # l'API eager è deprecata a favore di torchao, non ancora tra le dipendenze
+        warnings.simplefilter("ignore")
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def trace(module, example, check_inputs=None):
+    """
+    Esporta `module` in TorchScript con un input di esempio e lo congela.
+
+    Con `check_inputs` (lista di tuple di input di altre forme, es. altre
+    dimensioni del batch) il modulo esportato viene eseguito anche su
+    questi e confrontato con l'originale: una forma fissata per errore
+    durante il tracing fa fallire il caricamento (TracingCheckError)
+    invece di produrre risultati sbagliati.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            module.eval(), example, check_trace=check_inputs is not None, check_inputs=check_inputs
+        )
+        return torch.jit.freeze(traced.eval())
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """
+    Raggruppa le richieste che arrivano insieme in un'unica chiamata batch.
+
+    La prima richiesta in coda apre una finestra di `window_ms`: tutto ciò
+    che arriva entro la finestra (fino a `max_batch` elementi) viene passato
+    in una sola chiamata a `fn`, eseguita in un thread. `fn` riceve la lista
+    degli input e restituisce la lista dei risultati nello stesso ordine;
+    ogni chiamante riceve il proprio. Un errore di `fn` viene propagato a
+    tutte le richieste del batch.
+    """
+
+    def __init__(self, fn, max_batch=8, window_ms=20.0):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def submit(self, item):
+        """Accoda un input e attende il suo risultato."""
+        if self._worker is None or self._worker.done():
+            # la coda appartiene all'event loop in cui è stata creata
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # le richieste già annullate (client disconnessi) non vengono calcolate
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            try:
+                results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else None,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,216 @@
+"""
+Benchmark di Whisper e BLIP sui file di esempio (ai_models/audio/* e
+ai_models/img/*).
+
+Ogni configurazione della griglia (modello, backend, thread e, per Whisper,
+beam_size) gira in un processo separato, così tempo di caricamento e picco
+di memoria sono solo suoi. Dopo il warm-up ogni file viene elaborato
+`repeats` volte; si riportano latenza p50/p95, real-time factor per l'audio
+(tempo di inferenza / durata dell'audio), picco RSS e tempo di caricamento.
+
+I risultati sono scritti in JSON con il commit git corrente, per
+confrontare le prestazioni tra commit (--baseline con un risultato
+precedente stampa le variazioni di p50).
+
+Dalla cartella ai_models:
+    python src/benchmark.py --beam_sizes 1,5 --threads 1,4
+    python src/benchmark.py --baseline data/benchmarks/benchmark_20250601_120000_abc1234.json
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import backends
+import ingest
+from compare_backends import peak_rss_mb
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_FILES = os.path.join(BASE_DIR, "audio", "*")
+IMAGE_FILES = os.path.join(BASE_DIR, "img", "*")
+OUTPUT_DIR = os.path.join(BASE_DIR, "data", "benchmarks")
+
+
+def percentiles(values):
+    return {
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+    }
+
+
+def run_config(config, warmup, repeats):
+    """Misura una configurazione (nel processo worker)."""
+    started = time.perf_counter()
+    if config["pipeline"] == "whisper":
+        import whisper_model
+        model = whisper_model.load_model(config["model"], backend=config["backend"], threads=config["threads"])
+        load_seconds = time.perf_counter() - started
+        inputs = {}
+        for path in sorted(glob.glob(AUDIO_FILES)):
+            with open(path, "rb") as f:
+                inputs[path] = ingest.decode_audio(f.read())
+        durations = {path: len(audio) / whisper_model.SAMPLE_RATE for path, audio in inputs.items()}
+        infer = lambda audio: whisper_model.transcribe(model, audio, config["beam_size"])
+    else:
+        import blip_model
+        processor, model = blip_model.load_model(config["model"], backend=config["backend"], threads=config["threads"])
+        load_seconds = time.perf_counter() - started
+        inputs = {}
+        for path in sorted(glob.glob(IMAGE_FILES)):
+            with open(path, "rb") as f:
+                inputs[path] = blip_model.open_image(f.read(), processor)
+        durations = None
+        infer = lambda image: blip_model.caption(processor, model, image)
+
+    for _ in range(warmup):
+        infer(next(iter(inputs.values())))
+
+    latencies, rtf, files = [], [], {}
+    for path, data in inputs.items():
+        file_latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            infer(data)
+            file_latencies.append(time.perf_counter() - started)
+        latencies += file_latencies
+        files[os.path.basename(path)] = {"latency_s": percentiles(file_latencies)}
+        if durations:
+            files[os.path.basename(path)]["audio_seconds"] = round(durations[path], 2)
+            rtf += [latency / durations[path] for latency in file_latencies]
+
+    result = {
+        "load_seconds": round(load_seconds, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "latency_s": percentiles(latencies),
+        "files": files,
+    }
+    if rtf:
+        result["rtf"] = percentiles(rtf)
+    return result
+
+
+def configs(args):
+    """Griglia delle configurazioni da misurare."""
+    grid = []
+    if "whisper" in args.pipelines:
+        for model, backend, threads, beam_size in itertools.product(
+            args.whisper_models, args.backends, args.threads, args.beam_sizes
+        ):
+            grid.append({"pipeline": "whisper", "model": model, "backend": backend,
+                         "threads": threads, "beam_size": beam_size})
+    if "blip" in args.pipelines:
+        for model, backend, threads in itertools.product(args.blip_models, args.backends, args.threads):
+            grid.append({"pipeline": "blip", "model": model, "backend": backend, "threads": threads})
+    return grid
+
+
+def git_commit():
+    """Commit corrente (con "-dirty" se ci sono modifiche), None fuori da git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def config_label(config):
+    return " ".join(f"{key}={value}" for key, value in config.items())
+
+
+def compare(results, baseline_path):
+    """Variazione di p50 rispetto a un benchmark precedente, per le configurazioni comuni."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {json.dumps(entry["config"], sort_keys=True): entry for entry in baseline["results"]}
+    print(f"\nRispetto a {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for entry in results:
+        old = previous.get(json.dumps(entry["config"], sort_keys=True))
+        if old is None or "latency_s" not in old or "latency_s" not in entry:
+            continue
+        before, after = old["latency_s"]["p50"], entry["latency_s"]["p50"]
+        print(f"  {config_label(entry['config'])}: p50 {before:.3f} s -> {after:.3f} s "
+              f"({(after - before) / before * 100:+.1f}%)")
+
+
+def main(args):
+    results = []
+    for config in configs(args):
+        command = [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config),
+                   "--warmup", str(args.warmup), "--repeats", str(args.repeats)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{config_label(config)}: fallito\n{completed.stderr.strip()[-500:]}")
+            results.append({"config": config, "error": completed.stderr.strip()[-500:]})
+            continue
+        # il worker scrive il risultato come ultima riga
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append({"config": config, **result})
+        print(f"{config_label(config)}: load {result['load_seconds']:.2f} s  "
+              f"p50 {result['latency_s']['p50']:.3f} s  p95 {result['latency_s']['p95']:.3f} s  "
+              + (f"RTF p50 {result['rtf']['p50']:.3f}  " if "rtf" in result else "")
+              + f"picco RSS {result['peak_rss_mb']:.1f} MB")
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "warmup": args.warmup,
+        "repeats": args.repeats,
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        name = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json"
+        output = os.path.join(OUTPUT_DIR, name)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Risultati in {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+def csv_list(cast=str):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark di Whisper e BLIP sui file di esempio")
+    parser.add_argument("--pipelines", type=csv_list(), default=["whisper", "blip"],
+                        help="Pipeline da misurare (default: whisper,blip)")
+    parser.add_argument("--whisper_models", type=csv_list(), default=[os.environ.get("AIRA_WHISPER_MODEL", "tiny")],
+                        help="Modelli Whisper, es. tiny,base (default: tiny)")
+    parser.add_argument("--blip_models", type=csv_list(),
+                        default=[os.environ.get("AIRA_BLIP_MODEL", "Salesforce/blip-image-captioning-base")],
+                        help="Modelli BLIP (default: Salesforce/blip-image-captioning-base)")
+    parser.add_argument("--backends", type=csv_list(), default=["fp32"],
+                        help=f"Backend di inferenza tra {','.join(backends.BACKENDS)} (default: fp32)")
+    parser.add_argument("--threads", type=csv_list(int), default=[backends.THREADS],
+                        help="Thread intra-op, 0 = uno per core (default: 0)")
+    parser.add_argument("--beam_sizes", type=csv_list(int), default=[5],
+                        help="Beam di Whisper (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="Esecuzioni di warm-up per configurazione (default: 1)")
+    parser.add_argument("--repeats", type=int, default=3, help="Ripetizioni per file (default: 3)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="File JSON dei risultati (default: data/benchmarks/benchmark_<data>_<commit>.json)")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Benchmark precedente con cui confrontare le latenze")
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_config(json.loads(args.worker), args.warmup, args.repeats)))
+    else:
+        for backend in args.backends:
+            backends.check_backend(backend)
+        main(args)
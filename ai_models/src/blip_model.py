@@ -0,0 +1,98 @@
+import os
+import torch
+from transformers import BlipForConditionalGeneration, BlipProcessor
+import backends
+import ingest
+
+# Modello BLIP di default, sovrascrivibile con la variabile AIRA_BLIP_MODEL
+MODEL_NAME = os.environ.get("AIRA_BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+# Backend di inferenza (fp32, int8, torchscript), vedi backends.py
+BACKEND = os.environ.get("AIRA_BLIP_BACKEND", "fp32")
+# Batch massimo passato al modello (il MicroBatcher del server), l'encoder
+# del backend torchscript viene esportato con questo batch
+MAX_BATCH = int(os.environ.get("AIRA_BLIP_MAX_BATCH", 8))
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_model(name=MODEL_NAME, device=None, backend=BACKEND, threads=backends.THREADS, max_batch=MAX_BATCH):
+    """
+    Carica processor e modello BLIP, il modello in modalità eval con il backend scelto.
+
+    Con torchscript l'encoder visivo è esportato con un batch di
+    `max_batch` immagini e verificato su batch più piccoli, quelli che il
+    micro-batching produce con poco traffico.
+    """
+    backends.check_backend(backend)
+    backends.set_threads(threads)
+    # int8 e torchscript sono backend per CPU
+    device = torch.device("cpu") if backend != "fp32" else device or get_device()
+    processor = BlipProcessor.from_pretrained(name)
+    model = BlipForConditionalGeneration.from_pretrained(name).to(device)
+    model.eval()
+    if backend == "int8":
+        model = backends.quantize_int8(model)
+    elif backend == "torchscript":
+        size = model.config.vision_config.image_size
+        checks = [(torch.rand(batch, 3, size, size),) for batch in sorted({1, max(max_batch // 2, 2)})]
+        traced = backends.trace(
+            _VisionEncoder(model.vision_model), torch.zeros(max_batch, 3, size, size), check_inputs=checks
+        )
+        model.vision_model = _TracedVision(traced)
+    return processor, model
+
+
+class _VisionEncoder(torch.nn.Module):
+    """Encoder visivo con input e output tensoriali, per il tracing."""
+
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class _TracedVision(torch.nn.Module):
+    """Encoder visivo esportato, chiamato da generate come il vision_model originale."""
+
+    def __init__(self, traced):
+        super().__init__()
+        self.traced = traced
+
+    def forward(self, pixel_values, interpolate_pos_encoding=False):
+        return (self.traced(pixel_values),)
+
+
+def open_image(data, processor=None):
+    """
+    Apre un'immagine da byte o stream (ValueError se non è un'immagine).
+
+    Con il processor i JPEG sono decodificati già ridotti verso la
+    risoluzione di input del modello.
+    """
+    size = None
+    if processor is not None:
+        size = (processor.image_processor.size["width"], processor.image_processor.size["height"])
+    return ingest.decode_image(data, size=size)
+
+
+def caption(processor, model, image):
+    """Descrive un'immagine PIL con un modello già caricato."""
+    return caption_batch(processor, model, [image])[0]
+
+
+def caption_batch(processor, model, images):
+    """
+    Descrive più immagini con una sola chiamata a `generate`.
+
+    Il processor porta tutte le immagini alla stessa risoluzione, le
+    didascalie più corte vengono completate con padding e ripulite da
+    `batch_decode`.
+    """
+    inputs = processor(images=list(images), return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+        output = model.generate(**inputs)
+    return processor.batch_decode(output, skip_special_tokens=True)
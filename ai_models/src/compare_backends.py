@@ -0,0 +1,153 @@
+"""
+Confronta i backend di inferenza (fp32, int8, torchscript) di Whisper e BLIP
+sui file di esempio in ai_models/audio e ai_models/img.
+
+Ogni combinazione modello/backend gira in un processo separato, così la
+memoria misurata è solo la sua. Per ogni backend riporta tempo di
+caricamento, latenza mediana per file, memoria residente a regime e di
+picco (il picco include il caricamento dei pesi fp32) e accordo con
+fp32: trascrizioni o didascalie identiche e similarità media a parole.
+
+Dalla cartella ai_models:
+    python src/compare_backends.py --threads 4 --output data/backends.json
+"""
+import argparse
+import difflib
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import backends
+import ingest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = {
+    "whisper": os.path.join(BASE_DIR, "audio", "*"),
+    "blip": os.path.join(BASE_DIR, "img", "*"),
+}
+
+
+def rss_mb():
+    """Memoria residente attuale (Linux)."""
+    with open("/proc/self/statm") as f:
+        return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def peak_rss_mb():
+    # ru_maxrss è in KB su Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_worker(model_name, backend, threads, repeats, beam_size):
+    """Carica un modello con un backend e misura ogni file di esempio."""
+    started = time.perf_counter()
+    if model_name == "whisper":
+        import whisper_model
+        model = whisper_model.load_model(backend=backend, threads=threads)
+        inputs = {
+            path: ingest.decode_audio(open(path, "rb").read())
+            for path in sorted(glob.glob(SAMPLES["whisper"]))
+        }
+        infer = lambda audio: whisper_model.transcribe(model, audio, beam_size)["text"].strip()
+    else:
+        import blip_model
+        processor, model = blip_model.load_model(backend=backend, threads=threads)
+        inputs = {
+            path: blip_model.open_image(open(path, "rb").read(), processor)
+            for path in sorted(glob.glob(SAMPLES["blip"]))
+        }
+        infer = lambda image: blip_model.caption(processor, model, image)
+    load_seconds = time.perf_counter() - started
+    load_rss = peak_rss_mb()
+
+    # warm-up sul primo file
+    infer(next(iter(inputs.values())))
+    files = {}
+    for path, data in inputs.items():
+        latencies = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            output = infer(data)
+            latencies.append(time.perf_counter() - started)
+        files[os.path.basename(path)] = {
+            "output": output,
+            "latency_ms": round(float(np.median(latencies)) * 1000, 1),
+        }
+    return {
+        "load_seconds": round(load_seconds, 2),
+        "load_peak_rss_mb": load_rss,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+        "files": files,
+    }
+
+
+def similarity(a, b):
+    return difflib.SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+def agreement(reference, result):
+    """Accordo delle uscite di un backend con quelle di riferimento (fp32)."""
+    pairs = [(reference["files"][name]["output"], values["output"]) for name, values in result["files"].items()]
+    return {
+        "identical": sum(a == b for a, b in pairs),
+        "files": len(pairs),
+        "word_similarity": round(float(np.mean([similarity(a, b) for a, b in pairs])), 3),
+    }
+
+
+def main(args):
+    results = {}
+    for model_name in args.models:
+        results[model_name] = {}
+        for backend in args.backends:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker", model_name, backend,
+                "--threads", str(args.threads), "--repeats", str(args.repeats), "--beam_size", str(args.beam_size),
+            ]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{model_name}/{backend}: fallito\n{completed.stderr.strip()[-500:]}")
+                continue
+            # il worker scrive il risultato come ultima riga
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result["mean_latency_ms"] = round(float(np.mean([f["latency_ms"] for f in result["files"].values()])), 1)
+            results[model_name][backend] = result
+
+        reference = results[model_name].get("fp32")
+        for backend, result in results[model_name].items():
+            if reference is not None:
+                result["agreement_with_fp32"] = agreement(reference, result)
+            match = result.get("agreement_with_fp32")
+            print(f"{model_name:8s} {backend:12s} load {result['load_seconds']:6.2f} s  "
+                  f"latenza media {result['mean_latency_ms']:9.1f} ms  RSS {result['rss_mb']:8.1f} MB (picco {result['peak_rss_mb']:.1f})"
+                  + (f"  identici {match['identical']}/{match['files']}  similarità {match['word_similarity']}"
+                     if match else ""))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confronto dei backend di inferenza di Whisper e BLIP")
+    parser.add_argument("--models", type=lambda s: s.split(","), default=["whisper", "blip"],
+                        help="Modelli da confrontare (default: whisper,blip)")
+    parser.add_argument("--backends", type=lambda s: s.split(","), default=list(backends.BACKENDS),
+                        help=f"Backend da confrontare (default: {','.join(backends.BACKENDS)})")
+    parser.add_argument("--threads", type=int, default=backends.THREADS,
+                        help="Thread intra-op, 0 = uno per core (default: 0)")
+    parser.add_argument("--repeats", type=int, default=3, help="Ripetizioni per file, si riporta la mediana (default: 3)")
+    parser.add_argument("--beam_size", type=int, default=5, help="Beam di Whisper (default: 5)")
+    parser.add_argument("--output", type=str, default=None, help="File JSON in cui salvare i risultati")
+    parser.add_argument("--worker", nargs=2, metavar=("MODEL", "BACKEND"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        backends.check_backend(args.worker[1])
+        print(json.dumps(run_worker(args.worker[0], args.worker[1], args.threads, args.repeats, args.beam_size)))
+    else:
+        main(args)
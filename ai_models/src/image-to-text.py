@@ -1,38 +1,27 @@
-from PIL import Image
-import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
 import sys
 import os
 import json
 import time
 from datetime import datetime
-
-# Check for CUDA availability and set device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+import blip_model
+from result_cache import ResultCache
 
 # Directory di output per i risultati JSON
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Cache su disco dei risultati: un'immagine già descritta non viene ricalcolata
+CACHE_DIR = os.environ.get("AIRA_CACHE_DIR") or os.path.join(OUTPUT_DIR, "cache")
 
-# Inizializza modello e processor BLIP
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-model = model.to(device)  # Move model to GPU
-
-def describe_image(image_path):
-    if not os.path.exists(image_path):
-        return None
+# Modello e processor BLIP (GPU se disponibile), caricati al primo uso
+processor, model = None, None
 
+def describe_image(data):
+    """Descrive un'immagine dai suoi byte (o da uno stream), None se non valida."""
+    global processor, model
     try:
-        image = Image.open(image_path).convert('RGB')
-        inputs = processor(images=image, return_tensors="pt")
-        
-        # Move input tensors to GPU
-        for k, v in inputs.items():
-            inputs[k] = v.to(device)
-            
-        output = model.generate(**inputs)
-        caption = processor.decode(output[0], skip_special_tokens=True)
-        return caption
+        if model is None:
+            processor, model = blip_model.load_model()
+        image = blip_model.open_image(data, processor)
+        return blip_model.caption(processor, model, image)
     except Exception as e:
         return None
 
@@ -66,11 +55,28 @@ if __name__ == "__main__":
     if len(sys.argv) != 2:
         sys.exit(1)
 
-    image_path = "img/" + sys.argv[1]
+    # "-" legge l'immagine dallo standard input
+    if sys.argv[1] == "-":
+        image_path = "stdin"
+        data = sys.stdin.buffer.read()
+    else:
+        image_path = "img/" + sys.argv[1]
+        if not os.path.exists(image_path):
+            sys.exit(1)
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    
+    # Stessa immagine, modello e backend: il JSON esiste già
+    cache = ResultCache(directory=CACHE_DIR)
+    key = ResultCache.key(data, blip_model.MODEL_NAME, backend=blip_model.BACKEND)
+    cached = cache.get(key)
+    if cached and os.path.exists(cached.get("json_path", "")):
+        sys.exit(0)
     
     start_time = time.time()
-    caption = describe_image(image_path)
+    caption = describe_image(data)
     elapsed_time = time.time() - start_time
     
     if caption:
-        save_to_json(caption, image_path, elapsed_time)
\ No newline at end of file
+        json_path = save_to_json(caption, image_path, elapsed_time)
+        cache.put(key, {"caption": caption, "json_path": json_path})
\ No newline at end of file
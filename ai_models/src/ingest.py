@@ -0,0 +1,195 @@
+"""
+Ingest degli upload: byte (o uno stream) in memoria -> campioni audio e
+immagini pronte per i modelli, senza file temporanei.
+
+L'audio è decodificato nel processo con PyAV (le librerie di ffmpeg) da un
+BytesIO, quindi anche gli m4a con l'indice in fondo si leggono senza
+scriverli su disco, e i campioni a 16 kHz float32 finiscono direttamente in
+un buffer riusato tra le richieste. Senza PyAV si ripiega sul processo
+ffmpeg. Gli input troppo lunghi o troppo grandi sono rifiutati dalle
+intestazioni, prima di decodificare.
+"""
+import io
+import os
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Frequenza di campionamento attesa da Whisper (16 kHz)
+SAMPLE_RATE = 16000
+# Durata massima di un audio e dimensione massima di un'immagine
+MAX_AUDIO_SECONDS = float(os.environ.get("AIRA_MAX_AUDIO_SECONDS", 600))
+MAX_IMAGE_PIXELS = int(float(os.environ.get("AIRA_MAX_IMAGE_MEGAPIXELS", 64)) * 1e6)
+
+
+class TooLarge(ValueError):
+    """Input oltre i limiti di durata o dimensione."""
+
+
+class AudioBuffer:
+    """Buffer float32 riusabile, cresce solo quando un audio non ci sta."""
+
+    def __init__(self, capacity=0):
+        self.array = np.empty(capacity, dtype=np.float32)
+
+    def reserve(self, size, keep=0):
+        """Garantisce almeno `size` campioni, conservando i primi `keep`."""
+        if size > len(self.array):
+            grown = np.empty(max(size, 2 * len(self.array)), dtype=np.float32)
+            grown[:keep] = self.array[:keep]
+            self.array = grown
+        return self.array
+
+
+class BufferPool:
+    """Pool di AudioBuffer: una richiesta ne prende uno e lo restituisce alla fine."""
+
+    def __init__(self, max_free=4, capacity=30 * SAMPLE_RATE):
+        self.max_free = max_free
+        self.capacity = capacity
+        self._free = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def buffer(self):
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+        if buffer is None:
+            buffer = AudioBuffer(self.capacity)
+        try:
+            yield buffer
+        finally:
+            with self._lock:
+                if len(self._free) < self.max_free:
+                    self._free.append(buffer)
+
+
+# buffer dei campioni condivisi dalle richieste del processo
+audio_buffers = BufferPool()
+
+
+def _as_file(source):
+    """Oggetto file su byte o stream (BytesIO non copia i byte)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def decode_audio(source, buffer=None, max_seconds=MAX_AUDIO_SECONDS):
+    """
+    Decodifica un audio (mp3, m4a, ogg...) da byte o stream in campioni
+    float32 mono a 16 kHz.
+
+    Con `buffer` (un AudioBuffer) i campioni sono scritti nel suo array e il
+    risultato è una vista su di esso, valida finché il buffer non viene
+    riusato. ValueError se l'input non è audio, TooLarge se supera
+    `max_seconds`.
+    """
+    buffer = buffer or AudioBuffer()
+    if av is None:
+        data = source if isinstance(source, (bytes, bytearray, memoryview)) else source.read()
+        samples = _decode_ffmpeg(bytes(data))
+        if len(samples) > max_seconds * SAMPLE_RATE:
+            raise TooLarge(f"Audio oltre {max_seconds:g} s")
+        array = buffer.reserve(len(samples))
+        array[:len(samples)] = samples
+        return array[:len(samples)]
+
+    try:
+        container = av.open(_as_file(source), mode="r")
+    except av.FFmpegError as e:
+        raise ValueError(f"Audio non decodificabile: {e}")
+    with container:
+        if not container.streams.audio:
+            raise ValueError("Audio non decodificabile: nessuna traccia audio")
+        # la durata dichiarata dal contenitore basta per rifiutare e per dimensionare
+        duration = container.duration / av.time_base if container.duration else None
+        if duration and duration > max_seconds:
+            raise TooLarge(f"Audio oltre {max_seconds:g} s ({duration:.0f} s)")
+        max_samples = int(max_seconds * SAMPLE_RATE)
+        array = buffer.reserve(int((duration or 30) * SAMPLE_RATE) + SAMPLE_RATE)
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+        length = 0
+        try:
+            for frame in _with_flush(container.decode(container.streams.audio[0])):
+                for resampled in resampler.resample(frame):
+                    samples = resampled.to_ndarray()[0]
+                    if length + len(samples) > max_samples:
+                        raise TooLarge(f"Audio oltre {max_seconds:g} s")
+                    array = buffer.reserve(length + len(samples), keep=length)
+                    array[length:length + len(samples)] = samples
+                    length += len(samples)
+        except av.FFmpegError as e:
+            raise ValueError(f"Audio non decodificabile: {e}")
+    if not length:
+        raise ValueError("Audio non decodificabile: nessun campione in uscita")
+    return array[:length]
+
+
+def _with_flush(frames):
+    # None a fine flusso svuota il resampler
+    yield from frames
+    yield None
+
+
+def _decode_ffmpeg(data):
+    """Decodifica con il processo ffmpeg (senza PyAV)."""
+    out = _run_ffmpeg("pipe:0", data)
+    if not out:
+        # i contenitori con l'indice in fondo (m4a/mp4) non si leggono da una pipe
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            out = _run_ffmpeg(f.name)
+    if not out:
+        raise ValueError("Audio non decodificabile: nessun campione in uscita")
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+def _run_ffmpeg(source, data=None):
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", source,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1",
+    ]
+    try:
+        return subprocess.run(command, input=data, capture_output=True, check=True).stdout
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg non trovato: installare PyAV o ffmpeg per decodificare l'audio")
+    except subprocess.CalledProcessError as e:
+        if source == "pipe:0":
+            # ritenta dal file: l'errore può dipendere dalla pipe
+            return b""
+        raise ValueError(f"Audio non decodificabile: {e.stderr.decode(errors='ignore').strip()[-200:]}")
+
+
+def decode_image(source, max_pixels=MAX_IMAGE_PIXELS, size=None):
+    """
+    Apre un'immagine da byte o stream e la converte in RGB.
+
+    Dimensioni e formato si leggono dall'intestazione: un'immagine oltre
+    `max_pixels` è rifiutata prima di decodificarla. Con `size` (larghezza,
+    altezza di input del modello) i JPEG vengono decodificati già ridotti,
+    alla scala più piccola non inferiore a `size`.
+    ValueError se l'input non è un'immagine valida, TooLarge se è troppo grande.
+    """
+    try:
+        image = Image.open(_as_file(source))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Immagine non valida: {e}")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise TooLarge(f"Immagine oltre {max_pixels / 1e6:g} megapixel ({width}x{height})")
+    if size:
+        image.draft("RGB", size)
+    try:
+        return image.convert("RGB")
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Immagine non valida: {e}")
@@ -0,0 +1,97 @@
+"""
+Misura throughput e latenza (p50/p99) di BLIP con e senza micro-batching.
+
+`concurrency` client inviano ciascuno una richiesta dopo l'altra, fino a
+`requests` richieste in tutto, usando le immagini di ai_models/img. Il
+percorso "single" è quello attuale (un generate per immagine, una alla
+volta), "batched" passa dal MicroBatcher del server.
+
+Dalla cartella ai_models:
+    python src/measure_batching.py --requests 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+import blip_model
+from batcher import MicroBatcher
+
+IMG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "img")
+
+
+async def run_load(caption_one, images, requests, concurrency):
+    """Latenze di ogni richiesta (s) e durata totale (s)."""
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            await caption_one(images[i % len(images)])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return np.array(latencies), time.perf_counter() - started
+
+
+def summary(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+    }
+
+
+async def main(args):
+    processor, model = blip_model.load_model(max_batch=args.max_batch)
+    images = [
+        blip_model.open_image(open(path, "rb").read())
+        for path in sorted(glob.glob(os.path.join(IMG_DIR, "*")))
+    ]
+    lock = threading.Lock()
+
+    def single(image):
+        with lock:
+            return blip_model.caption(processor, model, image)
+
+    def batch(batch_images):
+        with lock:
+            return blip_model.caption_batch(processor, model, batch_images)
+
+    # warm-up di entrambi i percorsi
+    single(images[0])
+    batch(images[:1] * args.max_batch)
+
+    results = {}
+    latencies, elapsed = await run_load(
+        lambda image: asyncio.to_thread(single, image), images, args.requests, args.concurrency
+    )
+    results["single"] = summary(latencies, elapsed)
+
+    batcher = MicroBatcher(batch, max_batch=args.max_batch, window_ms=args.window_ms)
+    latencies, elapsed = await run_load(batcher.submit, images, args.requests, args.concurrency)
+    await batcher.close()
+    results["batched"] = {**summary(latencies, elapsed), **batcher.stats()}
+
+    for name, values in results.items():
+        print(f"{name:8s} {values['throughput_per_s']:7.2f} img/s  "
+              f"p50 {values['p50_ms']:8.1f} ms  p99 {values['p99_ms']:8.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching di BLIP contro il percorso a immagine singola")
+    parser.add_argument("--requests", type=int, default=64, help="Richieste totali (default: 64)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Client concorrenti (default: 16)")
+    parser.add_argument("--max_batch", type=int, default=8, help="Dimensione massima del batch (default: 8)")
+    parser.add_argument("--window_ms", type=float, default=20.0, help="Finestra di raccolta in ms (default: 20)")
+    parser.add_argument("--output", type=str, default=None, help="File JSON in cui salvare i risultati")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+"""
+Cache dei risultati indicizzata per contenuto.
+
+La chiave è lo SHA-256 dei byte ricevuti più il nome del modello e i
+parametri che cambiano il risultato (beam_size, backend...): la stessa foto
+o nota vocale inviata di nuovo, anche da un altro dispositivo, trova il
+risultato già calcolato.
+
+Due livelli: un LRU in memoria e, se è indicata una cartella, un livello su
+disco (un file JSON per chiave) che sopravvive ai riavvii e ai processi CLI,
+con i file usati meno di recente rimossi oltre `max_disk_mb`. `get` e `put`
+leggono e scrivono su disco: da una coroutine si chiamano con
+asyncio.to_thread (sono thread-safe).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Cache LRU a due livelli (memoria e disco opzionale) per risultati JSON.
+
+    Parameters:
+    -----------
+    max_items : int
+        Risultati tenuti in memoria (0 disattiva il livello in memoria)
+    directory : str, optional
+        Cartella del livello su disco (None = solo memoria)
+    max_disk_mb : float
+        Spazio massimo occupato su disco
+    """
+
+    def __init__(self, max_items=1024, directory=None, max_disk_mb=256):
+        self.max_items = max_items
+        self.directory = directory
+        self.max_disk_bytes = int(max_disk_mb * 2**20)
+        self._memory = OrderedDict()
+        # chiave -> dimensione del file, dal meno al più recente
+        self._disk = OrderedDict()
+        self.disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(data, model, **params):
+        """Chiave del risultato: hash dei byte, del modello e dei parametri."""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps([model, params], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Risultato in cache per `key`, None se assente."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return self._memory[key]
+            if key in self._disk:
+                try:
+                    with open(self._path(key), encoding="utf-8") as f:
+                        value = json.load(f)
+                except (OSError, ValueError):
+                    # file rimosso o troncato: si ricalcola
+                    self.disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    os.utime(self._path(key))
+                    self._remember(key, value)
+                    self.hits_disk += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Salva un risultato (serializzabile in JSON)."""
+        with self._lock:
+            self._remember(key, value)
+            if self.directory:
+                self._write(key, value)
+
+    def _remember(self, key, value):
+        if self.max_items <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _write(self, key, value):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        # scrittura atomica: un lettore non vede mai un file a metà
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        self.disk_bytes += len(data) - self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        while self.disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            old, size = self._disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+
+    def _scan_disk(self):
+        """Ricostruisce l'indice del livello su disco, in ordine di ultimo uso."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self.disk_bytes += size
+
+    def stats(self):
+        hits = self.hits_memory + self.hits_disk
+        lookups = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "memory_items": len(self._memory),
+            "disk_items": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+        }
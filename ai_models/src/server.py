@@ -0,0 +1,419 @@
+"""
+Server di inferenza per Whisper (trascrizione) e BLIP (descrizione immagini).
+
+I modelli vengono caricati una sola volta per processo e scaldati con un
+input fittizio, così nessuna richiesta paga il caricamento. Le richieste
+inviano i byte del file direttamente nel body (nessun multipart, nessun
+file su disco).
+
+Avvio dalla cartella ai_models:
+    uvicorn server:app --app-dir src --host 0.0.0.0 --port 8001
+
+Esempi:
+    curl --data-binary @audio/prova.mp3 localhost:8001/transcribe
+    curl --data-binary @img/dog.jpg localhost:8001/caption
+    curl -H "Content-Type: application/json" localhost:8001/triage \
+        -d '{"audio": "<base64>", "images": ["<base64>"], "location": {"latitude": 41.9, "longitude": 12.5}}'
+"""
+import asyncio
+import base64
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Optional
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from PIL import Image
+from pydantic import BaseModel, Field
+import blip_model
+import ingest
+import triage
+import whisper_model
+from batcher import MicroBatcher
+from result_cache import ResultCache
+from streaming import FfmpegDecoder, PcmDecoder, StreamingTranscriber
+
+# Modelli da caricare (es. AIRA_MODELS=whisper per un nodo solo audio)
+ENABLED_MODELS = [name.strip() for name in os.environ.get("AIRA_MODELS", "whisper,blip").split(",") if name.strip()]
+# Dimensione massima di un upload
+MAX_UPLOAD_BYTES = int(float(os.environ.get("AIRA_MAX_UPLOAD_MB", 25)) * 2**20)
+# Micro-batching di BLIP: immagini arrivate entro la finestra, fino a un massimo
+BLIP_MAX_BATCH = int(os.environ.get("AIRA_BLIP_MAX_BATCH", 8))
+BLIP_WINDOW_MS = float(os.environ.get("AIRA_BLIP_WINDOW_MS", 20))
+# Cache dei risultati: LRU in memoria più, se indicata, una cartella su disco
+CACHE_ITEMS = int(os.environ.get("AIRA_CACHE_ITEMS", 1024))
+CACHE_DIR = os.environ.get("AIRA_CACHE_DIR") or None
+CACHE_DISK_MB = float(os.environ.get("AIRA_CACHE_DISK_MB", 256))
+# Triage: deadline globale, timeout delle singole fasi (s) e foto per segnalazione
+TRIAGE_DEADLINE_S = float(os.environ.get("AIRA_TRIAGE_DEADLINE_S", 20))
+TRIAGE_TRANSCRIPTION_S = float(os.environ.get("AIRA_TRIAGE_TRANSCRIPTION_S", TRIAGE_DEADLINE_S))
+TRIAGE_CAPTION_S = float(os.environ.get("AIRA_TRIAGE_CAPTION_S", TRIAGE_DEADLINE_S))
+TRIAGE_MAX_IMAGES = int(os.environ.get("AIRA_TRIAGE_MAX_IMAGES", 8))
+
+# Modelli caricati e stato del caricamento, condivisi da tutte le richieste
+models = {}
+status = {"ready": False, "error": None, "load_seconds": {}, "warmup_seconds": {}}
+# Un modello esegue un'inferenza alla volta (PyTorch usa già tutti i core)
+locks = {"whisper": threading.Lock(), "blip": threading.Lock()}
+
+
+def load_models():
+    """Carica e scalda i modelli abilitati (nel thread di avvio)."""
+    try:
+        for name in ENABLED_MODELS:
+            started = time.perf_counter()
+            if name == "whisper":
+                models["whisper"] = whisper_model.load_model()
+            elif name == "blip":
+                models["blip"] = blip_model.load_model(max_batch=BLIP_MAX_BATCH)
+            else:
+                raise ValueError(f"Modello sconosciuto: {name}")
+            status["load_seconds"][name] = round(time.perf_counter() - started, 3)
+
+            # la prima inferenza alloca i buffer e inizializza i kernel
+            started = time.perf_counter()
+            if name == "whisper":
+                run_transcription(np.zeros(whisper_model.SAMPLE_RATE, dtype=np.float32), beam_size=1)
+            else:
+                run_caption_batch([Image.new("RGB", (384, 384))] * BLIP_MAX_BATCH)
+            status["warmup_seconds"][name] = round(time.perf_counter() - started, 3)
+            print(f"{name}: caricato in {status['load_seconds'][name]}s, "
+                  f"warm-up in {status['warmup_seconds'][name]}s")
+        status["ready"] = True
+    except Exception as e:
+        status["error"] = str(e)
+        print(f"Caricamento dei modelli fallito: {e}")
+
+
+def run_transcription(audio, beam_size=5, language=None, initial_prompt=None):
+    with locks["whisper"]:
+        return whisper_model.transcribe(models["whisper"], audio, beam_size, language, initial_prompt)
+
+
+def run_caption_batch(images):
+    processor, model = models["blip"]
+    with locks["blip"]:
+        return blip_model.caption_batch(processor, model, images)
+
+
+# le immagini che arrivano insieme (es. maxi-emergenza) condividono un generate
+caption_batcher = MicroBatcher(run_caption_batch, max_batch=BLIP_MAX_BATCH, window_ms=BLIP_WINDOW_MS)
+# l'app ritenta gli upload: lo stesso file non viene ricalcolato
+result_cache = ResultCache(max_items=CACHE_ITEMS, directory=CACHE_DIR, max_disk_mb=CACHE_DISK_MB)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # il caricamento gira in background: /health risponde subito,
+    # /ready solo quando i modelli sono pronti
+    loading = asyncio.create_task(asyncio.to_thread(load_models))
+    yield
+    await loading
+    await caption_batcher.close()
+
+
+app = FastAPI(title="AIRA inference", lifespan=lifespan)
+
+
+@contextmanager
+def timed(timings, stage):
+    """Aggiunge a `timings` la durata in ms del blocco."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def timed_response(content, timings):
+    """Risposta JSON con i tempi anche nell'header Server-Timing."""
+    header = ", ".join(f"{stage};dur={duration}" for stage, duration in timings.items())
+    return JSONResponse({**content, "timings_ms": timings}, headers={"Server-Timing": header})
+
+
+async def read_upload(request):
+    too_large = HTTPException(status_code=413, detail=f"File oltre {MAX_UPLOAD_BYTES} byte")
+    # rifiuta subito se la dimensione dichiarata supera il limite
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(status_code=400, detail="Body vuoto: inviare i byte del file")
+    return b"".join(chunks)
+
+
+def rejected_input(e):
+    """Errore HTTP per un input rifiutato dall'ingest."""
+    return HTTPException(status_code=413 if isinstance(e, ingest.TooLarge) else 415, detail=str(e))
+
+
+def require(name):
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail="Modelli in caricamento", headers={"Retry-After": "5"})
+    if name not in models:
+        raise HTTPException(status_code=404, detail=f"Modello {name} non abilitato su questo nodo")
+
+
+@app.get("/health")
+async def health():
+    """Liveness: il processo risponde."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 solo con tutti i modelli caricati e scaldati."""
+    body = {
+        **status,
+        "models": list(models),
+        "caption_batches": caption_batcher.stats(),
+        "cache": result_cache.stats(),
+    }
+    return JSONResponse(body, status_code=200 if status["ready"] else 503)
+
+
+@app.post("/transcribe")
+async def transcribe(
+    request: Request,
+    beam_size: int = Query(default=5, ge=1, le=10),
+    language: Optional[str] = None,
+):
+    require("whisper")
+    timings = {}
+    with timed(timings, "total"):
+        data = await read_upload(request)
+        content, cached = await cached_transcription(data, beam_size, language, timings)
+    return timed_response({**content, "cached": cached}, timings)
+
+
+async def cached_transcription(data, beam_size, language, timings):
+    """Trascrizione dalla cache o calcolata (e salvata), più se era in cache."""
+    key = ResultCache.key(
+        data, whisper_model.MODEL_NAME, backend=whisper_model.BACKEND, beam_size=beam_size, language=language
+    )
+    with timed(timings, "cache"):
+        # il livello su disco legge un file: fuori dall'event loop
+        content = await asyncio.to_thread(result_cache.get, key)
+    if content is not None:
+        return content, True
+    content = await asyncio.to_thread(transcribe_upload, data, beam_size, language, timings)
+    await asyncio.to_thread(result_cache.put, key, content)
+    return content, False
+
+
+def transcribe_upload(data, beam_size, language, timings):
+    """Decodifica e trascrive nello stesso thread: il buffer dei campioni torna al pool alla fine."""
+    with ingest.audio_buffers.buffer() as buffer:
+        with timed(timings, "decode"):
+            try:
+                audio = ingest.decode_audio(data, buffer)
+            except ValueError as e:
+                raise rejected_input(e)
+        with timed(timings, "inference"):
+            result = run_transcription(audio, beam_size, language)
+        return {
+            "transcription": result["text"],
+            "language": result.get("language"),
+            "audio_seconds": round(len(audio) / whisper_model.SAMPLE_RATE, 2),
+        }
+
+
+@app.post("/caption")
+async def caption(request: Request):
+    require("blip")
+    timings = {}
+    with timed(timings, "total"):
+        data = await read_upload(request)
+        content, cached = await cached_caption(data, timings)
+    return timed_response({**content, "cached": cached}, timings)
+
+
+async def cached_caption(data, timings):
+    """Didascalia dalla cache o calcolata (e salvata), più se era in cache."""
+    key = ResultCache.key(data, blip_model.MODEL_NAME, backend=blip_model.BACKEND)
+    with timed(timings, "cache"):
+        content = await asyncio.to_thread(result_cache.get, key)
+    if content is not None:
+        return content, True
+    with timed(timings, "decode"):
+        try:
+            image = await asyncio.to_thread(blip_model.open_image, data, models["blip"][0])
+        except ValueError as e:
+            raise rejected_input(e)
+    # attesa del batch compresa
+    with timed(timings, "inference"):
+        content = {"caption": await caption_batcher.submit(image)}
+    await asyncio.to_thread(result_cache.put, key, content)
+    return content, False
+
+
+class TriageSubmission(BaseModel):
+    """Segnalazione dall'app: media in base64 (anche come data URL)."""
+    audio: Optional[str] = None
+    images: List[str] = []
+    text: Optional[str] = None
+    location: Optional[dict] = None
+    type: Optional[str] = None
+    victimCount: Optional[str] = None
+    userId: Optional[int] = None
+    language: Optional[str] = None
+    beam_size: int = Field(default=5, ge=1, le=10)
+    deadline_s: Optional[float] = Field(default=None, gt=0)
+
+
+def decode_media(value, name):
+    """Byte di un media in base64, con o senza prefisso "data:...;base64,"."""
+    try:
+        data = base64.b64decode(value.split(",", 1)[-1], validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name}: base64 non valido")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"{name}: file oltre {MAX_UPLOAD_BYTES} byte")
+    return data
+
+
+@app.post("/triage")
+async def triage_submission(submission: TriageSubmission):
+    """
+    Trascrizione della nota vocale e didascalie delle foto in parallelo,
+    unite in un report per emergencyRequests. Allo scadere della deadline
+    si risponde con quanto è pronto.
+    """
+    if submission.audio:
+        require("whisper")
+    if submission.images:
+        require("blip")
+    if len(submission.images) > TRIAGE_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Al massimo {TRIAGE_MAX_IMAGES} foto")
+    deadline_s = min(submission.deadline_s or TRIAGE_DEADLINE_S, TRIAGE_DEADLINE_S)
+    audio = decode_media(submission.audio, "audio") if submission.audio else None
+    images = [decode_media(image, f"images[{i}]") for i, image in enumerate(submission.images)]
+
+    timings = {}
+    with timed(timings, "total"):
+        stages, stage_timings = {}, {}
+        if audio is not None:
+            stage_timings["transcription"] = {}
+            work = cached_transcription(audio, submission.beam_size, submission.language, stage_timings["transcription"])
+            stages["transcription"] = (timed_stage(work, stage_timings["transcription"]), TRIAGE_TRANSCRIPTION_S)
+        for i, image in enumerate(images):
+            stage_timings[f"caption_{i}"] = {}
+            work = cached_caption(image, stage_timings[f"caption_{i}"])
+            stages[f"caption_{i}"] = (timed_stage(work, stage_timings[f"caption_{i}"]), TRIAGE_CAPTION_S)
+
+        results, errors, missing = await triage.gather_until(stages, deadline_s)
+
+        transcription = results["transcription"][0]["transcription"] if "transcription" in results else None
+        captions = [
+            results[f"caption_{i}"][0]["caption"] if f"caption_{i}" in results else None
+            for i in range(len(images))
+        ]
+        report = triage.build_report(
+            transcription, captions, submission.text, submission.location,
+            submission.type, submission.victimCount, submission.userId,
+        )
+    return JSONResponse({
+        "emergencyRequest": report,
+        "transcription": transcription,
+        "captions": captions,
+        "missing": missing,
+        "errors": errors,
+        "deadline_s": deadline_s,
+        "timings_ms": {**timings, "stages": stage_timings},
+    })
+
+
+async def timed_stage(work, timings):
+    with timed(timings, "total"):
+        return await work
+
+
+class TranscriptionStream:
+    """
+    Una sessione di trascrizione in streaming: decoder dei byte ricevuti
+    più StreamingTranscriber, con i tempi del primo testo.
+    """
+
+    def __init__(self, audio_format, beam_size, language):
+        self.decoder = PcmDecoder() if audio_format == "pcm" else FfmpegDecoder()
+        self.transcriber = StreamingTranscriber(
+            lambda audio, beam, prompt: run_transcription(audio, beam, language, prompt)["text"],
+            beam_size=beam_size,
+        )
+        self.started = time.perf_counter()
+        self.first_text_s = None
+
+    async def feed(self, data):
+        # la scrittura verso ffmpeg può bloccare: tutto fuori dall'event loop
+        return self._timed(await asyncio.to_thread(self._feed, data))
+
+    def _feed(self, data):
+        self.decoder.write(data)
+        return self.transcriber.feed(self.decoder.read())
+
+    async def finish(self):
+        events = await asyncio.to_thread(self._finish)
+        return self._timed(events) + [{
+            "type": "end",
+            "audio_seconds": round(self.transcriber.position / whisper_model.SAMPLE_RATE, 2),
+            "elapsed_seconds": round(time.perf_counter() - self.started, 2),
+            "first_text_seconds": self.first_text_s,
+        }]
+
+    def _finish(self):
+        return self.transcriber.feed(self.decoder.close()) + self.transcriber.flush()
+
+    def _timed(self, events):
+        if self.first_text_s is None and any(event["text"] for event in events):
+            self.first_text_s = round(time.perf_counter() - self.started, 2)
+        return events
+
+
+@app.websocket("/transcribe/stream")
+async def transcribe_websocket(
+    websocket: WebSocket,
+    format: str = Query(default="pcm", pattern="^(pcm|ffmpeg)$"),
+    beam_size: int = Query(default=5, ge=1, le=10),
+    language: Optional[str] = None,
+):
+    """
+    Trascrizione in streaming: il client invia messaggi binari con l'audio
+    (PCM s16le mono 16 kHz con format=pcm, qualsiasi formato in streaming
+    leggibile da ffmpeg con format=ffmpeg) e il messaggio di testo "end" alla
+    fine. Riceve i risultati "partial" e "final" man mano, poi "end".
+    """
+    await websocket.accept()
+    if not status["ready"] or "whisper" not in models:
+        await websocket.close(code=1013, reason="Modello whisper non disponibile")
+        return
+    stream = TranscriptionStream(format, beam_size, language)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                events = await stream.feed(message["bytes"])
+            elif message.get("text") == "end":
+                for event in await stream.finish():
+                    await websocket.send_json(event)
+                await websocket.close()
+                return
+            else:
+                continue
+            for event in events:
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # il processo ffmpeg e le sue pipe vanno chiusi anche dopo un errore
+        # del decoder o del modello, o se il task viene cancellato
+        await asyncio.to_thread(stream.decoder.close)
@@ -1,40 +1,37 @@
-import whisper
 import argparse
 import os
+import sys
 import time
-import torch
 import json
 from datetime import datetime
+import backends
+import ingest
+import whisper_model
+from result_cache import ResultCache
 
 # Percorso del file MP3 da trascrivere
 MP3_FILE_PATH = "audio/prova.mp3"  # Modifica con il nome del tuo file MP3
 # Cartella di output per i risultati JSON
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Cache su disco dei risultati: un file già trascritto non viene ricalcolato
+CACHE_DIR = os.environ.get("AIRA_CACHE_DIR") or os.path.join(OUTPUT_DIR, "cache")
+TRANSCRIPTION_ERROR = "Errore durante la trascrizione"
 
-def load_model():
+def load_model(backend=whisper_model.BACKEND, threads=backends.THREADS):
     """Carica il modello Whisper nella versione 'tiny' utilizzando la GPU."""
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        if device == "cuda":
-            torch.cuda.empty_cache()  # Libera memoria GPU non utilizzata
-        
-        model = whisper.load_model("tiny", device=device)
-        return model
+        return whisper_model.load_model(backend=backend, threads=threads)
     except Exception as e:
         return None
 
-def transcribe_audio(model, file_path, beam_size=5):
-    """Trascrive l'audio usando il modello Whisper."""
+def transcribe_audio(model, data, beam_size=5):
+    """Trascrive l'audio (byte del file o stream) usando il modello Whisper."""
     try:
-        # Utilizzo FP16 per prestazioni migliori su GPU
-        result = model.transcribe(
-            file_path,
-            fp16=torch.cuda.is_available(),
-            beam_size=beam_size  # Utilizziamo beam_size invece di batch_size
-        )
-        return result["text"]
+        with ingest.audio_buffers.buffer() as buffer:
+            audio = ingest.decode_audio(data, buffer)
+            return whisper_model.transcribe(model, audio, beam_size)["text"]
     except Exception as e:
-        return f"Errore durante la trascrizione: {str(e)}"
+        return f"{TRANSCRIPTION_ERROR}: {str(e)}"
 
 def save_to_json(transcription, file_path, elapsed_time, output_dir=OUTPUT_DIR):
     """Salva i risultati della trascrizione in un file JSON."""
@@ -65,33 +62,52 @@ def save_to_json(transcription, file_path, elapsed_time, output_dir=OUTPUT_DIR):
 def main():
     parser = argparse.ArgumentParser(description='Trascrizione file audio usando openai-whisper (modello tiny)')
     parser.add_argument('--file', type=str, default=MP3_FILE_PATH, 
-                       help=f'Path del file audio da trascrivere (default: {MP3_FILE_PATH})')
+                       help=f'Path del file audio da trascrivere, - per lo standard input (default: {MP3_FILE_PATH})')
     parser.add_argument('--beam_size', type=int, default=5,
                        help='Dimensione del beam per la trascrizione (default: 5)')
     parser.add_argument('--output', type=str, default=OUTPUT_DIR,
                        help=f'Directory per salvare il file JSON (default: {OUTPUT_DIR})')
+    parser.add_argument('--backend', type=str, default=whisper_model.BACKEND, choices=backends.BACKENDS,
+                       help=f'Backend di inferenza (default: {whisper_model.BACKEND})')
+    parser.add_argument('--threads', type=int, default=backends.THREADS,
+                       help='Thread intra-op su CPU, 0 = uno per core (default: 0)')
     args = parser.parse_args()
     
     file_path = args.file
     beam_size = args.beam_size
     output_dir = args.output
     
-    # Verifica che il file esista
-    if not os.path.exists(file_path):
+    # Legge i byte dell'audio (file o standard input) una sola volta
+    if file_path == '-':
+        file_path = 'stdin'
+        data = sys.stdin.buffer.read()
+    elif os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    else:
+        return
+    
+    # Stesso audio, modello e parametri: il JSON esiste già
+    cache = ResultCache(directory=CACHE_DIR)
+    key = ResultCache.key(data, whisper_model.MODEL_NAME, backend=args.backend, beam_size=beam_size)
+    cached = cache.get(key)
+    if cached and os.path.exists(cached.get("json_path", "")):
         return
     
     # Carica il modello Whisper
-    model = load_model()
+    model = load_model(args.backend, args.threads)
     if not model:
         return
     
     # Esegui la trascrizione
     start_time = time.time()
-    transcription = transcribe_audio(model, file_path, beam_size)
+    transcription = transcribe_audio(model, data, beam_size)
     elapsed_time = time.time() - start_time
     
     # Salva i risultati in un file JSON
     json_path = save_to_json(transcription, file_path, elapsed_time, output_dir)
+    if not transcription.startswith(TRANSCRIPTION_ERROR):
+        cache.put(key, {"transcription": transcription, "json_path": json_path})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,229 @@
+import subprocess
+import threading
+import time
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Finestra di analisi del VAD (30 ms)
+FRAME = SAMPLE_RATE * 30 // 1000
+
+
+class EnergyVAD:
+    """
+    Voice activity detection a soglia di energia, frame da 30 ms.
+
+    La soglia segue il rumore di fondo: un frame è voce se la sua energia
+    (RMS) supera di `ratio` volte il livello del rumore, stimato come media
+    mobile dei frame di silenzio.
+    """
+
+    def __init__(self, ratio=3.0, min_rms=0.005):
+        self.ratio = ratio
+        self.min_rms = min_rms
+        self.noise = min_rms
+
+    def is_speech(self, frame):
+        rms = float(np.sqrt(np.mean(frame * frame)))
+        speech = rms > max(self.min_rms, self.noise * self.ratio)
+        if not speech:
+            self.noise = 0.95 * self.noise + 0.05 * rms
+        return speech
+
+
+class StreamingTranscriber:
+    """
+    Trascrizione incrementale di un flusso audio (float32 mono a 16 kHz).
+
+    L'audio viene diviso in segmenti di parlato dal VAD. Mentre un segmento
+    cresce viene trascritto ogni `partial_every_s` secondi di audio nuovo
+    (risultato "partial", ricerca greedy; se l'inferenza è più lenta del
+    tempo reale l'intervallo si allunga, così i parziali non accumulano
+    ritardo); quando il parlato si interrompe
+    per `silence_s` secondi, o il segmento raggiunge `max_segment_s`,
+    viene trascritto un'ultima volta con il beam richiesto (risultato
+    "final"). Il testo finale più recente è passato come prompt al segmento
+    successivo, così la punteggiatura e i nomi restano coerenti.
+
+    La memoria resta limitata anche su registrazioni lunghe: il buffer del
+    segmento ha dimensione fissa e del passato si tengono solo gli ultimi
+    `context_chars` caratteri.
+
+    Parameters:
+    -----------
+    transcribe : callable
+        transcribe(audio, beam_size, initial_prompt) -> testo
+    """
+
+    def __init__(self, transcribe, beam_size=5, partial_every_s=1.0, silence_s=0.6,
+                 max_segment_s=20.0, preroll_s=0.2, context_chars=200, vad=None):
+        self.transcribe = transcribe
+        self.beam_size = beam_size
+        self.partial_every = int(partial_every_s * SAMPLE_RATE)
+        self.silence_frames = max(int(silence_s * SAMPLE_RATE) // FRAME, 1)
+        self.preroll = int(preroll_s * SAMPLE_RATE) // FRAME * FRAME
+        self.context_chars = context_chars
+        self.vad = vad or EnergyVAD()
+
+        self._segment = np.zeros(int(max_segment_s * SAMPLE_RATE), dtype=np.float32)
+        self._length = 0
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._recent = np.zeros(0, dtype=np.float32)
+        self._silent = 0
+        self._since_partial = 0
+        self._next_partial = self.partial_every
+        self._segment_start = 0
+        self.position = 0       # campioni ricevuti dall'inizio del flusso
+        self.context = ""
+
+    @property
+    def in_speech(self):
+        return self._length > 0
+
+    def feed(self, samples):
+        """Aggiunge audio al flusso, restituisce i risultati prodotti (lista di dict)."""
+        events = []
+        samples = np.concatenate([self._pending, np.asarray(samples, dtype=np.float32)])
+        frames = len(samples) // FRAME
+        self._pending = samples[frames * FRAME:]
+        for i in range(frames):
+            frame = samples[i * FRAME:(i + 1) * FRAME]
+            self.position += FRAME
+            speech = self.vad.is_speech(frame)
+            if not self.in_speech:
+                if speech:
+                    # il segmento parte poco prima del primo frame di voce
+                    self._segment_start = self.position - FRAME - len(self._recent)
+                    self._append(self._recent)
+                    self._append(frame)
+                    self._silent = 0
+                elif self.preroll:
+                    self._recent = np.concatenate([self._recent, frame])[-self.preroll:]
+                continue
+
+            self._append(frame)
+            self._silent = 0 if speech else self._silent + 1
+            if self._silent >= self.silence_frames or self._length + FRAME > len(self._segment):
+                events.append(self._final())
+            elif self._since_partial >= self._next_partial:
+                started = time.perf_counter()
+                events.append(self._result("partial", beam_size=None))
+                # il prossimo parziale arriva dopo almeno il doppio dell'audio
+                # che questo ha impiegato a calcolarsi
+                elapsed = int((time.perf_counter() - started) * SAMPLE_RATE)
+                self._next_partial = max(self.partial_every, 2 * elapsed)
+                self._since_partial = 0
+        return events
+
+    def flush(self):
+        """Fine del flusso: trascrive il segmento in corso."""
+        if self.in_speech:
+            return [self._final()]
+        return []
+
+    def _append(self, samples):
+        self._segment[self._length:self._length + len(samples)] = samples
+        self._length += len(samples)
+        self._since_partial += len(samples)
+
+    def _result(self, kind, beam_size):
+        text = self.transcribe(self._segment[:self._length], beam_size, self.context or None).strip()
+        return {
+            "type": kind,
+            "text": text,
+            "start": round(self._segment_start / SAMPLE_RATE, 2),
+            "end": round(self.position / SAMPLE_RATE, 2),
+        }
+
+    def _final(self):
+        event = self._result("final", self.beam_size)
+        if event["text"]:
+            self.context = (self.context + " " + event["text"]).strip()[-self.context_chars:]
+        self._length = 0
+        self._since_partial = 0
+        self._next_partial = self.partial_every
+        self._silent = 0
+        self._recent = np.zeros(0, dtype=np.float32)
+        return event
+
+
+class PcmDecoder:
+    """Flusso PCM s16le mono a 16 kHz (es. microfono), stessa interfaccia di FfmpegDecoder."""
+
+    def __init__(self):
+        self._carry = b""
+        self._samples = np.zeros(0, dtype=np.float32)
+
+    def write(self, data):
+        data = self._carry + data
+        # un campione può essere diviso tra due messaggi
+        usable = len(data) // 2 * 2
+        self._carry = data[usable:]
+        samples = np.frombuffer(data[:usable], np.int16).astype(np.float32) / 32768.0
+        self._samples = np.concatenate([self._samples, samples])
+
+    def read(self):
+        samples, self._samples = self._samples, np.zeros(0, dtype=np.float32)
+        return samples
+
+    def close(self):
+        return self.read()
+
+
+class FfmpegDecoder:
+    """
+    Decodifica incrementale di un flusso compresso (mp3, ogg/opus, webm...)
+    con un processo ffmpeg persistente: i byte entrano da `write`, i
+    campioni a 16 kHz già decodificati escono da `read`.
+    """
+
+    def __init__(self):
+        self._process = subprocess.Popen(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+             "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        while True:
+            chunk = self._process.stdout.read1(65536)
+            if not chunk:
+                break
+            with self._lock:
+                self._buffer.extend(chunk)
+
+    def write(self, data):
+        self._process.stdin.write(data)
+        self._process.stdin.flush()
+
+    def read(self):
+        """Campioni decodificati finora e non ancora letti."""
+        with self._lock:
+            usable = len(self._buffer) // 2 * 2
+            data = bytes(self._buffer[:usable])
+            del self._buffer[:usable]
+        return np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+
+    def close(self, timeout=5.0):
+        """
+        Chiude l'input e restituisce gli ultimi campioni. Se ffmpeg non
+        termina entro `timeout` secondi il processo viene ucciso. Si può
+        chiamare più volte.
+        """
+        try:
+            self._process.stdin.close()
+        except OSError:
+            # ffmpeg è già uscito (es. input non valido), la pipe è rotta
+            pass
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        # con il processo terminato lo stdout arriva a EOF e il lettore esce
+        self._reader.join()
+        self._process.stdout.close()
+        return self.read()
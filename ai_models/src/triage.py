@@ -0,0 +1,147 @@
+"""
+Triage di una segnalazione di emergenza: nota vocale, testo e foto diventano
+un unico report pronto per emergencyRequests (app/shared/schema.ts).
+
+Trascrizione e didascalie girano in parallelo (`gather_until`); allo
+scadere della deadline globale il report si compone con quello che è
+pronto, le fasi mancanti sono elencate in "missing". Il tipo di emergenza e
+il numero di persone coinvolte, se l'utente non li ha indicati, sono
+ricavati dai testi con parole chiave.
+"""
+import asyncio
+import re
+
+# Tipi di emergenza dell'app, in ordine di priorità: vince il primo trovato.
+# Le parole chiave sono prefissi di parola ("ferit" -> ferito, feriti...)
+EMERGENCY_KEYWORDS = {
+    "unconscious": ["incoscient", "svenut", "non risponde", "privo di sensi", "unconscious", "fainted", "passed out"],
+    "cardiac": ["infarto", "cuore", "cardiac", "dolore al petto", "arresto cardiaco", "heart", "chest pain"],
+    "breathing": ["respir", "soffoc", "fiato", "asma", "breath", "chok", "asthma"],
+    "burn": ["ustion", "bruciat", "fuoco", "incendio", "fiamme", "fumo", "burn", "fire", "flame", "smoke"],
+    "trauma": ["ferit", "sangue", "caduta", "caduto", "incidente", "frattur", "injur", "wound", "blood",
+               "crash", "accident", "fracture"],
+}
+KEYWORD_PATTERNS = {
+    kind: re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + ")", re.IGNORECASE)
+    for kind, keywords in EMERGENCY_KEYWORDS.items()
+}
+NUMBER_WORDS = {
+    "un": 1, "uno": 1, "una": 1, "due": 2, "tre": 3, "quattro": 4, "cinque": 5, "sei": 6, "sette": 7,
+    "otto": 8, "nove": 9, "dieci": 10, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+# "sei" è anche "(tu) sei": conta solo davanti a un plurale ("sei feriti", non "sei ferito?")
+AMBIGUOUS_NUMBERS = ["sei"]
+PEOPLE_WORDS = (r"(?:persone|persona|feriti|ferito|ferita|ferite|vittime|vittima|bambini|bambino|"
+                r"people|person|persons|injured|victims|victim|children|child)")
+PLURAL_PEOPLE_WORDS = r"(?:persone|feriti|ferite|vittime|bambini)"
+VICTIMS = [
+    re.compile(
+        r"\b(\d+|" + "|".join(w for w in NUMBER_WORDS if w not in AMBIGUOUS_NUMBERS) + r")\s+(?:\w+\s+)?"
+        + PEOPLE_WORDS + r"\b", re.IGNORECASE
+    ),
+    re.compile(
+        r"\b(" + "|".join(AMBIGUOUS_NUMBERS) + r")\s+(?:\w+\s+)?" + PLURAL_PEOPLE_WORDS + r"\b", re.IGNORECASE
+    ),
+]
+
+
+def classify(texts):
+    """Tipo di emergenza dai testi (trascrizione, testo, didascalie), "other" se nessuno."""
+    joined = " ".join(texts)
+    for kind, pattern in KEYWORD_PATTERNS.items():
+        if pattern.search(joined):
+            return kind
+    return "other"
+
+
+def count_victims(texts):
+    """Numero più alto di persone citato nei testi ("tre feriti", "2 people"), None se assente."""
+    counts = []
+    for text in texts:
+        for pattern in VICTIMS:
+            for match in pattern.finditer(text):
+                number = match.group(1)
+                counts.append(int(number) if number.isdigit() else NUMBER_WORDS[number.lower()])
+    return max(counts) if counts else None
+
+
+async def gather_until(stages, deadline_s):
+    """
+    Esegue le fasi in parallelo fino alla deadline globale.
+
+    `stages` associa a ogni nome una coppia (coroutine, timeout della fase
+    in secondi o None). Restituisce (risultati, errori, mancanti). Una fase
+    oltre il proprio timeout non viene più attesa, ma se termina prima del
+    ritorno il suo risultato è incluso; quelle ancora in corso finiscono tra
+    i mancanti senza essere annullate, così il risultato arriva comunque in
+    cache.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tasks, expires = {}, {}
+    for name, (coroutine, timeout) in stages.items():
+        task = asyncio.ensure_future(coroutine)
+        tasks[task] = name
+        expires[task] = started + min(timeout or deadline_s, deadline_s)
+
+    pending = set(tasks)
+    while pending:
+        now = loop.time()
+        pending = {task for task in pending if expires[task] > now}
+        if not pending:
+            break
+        done, pending = await asyncio.wait(
+            pending, timeout=min(expires[task] for task in pending) - now, return_when=asyncio.FIRST_COMPLETED
+        )
+
+    results, errors, missing = {}, {}, []
+    for task, name in tasks.items():
+        if not task.done():
+            missing.append(name)
+            _background.add(task)
+            task.add_done_callback(_finished)
+        elif task.exception() is not None:
+            errors[name] = getattr(task.exception(), "detail", None) or str(task.exception())
+        else:
+            results[name] = task.result()
+    return results, errors, missing
+
+
+# fasi oltre la deadline ancora in corso (un riferimento le tiene in vita)
+_background = set()
+
+
+def _finished(task):
+    _background.discard(task)
+    if not task.cancelled():
+        task.exception()  # già segnalata o irrilevante: evita il warning di asyncio
+
+
+def build_report(transcription, captions, text=None, location=None, kind=None, victim_count=None, user_id=None):
+    """
+    Report unico nel formato di emergencyRequests (insertEmergencyRequestSchema).
+
+    `captions` ha una voce per foto, None per quelle non descritte in tempo.
+    Tipo e numero di persone indicati dall'utente hanno la precedenza su
+    quelli ricavati dai testi.
+    """
+    texts = [t for t in [text, transcription, *captions] if t]
+    lines = []
+    if text:
+        lines.append(text.strip())
+    if transcription:
+        lines.append(f"Trascrizione: {transcription.strip()}")
+    for i, caption in enumerate(captions, start=1):
+        if caption:
+            lines.append(f"Foto {i}: {caption.strip()}")
+    if victim_count is None:
+        victim_count = count_victims(texts)
+    return {
+        "userId": user_id,
+        "type": kind or classify(texts),
+        "description": "\n".join(lines) or None,
+        "victimCount": str(victim_count) if victim_count is not None else None,
+        "location": location or {},
+        "status": "pending",
+    }
@@ -0,0 +1,57 @@
+import os
+import torch
+import whisper
+import backends
+
+# Modello Whisper di default, sovrascrivibile con la variabile AIRA_WHISPER_MODEL
+MODEL_NAME = os.environ.get("AIRA_WHISPER_MODEL", "tiny")
+# Frequenza di campionamento attesa da Whisper (16 kHz)
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+# Backend di inferenza (fp32, int8, torchscript), vedi backends.py
+BACKEND = os.environ.get("AIRA_WHISPER_BACKEND", "fp32")
+
+
+def get_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_model(name=MODEL_NAME, device=None, backend=BACKEND, threads=backends.THREADS):
+    """Carica il modello Whisper (GPU se disponibile) con il backend scelto."""
+    backends.check_backend(backend)
+    backends.set_threads(threads)
+    # int8 e torchscript sono backend per CPU
+    device = "cpu" if backend != "fp32" else device or get_device()
+    if device == "cuda":
+        torch.cuda.empty_cache()  # Libera memoria GPU non utilizzata
+    model = whisper.load_model(name, device=device)
+    if backend == "int8":
+        # whisper usa una sottoclasse di nn.Linear (cast dei pesi al dtype
+        # dell'input) che quantize_dynamic non riconosce: in fp32 su CPU
+        # si comporta come nn.Linear
+        for module in model.modules():
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        model = backends.quantize_int8(model)
+    elif backend == "torchscript":
+        # transcribe passa all'encoder una finestra di 30 s alla volta
+        mel = torch.zeros(1, model.dims.n_mels, whisper.audio.N_FRAMES)
+        model.encoder = backends.trace(model.encoder, mel)
+    return model
+
+
+def transcribe(model, audio, beam_size=5, language=None, initial_prompt=None):
+    """
+    Trascrive l'audio (path o array float32 a 16 kHz) con un modello già caricato.
+
+    `beam_size` None usa la ricerca greedy, `initial_prompt` è il testo che
+    precede l'audio (contesto per i flussi trascritti a segmenti).
+    Restituisce il risultato di Whisper: "text", "segments" e "language".
+    """
+    with torch.inference_mode():
+        return model.transcribe(
+            audio,
+            fp16=next(model.parameters()).is_cuda,  # FP16 solo su GPU
+            beam_size=beam_size,
+            language=language,
+            initial_prompt=initial_prompt,
+        )
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from routers.router import main_router
-from maps_utils.maps_init import load_maps
+from maps_utils.maps_init import get_maps, get_pertinent_map
 from models.routing import Coordinates
 
 app = FastAPI()
@@ -15,13 +15,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-maps = load_maps()
+# Build the graphs once at startup, every request then shares the same registry
+get_maps()
 
 app.include_router(main_router)
 
 def get_city_map(user_coordinates: Coordinates):
-    #TODO implement this to get the map of the city based on the user location
-    return maps[0]
+    return get_pertinent_map(user_coordinates)
 
 
 # # Add this at the end of the file
@@ -0,0 +1,315 @@
+import json
+import os
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371008.8
+
+# On-disk layout of a .graph file:
+#   8 bytes   magic
+#   8 bytes   little endian length of the JSON header
+#   header    JSON with the metadata and, for every array, dtype/shape/offset
+#   arrays    raw little endian arrays, each one aligned to ALIGNMENT bytes
+# The arrays are never copied on load: they are views over a read-only memory
+# map, so several uvicorn workers opening the same file share the same pages.
+MAGIC = b"AIRAGRPH"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# name -> dtype of every array stored in the file
+ARRAYS = {
+    "node_ids": "<i8",      # OSM id of each node
+    "x": "<f8",             # node longitude
+    "y": "<f8",             # node latitude
+    "indptr": "<i8",        # CSR row pointer, edges of node i are indptr[i]:indptr[i+1]
+    "indices": "<i4",       # CSR column index, target node of every edge
+    "length": "<f8",        # edge length in meters
+    "geom_offsets": "<i8",  # coordinates of edge e are geom_coords[geom_offsets[e]:geom_offsets[e+1]]
+    "geom_coords": "<f8",   # (k, 2) lon/lat of the edge geometries, endpoints included
+}
+
+# arrays that older files may not have (None when missing)
+OPTIONAL_ARRAYS = {
+    "travel_time": "<f8",   # free-flow edge travel time in seconds (OSMnx speeds)
+}
+
+
+class CompactGraph:
+    """
+    Read-only road network stored as flat arrays.
+
+    Nodes are numbered 0..n-1 and edges 0..m-1. Edges are sorted by
+    (source, target), so parallel edges of a MultiDiGraph are contiguous.
+    """
+
+    def __init__(self, arrays, meta=None, path=None):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        for name in OPTIONAL_ARRAYS:
+            setattr(self, name, arrays.get(name))
+        self.meta = meta or {}
+        self.path = path
+        self._edge_sources = None
+        self._edge_groups = None
+        self._node_order = None
+        self._node_tree = None
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def _stored_arrays(self):
+        yield from ARRAYS.items()
+        for name, dtype in OPTIONAL_ARRAYS.items():
+            if getattr(self, name) is not None:
+                yield name, dtype
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _ in self._stored_arrays())
+
+    def edge_sources(self):
+        """Source node of every edge (the CSR row expanded to edge order)."""
+        if self._edge_sources is None:
+            self._edge_sources = np.repeat(
+                np.arange(self.number_of_nodes(), dtype=np.int32), np.diff(self.indptr)
+            )
+        return self._edge_sources
+
+    def edge_groups(self):
+        """
+        Groups of parallel edges, contiguous since edges are sorted.
+
+        Returns:
+        --------
+        group : numpy.ndarray
+            Group of every edge, groups are numbered in (source, target) order
+        starts : numpy.ndarray
+            First edge of every group, plus the number of edges at the end
+        """
+        if self._edge_groups is None:
+            sources, targets = self.edge_sources(), self.indices
+            new_group = np.ones(len(targets), dtype=bool)
+            new_group[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+            starts = np.append(np.flatnonzero(new_group), len(targets))
+            self._edge_groups = (np.cumsum(new_group) - 1, starts)
+        return self._edge_groups
+
+    def node_index(self, osm_ids):
+        """Node indices of OSM node ids (-1 for the unknown ones)."""
+        if self._node_order is None:
+            self._node_order = np.argsort(self.node_ids)
+        osm_ids = np.atleast_1d(np.asarray(osm_ids, dtype=np.int64))
+        sorted_ids = self.node_ids[self._node_order]
+        positions = np.minimum(np.searchsorted(sorted_ids, osm_ids), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == osm_ids
+        return np.where(found, self._node_order[positions], -1)
+
+    def edges_between(self, u, v):
+        """Ids of all the (parallel) edges from node index u to node index v."""
+        start, end = self.indptr[u], self.indptr[u + 1]
+        return start + np.flatnonzero(self.indices[start:end] == v)
+
+    def edge_coords(self, edge):
+        """(k, 2) lon/lat coordinates of an edge, from its source to its target."""
+        return self.geom_coords[self.geom_offsets[edge]:self.geom_offsets[edge + 1]]
+
+    def build_node_index(self):
+        """
+        Build the KD-tree used to snap coordinates to nodes.
+
+        Nodes are indexed as points on the unit sphere: the euclidean (chord)
+        distance grows with the great-circle one, so the nearest neighbour is
+        exact everywhere, with no lon/lat distortion.
+        """
+        if self._node_tree is None:
+            self._node_tree = cKDTree(_unit_vectors(self.x, self.y))
+        return self._node_tree
+
+    def nearest_nodes(self, longitudes, latitudes):
+        """
+        Snap many points at once, O(log n) per point.
+
+        Returns:
+        --------
+        nodes : numpy.ndarray
+            Index of the closest node of every point
+        distances : numpy.ndarray
+            Great-circle distance in meters between each point and its node
+        """
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        chords, nodes = self.build_node_index().query(_unit_vectors(longitudes, latitudes))
+        distances = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chords / 2, 1.0))
+        return nodes, distances
+
+    def nearest_node(self, longitude, latitude):
+        """Index of the node closest to a point."""
+        nodes, _ = self.nearest_nodes(longitude, latitude)
+        return int(nodes[0])
+
+    def build_adjacency(self, weights):
+        """
+        Simple (no parallel edges) CSR matrix for scipy.sparse.csgraph.
+
+        The matrix has exactly one entry per group of parallel edges, in
+        group order, whatever the weights: entry i always stands for group i,
+        so an overlay can rewrite `data` in place of rebuilding the matrix.
+        Closed roads keep an infinite weight, which no search ever relaxes.
+
+        Returns:
+        --------
+        matrix : scipy.sparse.csr_matrix
+            n x n matrix holding, for every (u, v), the cheapest parallel edge
+        edge_ids : numpy.ndarray
+            Original edge id of every stored entry of the matrix
+        """
+        n = self.number_of_nodes()
+        group, starts = self.edge_groups()
+        if len(group) == 0:
+            return csr_matrix((n, n)), np.zeros(0, dtype=np.int64)
+
+        # parallel edges are contiguous, keep the cheapest of each group
+        order = np.lexsort((weights, group))
+        best = order[starts[:-1]]
+
+        # csgraph ignores zero entries, keep zero-length edges as tiny weights
+        data = np.maximum(np.asarray(weights[best], dtype=np.float64), 1e-9)
+        indptr = np.searchsorted(self.edge_sources()[best], np.arange(n + 1))
+        matrix = csr_matrix((data, self.indices[best], indptr), shape=(n, n))
+        return matrix, best
+
+    @classmethod
+    def from_networkx(cls, G, meta=None):
+        """Flatten an OSMnx MultiDiGraph (lon/lat, 'length' on every edge, 'travel_time' if set)."""
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        index = {node: i for i, node in enumerate(node_ids.tolist())}
+        x = np.array([G.nodes[node]["x"] for node in G.nodes], dtype=np.float64)
+        y = np.array([G.nodes[node]["y"] for node in G.nodes], dtype=np.float64)
+
+        edges = sorted(
+            ((index[u], index[v], key, data) for u, v, key, data in G.edges(keys=True, data=True)),
+            key=lambda edge: (edge[0], edge[1], edge[2]),
+        )
+        sources = np.array([edge[0] for edge in edges], dtype=np.int64)
+        indptr = np.searchsorted(sources, np.arange(len(node_ids) + 1)).astype(np.int64)
+        indices = np.array([edge[1] for edge in edges], dtype=np.int32)
+        length = np.array([edge[3].get("length", 1.0) for edge in edges], dtype=np.float64)
+        travel_time = None
+        if edges and all("travel_time" in edge[3] for edge in edges):
+            travel_time = np.array([edge[3]["travel_time"] for edge in edges], dtype=np.float64)
+
+        geom_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        coords = []
+        for e, (u, v, _, data) in enumerate(edges):
+            geometry = data.get("geometry")
+            if geometry is not None and not geometry.is_empty:
+                points = list(geometry.coords)
+            else:
+                # straight line between the two nodes
+                points = [(x[u], y[u]), (x[v], y[v])]
+            coords.extend(points)
+            geom_offsets[e + 1] = geom_offsets[e] + len(points)
+        geom_coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+
+        arrays = {
+            "node_ids": node_ids, "x": x, "y": y, "indptr": indptr, "indices": indices,
+            "length": length, "geom_offsets": geom_offsets, "geom_coords": geom_coords,
+            "travel_time": travel_time,
+        }
+        return cls(arrays, meta=meta)
+
+    def save(self, path):
+        """Write the graph to `path` (atomically, through a temporary file)."""
+        arrays = {name: (getattr(self, name), dtype) for name, dtype in self._stored_arrays()}
+        return write_arrays(path, arrays, self.meta)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a graph written by `save`, nothing is read until it is used."""
+        arrays, meta = read_arrays(path)
+        return cls(arrays, meta=meta, path=path)
+
+
+def write_arrays(path, arrays, meta):
+    """
+    Write named arrays in the .graph layout (atomically, through a temporary file).
+
+    Parameters:
+    -----------
+    arrays : dict
+        name -> (array, little endian dtype string)
+    meta : dict
+        JSON serializable metadata
+    """
+    layout = {}
+    offset = 0
+    for name, (array, dtype) in arrays.items():
+        array = np.ascontiguousarray(array, dtype=dtype)
+        layout[name] = {"dtype": dtype, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({"version": FORMAT_VERSION, "meta": meta, "arrays": layout}).encode("utf-8")
+    data_start = -(-(16 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # a temporary file of our own: every worker may export the same missing
+    # graph at startup, each one replaces the target with a complete file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for name, (array, dtype) in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def read_arrays(path):
+    """Memory-map the arrays of a file written by `write_arrays`, returns (arrays, meta)."""
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(buffer[:8]) != MAGIC:
+        raise ValueError(f"{path} is not a compact graph file")
+    header_length = int.from_bytes(bytes(buffer[8:16]), "little")
+    header = json.loads(bytes(buffer[16:16 + header_length]).decode("utf-8"))
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"{path} has unsupported format version {header['version']}")
+    data_start = -(-(16 + header_length) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]
+        ).reshape(spec["shape"])
+    return arrays, header["meta"]
+
+
+def haversine_m(longitudes1, latitudes1, longitudes2, latitudes2):
+    """Vectorized great-circle distance in meters."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (longitudes1, latitudes1, longitudes2, latitudes2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _unit_vectors(longitudes, latitudes):
+    lon = np.radians(longitudes)
+    lat = np.radians(latitudes)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+import shapely
+from maps_utils.hazards import GEOJSON_CRS, HAZARD_BUFFER_M, HAZARD_PENALTY, METRIC_CRS, transformer
+
+# Side of a grid cell in meters, and of a tile in cells: the grid is
+# recomputed tile by tile when a layer changes
+AERIAL_RESOLUTION_M = float(os.environ.get("AERIAL_RESOLUTION_M", 25))
+TILE_CELLS = 64
+# Cells per side of a cell of the next coarser level: fine cells, coarse
+# cells (8 x 8 fine cells) and tiles (8 x 8 coarse cells)
+COARSE_FACTOR = 8
+
+# Immutable state of a grid, a search keeps the snapshot it started with.
+# The pyramids are the (coarse, tiles) levels pooled with max and with min.
+GridSnapshot = namedtuple("GridSnapshot", ["cost", "max_pyramid", "min_pyramid", "version"])
+
+
+class CostGrid:
+    """
+    Flight cost raster of one region, in METRIC_CRS.
+
+    Every cell holds the cost of flying one meter through it: 1 in free
+    air, more near the hazards, inf in the no-fly zones. Each
+    coarser level pools COARSE_FACTOR x COARSE_FACTOR cells of the previous
+    one: the max-pool never underestimates an obstacle, the min-pool keeps
+    the gaps narrower than a cell.
+
+    The layers (no-fly zones, hazards) are rasterized once, an
+    update only recomputes the tiles it touches and swaps in a new snapshot.
+    """
+
+    def __init__(self, boundary, resolution_m=AERIAL_RESOLUTION_M, no_fly=None, hazards=None, margin_m=1000):
+        self.resolution = resolution_m
+        minx, miny, maxx, maxy = shapely.transform(
+            boundary, _to_metric, interleaved=False
+        ).bounds
+        # a small margin lets the flights go around obstacles on the border
+        self.x0, self.y0 = minx - margin_m, miny - margin_m
+        self.rows = int(np.ceil((maxy - miny + 2 * margin_m) / resolution_m))
+        self.cols = int(np.ceil((maxx - minx + 2 * margin_m) / resolution_m))
+        # coarse cells are made of whole tiles of fine cells
+        self.rows += -self.rows % TILE_CELLS
+        self.cols += -self.cols % TILE_CELLS
+
+        self.no_fly = None
+        self.hazards = None
+        self._lock = threading.Lock()
+        pyramid = (
+            np.ones((self.rows // COARSE_FACTOR, self.cols // COARSE_FACTOR), dtype=np.float32),
+            np.ones((self.rows // TILE_CELLS, self.cols // TILE_CELLS), dtype=np.float32),
+        )
+        self.snapshot = GridSnapshot(
+            np.ones((self.rows, self.cols), dtype=np.float32),
+            pyramid, tuple(level.copy() for level in pyramid), 0,
+        )
+        self.update(no_fly=no_fly, hazards=hazards)
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+    @property
+    def nbytes(self):
+        cost, max_pyramid, min_pyramid, _ = self.snapshot
+        return cost.nbytes + sum(level.nbytes for level in max_pyramid + min_pyramid)
+
+    def to_cells(self, longitudes, latitudes):
+        """(rows, cols) of lon/lat points, -1 for the points outside the grid."""
+        x, y = transformer(GEOJSON_CRS, METRIC_CRS).transform(
+            np.atleast_1d(longitudes), np.atleast_1d(latitudes)
+        )
+        rows = np.floor((np.asarray(y) - self.y0) / self.resolution).astype(np.int64)
+        cols = np.floor((np.asarray(x) - self.x0) / self.resolution).astype(np.int64)
+        outside = (rows < 0) | (rows >= self.rows) | (cols < 0) | (cols >= self.cols)
+        rows[outside] = -1
+        cols[outside] = -1
+        return rows, cols
+
+    def to_lonlat(self, rows, cols):
+        """Lon/lat of the centers of cells."""
+        x, y = self.cell_centers(np.asarray(rows), np.asarray(cols))
+        return transformer(METRIC_CRS, GEOJSON_CRS).transform(x, y)
+
+    def cell_centers(self, rows, cols):
+        return (
+            self.x0 + (cols + 0.5) * self.resolution,
+            self.y0 + (rows + 0.5) * self.resolution,
+        )
+
+    def tiles_in_bounds(self, minx, miny, maxx, maxy):
+        """(tile row, tile col) of the tiles intersecting metric bounds."""
+        size = TILE_CELLS * self.resolution
+        tile_rows, tile_cols = self.rows // TILE_CELLS, self.cols // TILE_CELLS
+        r0 = max(int((miny - self.y0) // size), 0)
+        r1 = min(int((maxy - self.y0) // size), tile_rows - 1)
+        c0 = max(int((minx - self.x0) // size), 0)
+        c1 = min(int((maxx - self.x0) // size), tile_cols - 1)
+        if r0 > r1 or c0 > c1:
+            return set()
+        return {(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)}
+
+    def _hazard_tiles(self, hazards):
+        """Tiles within the buffer of any detection."""
+        if hazards is None or len(hazards) == 0:
+            return set()
+        size = TILE_CELLS * self.resolution
+        # offsets at most one tile apart cover the whole buffer square
+        offsets = np.linspace(-HAZARD_BUFFER_M, HAZARD_BUFFER_M, int(np.ceil(2 * HAZARD_BUFFER_M / size)) + 1)
+        tiles = set()
+        for dx in offsets:
+            for dy in offsets:
+                rows = np.floor((hazards.y + dy - self.y0) / size).astype(np.int64)
+                cols = np.floor((hazards.x + dx - self.x0) / size).astype(np.int64)
+                inside = (
+                    (rows >= 0) & (rows < self.rows // TILE_CELLS)
+                    & (cols >= 0) & (cols < self.cols // TILE_CELLS)
+                )
+                tiles.update(zip(rows[inside].tolist(), cols[inside].tolist()))
+        return tiles
+
+    def update(self, no_fly=..., hazards=...):
+        """
+        Replace some layers and recompute the tiles they touch.
+
+        Parameters:
+        -----------
+        no_fly : shapely geometry or None
+            No-fly zones, in lon/lat
+        hazards : HazardFeed or None
+            Detections to fly around (penalized, never closed: the incident
+            itself is often in the middle of them)
+
+        Returns:
+        --------
+        tiles : int
+            Number of tiles recomputed
+        """
+        with self._lock:
+            tiles = set()
+            if no_fly is not ...:
+                if no_fly is not None:
+                    # grown by half a cell diagonal: a cell partly inside is blocked
+                    no_fly = shapely.transform(no_fly, _to_metric, interleaved=False)
+                    no_fly = no_fly.buffer(self.resolution * 0.71)
+                for geometry in (self.no_fly, no_fly):
+                    if geometry is not None and not geometry.is_empty:
+                        tiles |= self.tiles_in_bounds(*geometry.bounds)
+                self.no_fly = no_fly
+                if no_fly is not None:
+                    shapely.prepare(no_fly)
+            if hazards is not ...:
+                tiles |= self._hazard_tiles(self.hazards) | self._hazard_tiles(hazards)
+                self.hazards = hazards
+            if not tiles:
+                return 0
+
+            # copy on write: the searches running on the old snapshot are unaffected
+            cost = self.snapshot.cost.copy()
+            coarse_max, tiles_max = (level.copy() for level in self.snapshot.max_pyramid)
+            coarse_min, tiles_min = (level.copy() for level in self.snapshot.min_pyramid)
+            per_tile = TILE_CELLS // COARSE_FACTOR
+            for r, c in tiles:
+                block = (slice(r * TILE_CELLS, (r + 1) * TILE_CELLS), slice(c * TILE_CELLS, (c + 1) * TILE_CELLS))
+                cost[block] = self._tile_cost(r, c)
+                pooled = cost[block].reshape(per_tile, COARSE_FACTOR, per_tile, COARSE_FACTOR)
+                coarse_block = (slice(r * per_tile, (r + 1) * per_tile), slice(c * per_tile, (c + 1) * per_tile))
+                coarse_max[coarse_block] = pooled.max(axis=(1, 3))
+                coarse_min[coarse_block] = pooled.min(axis=(1, 3))
+                tiles_max[r, c] = coarse_max[coarse_block].max()
+                tiles_min[r, c] = coarse_min[coarse_block].min()
+            self.snapshot = GridSnapshot(
+                cost, (coarse_max, tiles_max), (coarse_min, tiles_min), self.snapshot.version + 1
+            )
+            return len(tiles)
+
+    def _tile_cost(self, tile_row, tile_col):
+        rows, cols = np.mgrid[
+            tile_row * TILE_CELLS:(tile_row + 1) * TILE_CELLS,
+            tile_col * TILE_CELLS:(tile_col + 1) * TILE_CELLS,
+        ]
+        x, y = self.cell_centers(rows, cols)
+        cost = np.ones(rows.shape, dtype=np.float32)
+
+        if self.hazards is not None and self.hazards.tree is not None:
+            distances, _ = self.hazards.tree.query(
+                np.column_stack([x.ravel(), y.ravel()]), distance_upper_bound=HAZARD_BUFFER_M
+            )
+            cost[(distances <= HAZARD_BUFFER_M).reshape(cost.shape)] *= HAZARD_PENALTY
+        if self.no_fly is not None:
+            cost[shapely.contains_xy(self.no_fly, x, y)] = np.inf
+        return cost
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "cols": self.cols,
+            "resolution_m": self.resolution,
+            "version": self.snapshot.version,
+            "bytes": self.nbytes,
+            "blocked_cells": int(np.isinf(self.snapshot.cost).sum()),
+        }
+
+
+def _to_metric(x, y):
+    return transformer(GEOJSON_CRS, METRIC_CRS).transform(x, y)
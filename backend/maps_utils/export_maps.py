@@ -0,0 +1,22 @@
+"""
+Export every map of the maps config file to the compact on-disk format.
+
+Run from the backend directory:
+    python -m maps_utils.export_maps [name ...]
+"""
+import sys
+import time
+from maps_utils.maps_init import export_map, load_map_config
+
+
+def main(names):
+    for place in load_map_config():
+        if names and place["name"] not in names:
+            continue
+        started = time.perf_counter()
+        path = export_map(place)
+        print(f"{place['name']}: written {path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
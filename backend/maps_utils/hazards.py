@@ -0,0 +1,244 @@
+import json
+import os
+import time
+from functools import lru_cache
+import numpy as np
+from pyproj import CRS, Transformer
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+# Metric CRS of the hazard index: Lambert azimuthal equal-area over Europe,
+# the CRS of the EFFIS/FIRMS burnt areas feeds
+METRIC_CRS = "EPSG:3035"
+GEOJSON_CRS = "EPSG:4326"
+
+# Roads closer than HAZARD_CLOSE_M to a detection are closed, the ones closer
+# than HAZARD_BUFFER_M have their cost multiplied by HAZARD_PENALTY
+HAZARD_BUFFER_M = float(os.environ.get("HAZARD_BUFFER_M", 500))
+HAZARD_CLOSE_M = float(os.environ.get("HAZARD_CLOSE_M", 150))
+HAZARD_PENALTY = float(os.environ.get("HAZARD_PENALTY", 5))
+
+
+class HazardFeed:
+    """
+    Satellite hotspot detections, indexed by a KD-tree in a metric CRS.
+
+    Parameters:
+    -----------
+    x, y : numpy.ndarray
+        Coordinates of the detections in METRIC_CRS
+    frp, confidence : numpy.ndarray
+        Fire radiative power and confidence of every detection (nan if unknown)
+    acquired : list
+        Acquisition time of every detection, as given by the feed
+    """
+
+    def __init__(self, x, y, frp, confidence, acquired, source=None):
+        self.x = x
+        self.y = y
+        self.frp = frp
+        self.confidence = confidence
+        self.acquired = acquired
+        self.source = source
+        self.tree = cKDTree(np.column_stack([x, y])) if len(x) else None
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_geojson(cls, collection, min_confidence=None, source=None):
+        """
+        Bulk-load a GeoJSON FeatureCollection of Point detections.
+
+        The points are reprojected all at once from the CRS named in the
+        collection (EPSG:4326 when missing, as in plain GeoJSON).
+        """
+        crs_name = (collection.get("crs") or {}).get("properties", {}).get("name", GEOJSON_CRS)
+        points = [
+            feature for feature in collection.get("features", [])
+            if (feature.get("geometry") or {}).get("type") == "Point"
+        ]
+        coords = np.array(
+            [feature["geometry"]["coordinates"][:2] for feature in points], dtype=np.float64
+        ).reshape(-1, 2)
+        frp = _numbers(feature["properties"].get("frp") for feature in points)
+        confidence = _numbers(feature["properties"].get("confidence") for feature in points)
+        acquired = [feature["properties"].get("acq_at") for feature in points]
+
+        if min_confidence is not None:
+            # detections of unknown confidence are kept, a missed fire costs more
+            keep = ~(confidence < min_confidence)
+            coords, frp, confidence = coords[keep], frp[keep], confidence[keep]
+            acquired = [value for value, kept in zip(acquired, keep.tolist()) if kept]
+
+        x, y = coords[:, 0], coords[:, 1]
+        if not CRS.from_user_input(crs_name).equals(CRS.from_user_input(METRIC_CRS)):
+            x, y = transformer(crs_name, METRIC_CRS).transform(x, y)
+        return cls(np.asarray(x), np.asarray(y), frp, confidence, acquired, source=source)
+
+    @classmethod
+    def load(cls, path, min_confidence=None):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_geojson(json.load(f), min_confidence, source=path)
+
+    def edge_distances(self, graph, buffer_m=None, spacing=None):
+        """
+        Distance in meters from every edge of a CompactGraph (or of a tile
+        of a TiledGraph) to the closest detection, inf beyond `buffer_m`
+        (HAZARD_BUFFER_M by default).
+
+        The segments of the edges are sampled every `spacing` meters at
+        most (HAZARD_BUFFER_M / 2 by default): the closest detection to a
+        sample bounds the distance of its segment, and any detection closer
+        to the segment is within that bound plus `spacing` / 2 of one of
+        its samples. The exact point to segment distance is then computed
+        for these candidates only.
+        """
+        buffer_m = HAZARD_BUFFER_M if buffer_m is None else buffer_m
+        spacing = spacing or buffer_m / 2
+        distances = np.full(len(graph.geom_offsets) - 1, np.inf)
+        if self.tree is None or len(distances) == 0:
+            return distances
+
+        starts, ends, segment_edges = edge_segments(graph)
+        samples, sample_segments = segment_samples(starts, ends, spacing)
+        nearest, _ = self.tree.query(samples, distance_upper_bound=buffer_m + spacing / 2)
+        bounds = np.full(len(starts), np.inf)
+        np.minimum.at(bounds, sample_segments, nearest)
+        near = np.flatnonzero(np.isfinite(bounds[sample_segments]))
+        if len(near) == 0:
+            return distances
+        radii = np.minimum(bounds[sample_segments[near]], buffer_m) + spacing / 2
+        neighbours = self.tree.query_ball_point(samples[near], radii)
+        counts = np.array([len(found) for found in neighbours], dtype=np.int64)
+        pairs = np.unique(np.column_stack([
+            np.repeat(sample_segments[near], counts),
+            np.concatenate(neighbours).astype(np.int64),
+        ]), axis=0)
+        segments, detections = pairs[:, 0], pairs[:, 1]
+
+        exact = segment_distances(
+            np.column_stack([self.x[detections], self.y[detections]]), starts[segments], ends[segments]
+        )
+        exact[exact > buffer_m] = np.inf
+        np.minimum.at(distances, segment_edges[segments], exact)
+        return distances
+
+    def edge_factors(self, graph, buffer_m=None, close_m=None, penalty=None):
+        """
+        The edges of `graph` near a detection and their cost multiplier
+        (inf for the closed ones).
+        """
+        buffer_m = HAZARD_BUFFER_M if buffer_m is None else buffer_m
+        close_m = HAZARD_CLOSE_M if close_m is None else close_m
+        penalty = HAZARD_PENALTY if penalty is None else penalty
+        distances = self.edge_distances(graph, buffer_m)
+        edges = np.flatnonzero(distances <= buffer_m)
+        factors = np.where(distances[edges] <= close_m, np.inf, penalty)
+        return edges, factors
+
+    def stats(self):
+        return {
+            "detections": len(self),
+            "source": self.source,
+            "latest": max((value for value in self.acquired if value), default=None),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def closure_zones(sources, targets, number_of_nodes):
+    """
+    Group the closed edges in zones, the sets of closed roads joined by
+    their ends (usually the ones around a detection).
+
+    Parameters:
+    -----------
+    sources, targets : numpy.ndarray
+        Ends of the closed edges
+    number_of_nodes : int
+        Nodes of the graph
+
+    Returns:
+    --------
+    edge_zones : numpy.ndarray
+        Zone of every closed edge
+    node_zones : numpy.ndarray
+        Zone of every node of the graph, -1 for the nodes no closed edge touches
+    """
+    nodes, ends = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+    node_zones = np.full(number_of_nodes, -1, dtype=np.int64)
+    if len(nodes) == 0:
+        return np.zeros(0, dtype=np.int64), node_zones
+    ends = ends.reshape(2, -1)
+    adjacency = coo_matrix((np.ones(ends.shape[1]), (ends[0], ends[1])), shape=(len(nodes), len(nodes)))
+    _, labels = connected_components(adjacency, directed=False)
+    node_zones[nodes] = labels
+    return labels[ends[0]], node_zones
+
+
+def edge_segments(graph):
+    """
+    Straight segments of the edge geometries of a graph, in METRIC_CRS.
+
+    Returns:
+    --------
+    starts, ends : numpy.ndarray
+        (k, 2) ends of every segment
+    edges : numpy.ndarray
+        Edge of every segment
+    """
+    offsets = graph.geom_offsets
+    vertices = np.column_stack(
+        transformer(GEOJSON_CRS, METRIC_CRS).transform(graph.geom_coords[:, 0], graph.geom_coords[:, 1])
+    )
+    vertex_edges = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    # segments join consecutive vertices of the same edge
+    first = np.flatnonzero(vertex_edges[1:] == vertex_edges[:-1])
+    return vertices[first], vertices[first + 1], vertex_edges[first]
+
+
+def segment_samples(starts, ends, spacing):
+    """
+    Points at the middle of equal pieces, at most `spacing` long, of every
+    segment: any point of a segment is within `spacing` / 2 of one of them.
+
+    Returns:
+    --------
+    points : numpy.ndarray
+        (k, 2) sample points
+    segments : numpy.ndarray
+        Segment of every sample point
+    """
+    lengths = np.hypot(*(ends - starts).T)
+    counts = np.maximum(np.ceil(lengths / spacing), 1).astype(np.int64)
+    segments = np.repeat(np.arange(len(starts)), counts)
+    rank = np.arange(len(segments)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = ((rank + 0.5) / counts[segments])[:, None]
+    points = starts[segments] + fractions * (ends[segments] - starts[segments])
+    return points, segments
+
+
+def segment_distances(points, starts, ends):
+    """Distance from every point to the segment of the same row."""
+    direction = ends - starts
+    squared = np.einsum("ij,ij->i", direction, direction)
+    along = np.einsum("ij,ij->i", points - starts, direction)
+    fractions = np.clip(np.divide(along, squared, out=np.zeros_like(along), where=squared > 0), 0.0, 1.0)
+    return np.hypot(*(points - starts - fractions[:, None] * direction).T)
+
+
+def _numbers(values):
+    """Float array of feed properties, nan where they are missing or not numeric."""
+    return np.array(
+        [value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+         for value in values],
+        dtype=np.float64,
+    )
+
+
+@lru_cache(maxsize=None)
+def transformer(source, target):
+    """Shared lon/lat-ordered transformer (thread-safe since pyproj 3.1)."""
+    return Transformer.from_crs(source, target, always_xy=True)
@@ -0,0 +1,77 @@
+import time
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+
+class Landmarks:
+    """
+    ALT preprocessing (A*, Landmarks, Triangle inequality) of one graph.
+
+    For a few landmark nodes l the exact distances d(l, v) and d(v, l) to
+    every node v are computed once. By the triangle inequality
+        d(v, t) >= d(l, t) - d(l, v)   and   d(v, t) >= d(v, l) - d(t, l)
+    which gives A* a consistent lower bound, so the search stays exact while
+    settling only the nodes around the shortest path. The bounds also hold
+    for any overlay whose weights never go below the ones of `profile`.
+    """
+
+    def __init__(self, profile, count=16, seed=0):
+        started = time.perf_counter()
+        matrix, reverse = profile.matrix, profile.reverse
+        self.weight = profile.name
+        self.nodes = _pick_landmarks(matrix, reverse, count, seed)
+        # (n, k) so the k bounds of one node are contiguous
+        self.from_landmark = np.ascontiguousarray(dijkstra(matrix, indices=self.nodes).T)
+        self.to_landmark = np.ascontiguousarray(dijkstra(reverse, indices=self.nodes).T)
+        self.preprocessing_seconds = time.perf_counter() - started
+
+    @property
+    def nbytes(self):
+        return self.from_landmark.nbytes + self.to_landmark.nbytes
+
+    def stats(self):
+        return {
+            "weight": self.weight,
+            "count": len(self.nodes),
+            "preprocessing_seconds": round(self.preprocessing_seconds, 3),
+            "bytes": self.nbytes,
+        }
+
+    def active_landmarks(self, target, active=4):
+        """
+        The `active` landmarks giving the best bounds toward `target`.
+
+        Using only a few of them per query keeps every evaluation of the
+        bound cheap, the others rarely tighten it.
+        """
+        with np.errstate(invalid="ignore"):
+            usefulness = np.maximum(self.from_landmark[target], self.to_landmark[target])
+        usefulness = np.nan_to_num(usefulness, posinf=-1.0)
+        return np.argsort(usefulness)[::-1][:active].astype(np.int64)
+
+
+def _pick_landmarks(matrix, reverse, count, seed):
+    """Farthest-point selection: every landmark is far from the previous ones."""
+    n = matrix.shape[0]
+    count = min(count, n)
+    rng = np.random.default_rng(seed)
+    landmarks = [int(rng.integers(n))]
+    while len(landmarks) < count:
+        # symmetric distance to the closest landmark, in either direction
+        forward = dijkstra(matrix, indices=landmarks, min_only=True)
+        backward = dijkstra(reverse, indices=landmarks, min_only=True)
+        spread = np.minimum(forward, backward)
+        spread[~np.isfinite(spread)] = -1.0
+        spread[landmarks] = -1.0
+        candidate = int(np.argmax(spread))
+        if spread[candidate] < 0:
+            break
+        landmarks.append(candidate)
+    # the first, random, landmark is replaced by the farthest from the others
+    if len(landmarks) > 1:
+        forward = dijkstra(matrix, indices=landmarks[1:], min_only=True)
+        forward[~np.isfinite(forward)] = -1.0
+        forward[landmarks] = -1.0
+        if forward.max() >= 0:
+            landmarks[0] = int(np.argmax(forward))
+    return np.array(landmarks, dtype=np.int64)
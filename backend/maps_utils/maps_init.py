@@ -1,15 +1,502 @@
+import json
+import os
+import threading
+import time
+import numpy as np
 import osmnx as ox
+import shapely
+from shapely.strtree import STRtree
+from maps_utils.compact_graph import CompactGraph
+from maps_utils.cost_grid import CostGrid
+from maps_utils.hazards import HazardFeed
+from maps_utils.landmarks import Landmarks
+from maps_utils.tiled_graph import INDEX_FILE, TILE_SIZE_DEG, TiledGraph, export_tiles
+from maps_utils.weights import BASE_PROFILES, WeightProfiles
+from routing_utils.cache import route_cache
+from routing_utils.search import alt_shortest_path
+
+# Directory with the exported .graph files (see maps_utils/export_maps.py)
+GRAPHS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "graphs")
+
+# List of the maps to serve, can be overridden with the AIRA_MAPS_CONFIG variable
+MAPS_CONFIG = os.environ.get(
+    "AIRA_MAPS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps.json")
+)
+
+# Optional GeoJSON feed of fire detections to avoid from startup
+# (e.g. API_test/data/italy_burnt_areas.json), see maps_utils/hazards.py
+HAZARDS_FEED = os.environ.get("AIRA_HAZARDS_FEED")
+
+# A route whose ends are in two different maps is served by a map containing
+# one end whose roads come within this distance of the other one (e.g. an
+# address just across the border of a municipality)
+ROUTE_MAP_TOLERANCE_M = float(os.environ.get("ROUTE_MAP_TOLERANCE_M", 1000))
+
+
+class MapNotFoundError(LookupError):
+    """No loaded map covers the requested coordinates."""
+
+
+class MapRegistry:
+    """
+    The loaded maps plus an R-tree (STRtree) over their boundary polygons.
+
+    A lookup only tests the few polygons whose bounding box contains the
+    point, so adding a map does not slow down the lookups for the others.
+    When several maps cover a point (a city inside its province) the one
+    with the smallest area, i.e. the most detailed, wins.
+    """
+
+    def __init__(self, maps):
+        self.maps = sorted(maps, key=lambda map_data: map_data["boundary"].area)
+        self.by_name = {map_data["name"]: map_data for map_data in self.maps}
+        self.tree = STRtree([map_data["boundary"] for map_data in self.maps])
+
+    def find_all(self, coordinates):
+        """Every map covering the coordinates, the most detailed first."""
+        point = shapely.Point(coordinates.longitude, coordinates.latitude)
+        hits = self.tree.query(point, predicate="intersects")
+        # maps are sorted by area, so sorting the indices sorts the candidates
+        return [self.maps[i] for i in np.sort(hits)]
+
+    def assign(self, longitudes, latitudes):
+        """
+        Vectorized lookup of many points.
+
+        Returns the index in `maps` of the most detailed map covering every
+        point, -1 for the points outside all the maps.
+        """
+        points = shapely.points(np.column_stack([longitudes, latitudes]))
+        point_idx, map_idx = self.tree.query(points, predicate="intersects")
+        assigned = np.full(len(points), len(self.maps), dtype=np.int64)
+        np.minimum.at(assigned, point_idx, map_idx)
+        assigned[assigned == len(self.maps)] = -1
+        return assigned
+
+    def find(self, coordinates):
+        candidates = self.find_all(coordinates)
+        if not candidates:
+            raise MapNotFoundError(
+                f"No map covers ({coordinates.latitude}, {coordinates.longitude})"
+            )
+        return candidates[0]
+
+    def find_covering(self, coordinates, longitudes, latitudes):
+        """
+        The map of `coordinates` that also covers most of the given points.
+
+        Returns the map and a boolean mask of the points it covers. Among
+        the maps covering the same number of points the most detailed wins.
+        """
+        candidates = self.find_all(coordinates)
+        if not candidates:
+            raise MapNotFoundError(
+                f"No map covers ({coordinates.latitude}, {coordinates.longitude})"
+            )
+        best, best_mask = None, None
+        for map_data in candidates:
+            mask = shapely.contains_xy(map_data["boundary"], longitudes, latitudes)
+            if best_mask is None or mask.sum() > best_mask.sum():
+                best, best_mask = map_data, mask
+            if best_mask.all():
+                break
+        return best, best_mask
+
+    def find_covering_all(self, longitudes, latitudes):
+        """The most detailed map covering every one of the points."""
+        points = shapely.multipoints(np.column_stack([longitudes, latitudes]))
+        hits = self.tree.query(points, predicate="covered_by")
+        if len(hits):
+            return self.maps[int(np.min(hits))]
+        outside = int((self.assign(longitudes, latitudes) < 0).sum())
+        if outside:
+            raise MapNotFoundError(f"{outside} of the {len(longitudes)} points are outside every map")
+        raise MapNotFoundError(
+            f"No loaded map covers all the {len(longitudes)} points: add a map covering the whole area"
+        )
+
+    def find_route_map(self, start_coordinates, end_coordinates, tolerance_m=ROUTE_MAP_TOLERANCE_M):
+        """
+        The most detailed map that contains both ends of a route.
+
+        When no map contains both, the map containing one end whose roads
+        come closest to the other one is used, if they come within
+        `tolerance_m`. Routes are never stitched across two maps.
+        """
+        start_maps = self.find_all(start_coordinates)
+        end_maps = self.find_all(end_coordinates)
+        end_names = {map_data["name"] for map_data in end_maps}
+        for map_data in start_maps:
+            if map_data["name"] in end_names:
+                return map_data
+
+        if not start_maps or not end_maps:
+            outside = start_coordinates if not start_maps else end_coordinates
+            raise MapNotFoundError(
+                f"No map covers ({outside.latitude}, {outside.longitude})"
+            )
+
+        best, best_distance = None, np.inf
+        candidates = [(map_data, end_coordinates) for map_data in start_maps]
+        candidates += [(map_data, start_coordinates) for map_data in end_maps]
+        for map_data, other in candidates:
+            _, distances = map_data["map"].nearest_nodes(other.longitude, other.latitude)
+            if distances[0] <= tolerance_m and distances[0] < best_distance:
+                best, best_distance = map_data, distances[0]
+        if best is not None:
+            return best
+        raise MapNotFoundError(
+            f"Start is in {', '.join(m['name'] for m in start_maps)} and end is in "
+            f"{', '.join(m['name'] for m in end_maps)}, no loaded map contains both or has roads "
+            f"within {tolerance_m:.0f} m of the other end: add a map covering the two areas"
+        )
+
+
+# Process-wide registry of the loaded maps. Requests only ever read the
+# registry reference, a reload builds a brand new registry and swaps it in one
+# assignment, so a request that already picked a graph keeps using it.
+_registry = None
+_maps_version = 0
+_registry_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+# The hazard feed applied to the maps. Indexing a new feed happens in the
+# background, the maps keep routing on the previous hazards meanwhile.
+_hazard_feed = None
+_hazards_lock = threading.Lock()
+_hazards_apply_lock = threading.Lock()
+
+def graph_path(name):
+    return os.path.join(GRAPHS_DIR, f"{name.lower().replace(' ', '_')}.graph")
+
+def tiles_path(name):
+    return os.path.join(GRAPHS_DIR, f"{name.lower().replace(' ', '_')}.tiles")
+
+def load_map_config(path=MAPS_CONFIG):
+    """
+    Read the list of maps to serve.
+
+    Every entry has a "name", an OSMnx "place" query (a string or a list of
+    strings, e.g. all the municipalities of a province) and the "coordinates"
+    of its center. An optional "landmarks" count enables the ALT
+    preprocessing used by the fast routing mode, and optional "no_fly"
+    GeoJSON geometries (lon/lat) are avoided by the aerial routes. With
+    "tiled" the map is split in tiles of "tile_size" degrees loaded on
+    demand, for the regions too big to keep in memory (point-to-point
+    routing and snapping only).
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["maps"]
+
+def build_graph(place):
+    """Download (or read from the OSMnx cache) a place and flatten it."""
+    G = ox.graph_from_place(place["place"], network_type="drive")
+    # free-flow speeds (maxspeed tags, imputed per road type) for the "time" profile
+    G = ox.add_edge_travel_times(ox.add_edge_speeds(G))
+    boundary = ox.geocode_to_gdf(place["place"]).union_all()
+    return CompactGraph.from_networkx(
+        G, meta={"name": place["name"], "place": place["place"], "boundary": boundary.wkt}
+    )
+
+def export_map(place):
+    """Build a place with OSMnx and write its compact .graph file (or its tiles)."""
+    if place.get("tiled"):
+        return export_tiles(
+            build_graph(place), tiles_path(place["name"]), place.get("tile_size", TILE_SIZE_DEG)
+        )
+    return build_graph(place).save(graph_path(place["name"]))
+
+def map_boundary(graph):
+    """Boundary polygon stored at export time, or the hull of the nodes."""
+    if graph.meta.get("boundary"):
+        return shapely.from_wkt(graph.meta["boundary"])
+    return shapely.multipoints(np.column_stack([graph.x, graph.y])).convex_hull
+
+def no_fly_zones(geometries):
+    """Union of GeoJSON geometries, None if there are none."""
+    if not geometries:
+        return None
+    return shapely.union_all([shapely.geometry.shape(geometry) for geometry in geometries])
 
 def load_maps():
-    #TODO do it by retreiving the maps specified in a file
-    return [
-        {
-            "name": "Bologna",
-            "coordinates": (44.4949, 11.3426), # TODO boh
-            "map": ox.graph_from_place("Bologna, Italia", network_type="drive")
-        }
-    ]
+    """
+    Load every map listed in the maps config file.
+
+    Maps are memory-mapped from their exported .graph file, the file is
+    exported first (slow, OSMnx) only when it does not exist yet.
+    """
+    maps = []
+    for place in load_map_config():
+        if place.get("tiled"):
+            maps.append(load_tiled_map(place))
+            continue
+        path = graph_path(place["name"])
+        if not os.path.exists(path):
+            print(f"No exported graph for {place['name']}, building it with OSMnx...")
+            export_map(place)
+        graph = CompactGraph.load(path)
+        graph.build_node_index()
+        weights = WeightProfiles(graph)
+
+        # one set of landmarks per base profile, the overlays reuse the ones
+        # of the profile they derive from
+        landmarks = {}
+        for base in BASE_PROFILES if place.get("landmarks") else ():
+            profile = weights.get(base)
+            landmarks[base] = Landmarks(profile, count=place["landmarks"])
+            # compile (or load from the numba cache) the search kernel now,
+            # not on the first request
+            alt_shortest_path(profile, landmarks[base], 0, graph.number_of_nodes() - 1)
+            stats = landmarks[base].stats()
+            print(f"{place['name']}: {stats['count']} ALT landmarks ({base}) in "
+                  f"{stats['preprocessing_seconds']}s, {stats['bytes'] / 2**20:.1f} MiB")
+
+        maps.append({
+            "name": place["name"],
+            "coordinates": tuple(place["coordinates"]),
+            "map": graph,
+            "boundary": map_boundary(graph),
+            "weights": weights,
+            "landmarks": landmarks,
+            "no_fly": no_fly_zones(place.get("no_fly")),
+            # aerial cost grid, built on the first aerial request
+            "grid": None,
+        })
+    return maps
+
+def load_tiled_map(place):
+    """
+    Open the index of a tiled map, the tiles themselves are read by the
+    searches that need them. A tiled map has no weight profiles (only the
+    base "length" and "time" weights) and no ALT landmarks.
+    """
+    directory = tiles_path(place["name"])
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        print(f"No exported tiles for {place['name']}, building them with OSMnx...")
+        export_map(place)
+    graph = TiledGraph.open(directory)
+    stats = graph.stats()
+    print(f"{place['name']}: {graph.number_of_nodes()} nodes in {stats['tiles']} tiles "
+          f"of {stats['tile_size_deg']} degrees")
+    return {
+        "name": place["name"],
+        "coordinates": tuple(place["coordinates"]),
+        "map": graph,
+        "boundary": map_boundary(graph),
+        "weights": None,
+        "landmarks": {},
+        "no_fly": no_fly_zones(place.get("no_fly")),
+        "grid": None,
+        "tiled": True,
+    }
+
+def _build_registry():
+    """Build every map and tag the entries with a new registry version."""
+    global _maps_version
+    started = time.perf_counter()
+    maps = load_maps()
+    _maps_version += 1
+    for map_data in maps:
+        map_data["version"] = _maps_version
+    print(f"Loaded {len(maps)} map(s) in {time.perf_counter() - started:.2f}s")
+    return MapRegistry(maps)
+
+def get_registry():
+    """Return the shared registry, building it on first use only."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = _build_registry()
+                if HAZARDS_FEED and os.path.exists(HAZARDS_FEED):
+                    _set_hazards(HazardFeed.load(HAZARDS_FEED), registry.maps)
+                _registry = registry
+    return _registry
+
+def get_maps():
+    return get_registry().maps
+
+def reload_maps(background=True):
+    """
+    Rebuild all the maps and atomically replace the registry.
+
+    What was set at runtime survives the reload: the current hazard feed
+    is applied to the new maps, and the no-fly zones and weight overlays
+    set through the API are carried over to the map with the same name
+    (see `_carry_over`).
+
+    Parameters:
+    -----------
+    background : bool
+        Run the rebuild in a daemon thread and return immediately
+
+    Returns:
+    --------
+    started : bool
+        False if another reload is already in progress
+    """
+    if not _reload_lock.acquire(blocking=False):
+        return False
+
+    def _reload():
+        global _registry
+        try:
+            new_registry = _build_registry()
+            # a feed indexed during the rebuild must not be lost in the swap
+            with _hazards_apply_lock:
+                if _registry is not None:
+                    _carry_over(_registry.maps, new_registry.maps)
+                if _hazard_feed is not None:
+                    _apply_hazards(new_registry.maps, _hazard_feed)
+                with _registry_lock:
+                    _registry = new_registry
+            # the cached routes of the old graphs can never match again
+            route_cache.clear()
+            print(f"Maps reloaded (version {_maps_version})")
+        except Exception as e:
+            # keep serving the previous graphs if the rebuild fails
+            print(f"Maps reload failed: {e}")
+        finally:
+            _reload_lock.release()
+
+    if background:
+        threading.Thread(target=_reload, name="maps-reload", daemon=True).start()
+    else:
+        _reload()
+    return True
+
+def is_reloading():
+    return _reload_lock.locked()
+
+def _carry_over(old_maps, new_maps):
+    """
+    Copy the no-fly zones and the weight overlays set through the API from
+    the old maps to the rebuilt ones with the same name.
+
+    A re-exported graph can number its edges differently, so the overlays
+    are matched by the OSM ids of the ends of every road; the roads that
+    are no longer in the new graph are dropped.
+    """
+    old_by_name = {map_data["name"]: map_data for map_data in old_maps}
+    for map_data in new_maps:
+        old = old_by_name.get(map_data["name"])
+        if old is None:
+            continue
+        if old.get("no_fly_updated"):
+            map_data["no_fly"] = old["no_fly"]
+            map_data["no_fly_updated"] = True
+        if old["weights"] is None or map_data["weights"] is None:
+            continue
+        old_graph, graph = old["map"], map_data["map"]
+        for name in old["weights"].overlays():
+            edges, factors = old["weights"].overlay_factors(name)
+            sources = graph.node_index(old_graph.node_ids[old_graph.edge_sources()[edges]])
+            targets = graph.node_index(old_graph.node_ids[old_graph.indices[edges]])
+            new_edges, new_factors = [], []
+            for u, v, factor in zip(sources.tolist(), targets.tolist(), factors.tolist()):
+                found = graph.edges_between(u, v) if u >= 0 and v >= 0 else ()
+                new_edges.extend(found)
+                new_factors.extend([factor] * len(found))
+            map_data["weights"].update(name, new_edges, new_factors)
+
+def _apply_hazards(maps, feed):
+    """Mark the roads near the detections of `feed` on every map."""
+    for map_data in maps:
+        # the roads of a tiled map are never all in memory, its tiles are
+        # marked when the searches read them
+        if map_data.get("tiled"):
+            map_data["map"].set_hazards(feed)
+        elif map_data["weights"] is not None:
+            edges, factors = feed.edge_factors(map_data["map"])
+            map_data["weights"].set_hazards(edges, factors)
+        if map_data["grid"] is not None:
+            map_data["grid"].update(hazards=feed)
+
+def _set_hazards(feed, maps=None):
+    global _hazard_feed
+    with _hazards_apply_lock:
+        # read under the lock, a reload cannot swap the maps in the meantime
+        _apply_hazards(get_maps() if maps is None else maps, feed)
+        _hazard_feed = feed
+
+def update_hazards(collection, background=True):
+    """
+    Index a new hazard feed and swap it in on every map.
+
+    Parameters:
+    -----------
+    collection : bytes or dict
+        GeoJSON FeatureCollection of Point detections (parsed in the
+        background when given as bytes)
+    background : bool
+        Run the indexing in a daemon thread and return immediately
+
+    Returns:
+    --------
+    started : bool
+        False if another feed is already being indexed
+    """
+    if not _hazards_lock.acquire(blocking=False):
+        return False
+
+    def _update():
+        try:
+            started = time.perf_counter()
+            data = json.loads(collection) if isinstance(collection, (bytes, str)) else collection
+            feed = HazardFeed.from_geojson(data, source="upload")
+            _set_hazards(feed)
+            print(f"Hazards updated: {len(feed)} detections in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            # keep avoiding the previous hazards if the new feed is invalid
+            print(f"Hazards update failed: {e}")
+        finally:
+            _hazards_lock.release()
+
+    if background:
+        threading.Thread(target=_update, name="hazards-update", daemon=True).start()
+    else:
+        _update()
+    return True
+
+def is_updating_hazards():
+    return _hazards_lock.locked()
+
+def get_hazard_feed():
+    return _hazard_feed
+
+def get_cost_grid(map_data):
+    """
+    Aerial cost grid of a map, rasterized once on first use with the
+    no-fly zones and the current hazards.
+    """
+    if map_data["grid"] is None:
+        with _hazards_apply_lock:
+            if map_data["grid"] is None:
+                map_data["grid"] = CostGrid(
+                    map_data["boundary"], no_fly=map_data["no_fly"], hazards=_hazard_feed
+                )
+    return map_data["grid"]
+
+def set_no_fly_zones(map_data, geometries):
+    """Replace the no-fly zones of a map, only the touched tiles are rasterized again."""
+    map_data["no_fly"] = no_fly_zones(geometries)
+    # kept over a reload of the maps, instead of the zones of the config
+    map_data["no_fly_updated"] = True
+    return get_cost_grid(map_data).update(no_fly=map_data["no_fly"])
 
 def get_pertinent_map(user_coordinates):
-    #TODO implement this to get the map of the city based on the user location
-    return load_maps()[0]
\ No newline at end of file
+    """The most detailed map covering the user location (MapNotFoundError if none)."""
+    return get_registry().find(user_coordinates)
+
+def get_route_map(start_coordinates, end_coordinates):
+    """The most detailed map containing both the start and the end of a route."""
+    return get_registry().find_route_map(start_coordinates, end_coordinates)
+
+def get_map_covering_all(longitudes, latitudes):
+    """The most detailed map covering all the points (MapNotFoundError if none)."""
+    return get_registry().find_covering_all(longitudes, latitudes)
+
+def get_covering_map(coordinates, longitudes, latitudes):
+    """The map of `coordinates` covering most of the points, with their mask."""
+    return get_registry().find_covering(coordinates, longitudes, latitudes)
+
@@ -0,0 +1,567 @@
+import heapq
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+from numba import njit
+from scipy.spatial import cKDTree
+from maps_utils.compact_graph import (
+    EARTH_RADIUS_M, _unit_vectors, haversine_m, read_arrays, write_arrays,
+)
+from maps_utils.hazards import HAZARD_PENALTY, closure_zones
+from maps_utils.weights import DEFAULT_SPEED_KMH
+from routing_utils.executor import cancel_flag, check_cancelled
+
+# Side of a tile in degrees (~5 km at Italian latitudes)
+TILE_SIZE_DEG = 0.05
+
+# A tiled graph is a directory with an index file and one .graph file per
+# tile. Nodes and edges are numbered tile by tile, so the nodes (and the
+# edges leaving them) of tile t are the ranges node_start[t]:node_start[t+1]
+# and edge_start[t]:edge_start[t+1] of the whole graph.
+INDEX_FILE = "index.graph"
+INDEX_ARRAYS = {
+    "tile_keys": "<i8",     # (T, 2) (column, row) of every tile: floor(lon / size), floor(lat / size)
+    "node_start": "<i8",    # first node of every tile, plus the number of nodes
+    "edge_start": "<i8",    # first edge of every tile, plus the number of edges
+}
+TILE_ARRAYS = {
+    "node_ids": "<i8",      # OSM id of each node of the tile
+    "x": "<f8",
+    "y": "<f8",
+    "indptr": "<i8",        # local CSR row pointer
+    "indices": "<i8",       # global target node of every edge, possibly in another tile
+    "length": "<f8",
+    "geom_offsets": "<i8",
+    "geom_coords": "<f8",
+    "border_ids": "<i8",    # sorted global ids of the targets in other tiles
+    "border_x": "<f8",      # and their coordinates, for the A* bound
+    "border_y": "<f8",
+}
+
+
+class Tile:
+    """Arrays of one tile, copied in RAM, with the KD-tree of its nodes."""
+
+    def __init__(self, arrays):
+        self.travel_time = None
+        for name, array in arrays.items():
+            setattr(self, name, np.array(array))
+        self.tree = cKDTree(_unit_vectors(self.x, self.y))
+
+    @property
+    def nbytes(self):
+        arrays = sum(array.nbytes for array in vars(self).values() if isinstance(array, np.ndarray))
+        # the KD-tree keeps its points plus an index per node
+        return arrays + len(self.x) * 32
+
+
+class TileCache:
+    """
+    Process-wide LRU of the loaded tiles under a memory budget.
+
+    The searches copy what they need out of the tiles, so evicting a tile
+    never breaks a running search: it is read again from disk by the next
+    query that needs it.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.peak_bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, directory, tile):
+        key = (directory, tile)
+        with self._lock:
+            loaded = self._tiles.get(key)
+            if loaded is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return loaded
+
+        # read outside the lock, two threads may read the same tile at worst
+        arrays, _ = read_arrays(os.path.join(directory, tile_file(tile)))
+        loaded = Tile(arrays)
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = loaded
+                self._bytes += loaded.nbytes
+                self.loads += 1
+                self.peak_bytes = max(self.peak_bytes, self._bytes)
+            # least recently used first, the tile just read is kept
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+            return self._tiles.get(key, loaded)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "tiles": len(self._tiles),
+                "bytes": self._bytes,
+                "peak_bytes": self.peak_bytes,
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+tile_cache = TileCache(max_bytes=int(float(os.environ.get("TILE_CACHE_MB", 256)) * 2**20))
+
+
+class TileHazards:
+    """
+    Hazard factors of the roads of a TiledGraph (see HazardFeed.edge_factors),
+    computed tile by tile the first time a search reads the tile. A new
+    feed gets a new TileHazards, the searches keep the one they started with.
+    """
+
+    def __init__(self, feed, version):
+        self.feed = feed
+        self.version = version
+        self._factors = {}
+
+    def tile_factors(self, t, tile):
+        """Cost multiplier of every edge of tile t (inf for the closed ones)."""
+        edges_factors = self._factors.get(t)
+        if edges_factors is None:
+            # two threads may compute the same tile at worst
+            edges_factors = self._factors[t] = self.feed.edge_factors(tile)
+        factors = np.ones(len(tile.indices))
+        factors[edges_factors[0]] = edges_factors[1]
+        return factors
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "tiles": len(self._factors),
+            "penalized_edges": sum(int(np.isfinite(f).sum()) for _, f in self._factors.values()),
+            "closed_edges": sum(int(np.isinf(f).sum()) for _, f in self._factors.values()),
+        }
+
+
+def tile_file(tile):
+    return f"tile_{tile}.graph"
+
+
+def export_tiles(graph, directory, tile_size=TILE_SIZE_DEG):
+    """
+    Split a CompactGraph into tiles of `tile_size` degrees written to `directory`.
+
+    Nodes and edges are renumbered tile by tile. The edges crossing a tile
+    border keep the global id of their target, whose coordinates are also
+    stored in the tile so that a search can bound the cost of the roads
+    leading to the tiles it has not loaded.
+
+    `graph` is read whole: a map is exported from one CompactGraph built by
+    OSMnx in memory, so the largest map that can be tiled is the largest
+    one OSMnx can build on the exporting machine (the server only ever
+    holds the tiles it routes on).
+    """
+    n, m = graph.number_of_nodes(), graph.number_of_edges()
+    columns = np.floor(np.asarray(graph.x) / tile_size).astype(np.int64)
+    rows = np.floor(np.asarray(graph.y) / tile_size).astype(np.int64)
+    tile_keys, node_tile = np.unique(np.column_stack([columns, rows]), axis=0, return_inverse=True)
+    node_tile = node_tile.ravel()
+
+    # new node ids: tile by tile, in the original order within a tile
+    node_order = np.argsort(node_tile, kind="stable")
+    rank = np.empty(n, dtype=np.int64)
+    rank[node_order] = np.arange(n)
+    node_start = np.searchsorted(node_tile[node_order], np.arange(len(tile_keys) + 1))
+
+    # edges sorted by (new source, new target), parallel edges stay contiguous
+    sources, targets = rank[graph.edge_sources()], rank[graph.indices]
+    edge_order = np.lexsort((np.arange(m), targets, sources))
+    sources, targets = sources[edge_order], targets[edge_order]
+    edge_start = np.searchsorted(sources, node_start)
+
+    length = np.asarray(graph.length, dtype=np.float64)
+    if graph.travel_time is not None:
+        time = np.asarray(graph.travel_time, dtype=np.float64)
+    else:
+        time = length / (DEFAULT_SPEED_KMH / 3.6)
+    x, y = np.asarray(graph.x)[node_order], np.asarray(graph.y)[node_order]
+    node_ids = np.asarray(graph.node_ids)[node_order]
+
+    os.makedirs(directory, exist_ok=True)
+    for t in range(len(tile_keys)):
+        nodes = slice(node_start[t], node_start[t + 1])
+        edges = edge_order[edge_start[t]:edge_start[t + 1]]
+        tile_targets = targets[edge_start[t]:edge_start[t + 1]]
+        border = np.unique(tile_targets[(tile_targets < nodes.start) | (tile_targets >= nodes.stop)])
+        geometry = [graph.edge_coords(edge) for edge in edges.tolist()]
+        values = {
+            "node_ids": node_ids[nodes],
+            "x": x[nodes],
+            "y": y[nodes],
+            "indptr": np.searchsorted(sources[edge_start[t]:edge_start[t + 1]], np.arange(nodes.start, nodes.stop + 1)),
+            "indices": tile_targets,
+            "length": length[edges],
+            "geom_offsets": np.concatenate([[0], np.cumsum([len(line) for line in geometry])]),
+            "geom_coords": np.concatenate(geometry).reshape(-1, 2) if geometry else np.zeros((0, 2)),
+            "border_ids": border,
+            "border_x": x[border],
+            "border_y": y[border],
+        }
+        arrays = {name: (values[name], dtype) for name, dtype in TILE_ARRAYS.items()}
+        if graph.travel_time is not None:
+            arrays["travel_time"] = (time[edges], "<f8")
+        write_arrays(os.path.join(directory, tile_file(t)), arrays, {"tile": t})
+
+    # A* bound of every weight: the smallest weight per meter of straight
+    # line over all the edges, so that it never overestimates a road
+    straight = haversine_m(x[sources], y[sources], x[targets], y[targets])
+    moving = straight > 0
+    scales = {}
+    for name, values in (("length", length), ("time", time)):
+        ratios = values[edge_order][moving] / straight[moving]
+        scales[name] = float(ratios.min()) if len(ratios) else 0.0
+    meta = {
+        **graph.meta,
+        "tile_size": tile_size,
+        "nodes": n,
+        "edges": m,
+        "travel_time": graph.travel_time is not None,
+        "heuristic_scales": scales,
+    }
+    if not meta.get("boundary"):
+        meta["boundary"] = _hull(graph.x, graph.y).wkt
+    index = {
+        "tile_keys": (tile_keys, "<i8"),
+        "node_start": (node_start, "<i8"),
+        "edge_start": (edge_start, "<i8"),
+    }
+    return write_arrays(os.path.join(directory, INDEX_FILE), index, meta)
+
+
+class TiledGraph:
+    """
+    Road network kept on disk and loaded tile by tile.
+
+    Only the index (three small arrays) stays in memory. A route loads the
+    tiles around the line between its ends, then the ones its search
+    frontier reaches, through the shared TileCache; the cold tiles are
+    evicted when the cache goes over its budget. Node and edge ids are the
+    global ones given by `export_tiles`.
+    """
+
+    def __init__(self, directory, index, meta, cache=None):
+        self.directory = directory
+        self.tile_keys = index["tile_keys"]
+        self.node_start = index["node_start"]
+        self.edge_start = index["edge_start"]
+        self.meta = meta
+        self.cache = cache or tile_cache
+        self.tile_size = meta["tile_size"]
+        self._tile_index = {key: t for t, key in enumerate(map(tuple, self.tile_keys.tolist()))}
+        # TileHazards of the current feed, None without hazards
+        self.hazards = None
+        self.node_ids = _TiledColumn(self, "node_ids")
+        self.x = _TiledColumn(self, "x")
+        self.y = _TiledColumn(self, "y")
+
+    @classmethod
+    def open(cls, directory, cache=None):
+        index, meta = read_arrays(os.path.join(directory, INDEX_FILE))
+        return cls(directory, {name: np.array(index[name]) for name in INDEX_ARRAYS}, meta, cache)
+
+    def number_of_nodes(self):
+        return int(self.node_start[-1])
+
+    def number_of_edges(self):
+        return int(self.edge_start[-1])
+
+    @property
+    def nbytes(self):
+        """Memory held by the graph itself, the tiles are accounted by the cache."""
+        return self.tile_keys.nbytes + self.node_start.nbytes + self.edge_start.nbytes
+
+    def tile(self, t):
+        return self.cache.get(self.directory, int(t))
+
+    def node_tiles(self, nodes):
+        return np.searchsorted(self.node_start, nodes, side="right") - 1
+
+    def tiles_near(self, longitude, latitude, ring=0):
+        """Existing tiles at most `ring` tiles away from the tile of a point."""
+        column = int(np.floor(longitude / self.tile_size))
+        row = int(np.floor(latitude / self.tile_size))
+        return {
+            self._tile_index[(c, r)]
+            for c in range(column - ring, column + ring + 1)
+            for r in range(row - ring, row + ring + 1)
+            if (c, r) in self._tile_index
+        }
+
+    def nearest_nodes(self, longitudes, latitudes):
+        """
+        Snap points to their closest node, loading the tiles around them.
+
+        The rings of tiles around a point are searched until the closest
+        node found is nearer than any tile not searched yet.
+        """
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        nodes = np.full(len(longitudes), -1, dtype=np.int64)
+        chords = np.full(len(longitudes), np.inf)
+        # a tile is never narrower than this on the ground, anywhere in the map
+        rows = self.tile_keys[:, 1]
+        max_latitude = max(np.abs(rows).max(), np.abs(rows + 1).max()) * self.tile_size
+        tile_m = np.radians(self.tile_size) * EARTH_RADIUS_M * np.cos(np.radians(min(max_latitude, 89.0)))
+        max_ring = int(np.ptp(self.tile_keys, axis=0).max()) + 1
+
+        for i, (longitude, latitude) in enumerate(zip(longitudes.tolist(), latitudes.tolist())):
+            point = _unit_vectors(longitude, latitude)[0]
+            searched, ring = set(), 0
+            while ring <= max_ring:
+                for t in self.tiles_near(longitude, latitude, ring) - searched:
+                    chord, local = self.tile(t).tree.query(point)
+                    if chord < chords[i]:
+                        chords[i], nodes[i] = chord, self.node_start[t] + local
+                    searched.add(t)
+                distance = 2 * EARTH_RADIUS_M * np.arcsin(min(chords[i] / 2, 1.0))
+                if distance <= ring * tile_m:
+                    break
+                ring += 1
+        distances = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chords / 2, 1.0))
+        return nodes, distances
+
+    def nearest_node(self, longitude, latitude):
+        nodes, _ = self.nearest_nodes(longitude, latitude)
+        return int(nodes[0])
+
+    def set_hazards(self, feed):
+        """Replace the hazards, their factors are computed as the tiles are read."""
+        version = self.hazards.version + 1 if self.hazards is not None else 1
+        self.hazards = TileHazards(feed, version)
+        return version
+
+    def edge_coords(self, edge):
+        t = int(np.searchsorted(self.edge_start, edge, side="right") - 1)
+        tile = self.tile(t)
+        local = edge - self.edge_start[t]
+        return tile.geom_coords[tile.geom_offsets[local]:tile.geom_offsets[local + 1]]
+
+    def _subgraph(self, tiles, weight, pinned, hazards=None, open_at=()):
+        """
+        CSR graph of some tiles, in compact ids: the nodes of the tiles
+        first, then the targets of their border edges in tiles not loaded
+        (leaves of the graph, the "frontier"). `pinned` keeps the tiles
+        read for the query. With `hazards` the weights are multiplied by
+        their factors, but the closure zones touching the nodes `open_at`
+        (global ids, in the tiles) are only penalized.
+
+        Returns:
+        --------
+        graph : tuple
+            (indptr, indices, weights, longitudes, latitudes, edge_ids)
+        nodes : numpy.ndarray
+            Global id of every compact node
+        frontier : int
+            Compact id of the first frontier node
+        """
+        tiles = sorted(tiles)
+        for t in tiles:
+            if t not in pinned:
+                pinned[t] = self.tile(t)
+        loaded = [pinned[t] for t in tiles]
+        offsets = np.full(len(self.tile_keys), -1, dtype=np.int64)
+        counts = np.array([len(tile.x) for tile in loaded], dtype=np.int64)
+        offsets[tiles] = np.cumsum(counts) - counts
+        frontier = int(counts.sum())
+
+        nodes = np.concatenate([np.arange(self.node_start[t], self.node_start[t + 1]) for t in tiles])
+        targets = np.concatenate([tile.indices for tile in loaded])
+        target_tiles = self.node_tiles(targets)
+        compact = offsets[target_tiles] + targets - self.node_start[target_tiles]
+        outside = offsets[target_tiles] < 0
+        border_ids, first = np.unique(np.concatenate([tile.border_ids for tile in loaded]), return_index=True)
+        keep = offsets[self.node_tiles(border_ids)] < 0
+        border_ids, first = border_ids[keep], first[keep]
+        compact[outside] = frontier + np.searchsorted(border_ids, targets[outside])
+
+        longitudes = np.concatenate(
+            [tile.x for tile in loaded] + [np.concatenate([tile.border_x for tile in loaded])[first]]
+        )
+        latitudes = np.concatenate(
+            [tile.y for tile in loaded] + [np.concatenate([tile.border_y for tile in loaded])[first]]
+        )
+
+        edge_counts = np.array([len(tile.indices) for tile in loaded], dtype=np.int64)
+        indptr = np.concatenate(
+            [[0]] + [tile.indptr[1:] + start for tile, start in zip(loaded, np.cumsum(edge_counts) - edge_counts)]
+            + [np.full(len(border_ids), edge_counts.sum())]
+        )
+        edge_ids = np.concatenate([np.arange(self.edge_start[t], self.edge_start[t + 1]) for t in tiles])
+        weights = np.concatenate([_tile_weights(tile, weight) for tile in loaded])
+        if hazards is not None:
+            factors = np.concatenate([hazards.tile_factors(t, tile) for t, tile in zip(tiles, loaded)])
+            closed = np.flatnonzero(np.isinf(factors))
+            sources = np.repeat(np.arange(frontier), np.diff(indptr[:frontier + 1]))
+            edge_zones, node_zones = closure_zones(sources[closed], compact[closed], len(indptr) - 1)
+            zones = node_zones[np.searchsorted(nodes, open_at)]
+            factors[closed[np.isin(edge_zones, zones[zones >= 0])]] = HAZARD_PENALTY
+            weights = weights * factors
+        return (
+            (indptr, compact, weights, longitudes, latitudes, edge_ids),
+            np.concatenate([nodes, border_ids]), frontier,
+        )
+
+    def shortest_path(self, orig_node, dest_node, weight="length", hazards=None):
+        """
+        Edge ids of the cheapest route, None if there is none. With
+        `hazards` (a TileHazards) the route avoids the roads near the
+        detections, as WeightProfile.reopened does on the other maps.
+
+        A* runs on the loaded tiles, the roads leaving them end on frontier
+        nodes. The bound never overestimates, so a frontier node popped
+        before the destination is the only way a cheaper route could exist:
+        its tile is loaded and the search runs again, until the route does
+        not touch the frontier. The result is the one of the whole graph.
+        """
+        if orig_node == dest_node:
+            return []
+        scale = self.meta["heuristic_scales"][weight] * (1 - 1e-9)
+        orig_tile, dest_tile = self.node_tiles([orig_node, dest_node]).tolist()
+        tiles = self._corridor(orig_tile, dest_tile)
+        # the tiles of this query, even if the cache evicts them meanwhile
+        pinned = {}
+        cancel = cancel_flag()
+
+        while True:
+            graph, nodes, frontier = self._subgraph(
+                tiles, weight, pinned, hazards, [orig_node, dest_node]
+            )
+            indptr, indices, weights, longitudes, latitudes, edge_ids = graph
+            orig, dest = np.searchsorted(nodes[:frontier], [orig_node, dest_node])
+            # the frontier nodes come after the sorted nodes of the tiles
+            parents, reached = _tiled_astar(
+                indptr, indices, weights, np.radians(longitudes), np.radians(latitudes),
+                scale * EARTH_RADIUS_M, frontier, orig, dest, cancel,
+            )
+            check_cancelled(cancel)
+            missing = set(self.node_tiles(nodes[reached]).tolist()) - tiles
+            if not missing:
+                break
+            # the search usually goes on past the new tiles, their
+            # neighbours are loaded at once to save a few rounds
+            for t in missing:
+                column, row = self.tile_keys[t]
+                tiles |= self.tiles_near((column + 0.5) * self.tile_size, (row + 0.5) * self.tile_size, 1)
+
+        if parents[dest] < 0:
+            return None
+        sources = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        route = []
+        node = dest
+        while node != orig:
+            route.append(int(edge_ids[parents[node]]))
+            node = sources[parents[node]]
+        route.reverse()
+        return route
+
+    def _corridor(self, orig_tile, dest_tile):
+        """The existing tiles along the line between two tiles, and their neighbours."""
+        (c0, r0), (c1, r1) = self.tile_keys[orig_tile], self.tile_keys[dest_tile]
+        steps = int(max(abs(c1 - c0), abs(r1 - r0))) + 1
+        tiles = set()
+        for fraction in np.linspace(0.0, 1.0, steps + 1):
+            column = np.floor(c0 + 0.5 + fraction * (c1 - c0))
+            row = np.floor(r0 + 0.5 + fraction * (r1 - r0))
+            tiles |= self.tiles_near((column + 0.5) * self.tile_size, (row + 0.5) * self.tile_size, 1)
+        return tiles | {orig_tile, dest_tile}
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "tiles": len(self.tile_keys),
+            "tile_size_deg": self.tile_size,
+            "index_bytes": self.nbytes,
+        }
+
+
+class _TiledColumn:
+    """Read-only node attribute of a TiledGraph, indexed by global node ids."""
+
+    def __init__(self, graph, name):
+        self.graph = graph
+        self.name = name
+
+    def __getitem__(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        values = np.empty(nodes.shape, dtype=np.int64 if self.name == "node_ids" else np.float64)
+        tiles = self.graph.node_tiles(nodes)
+        for t in np.unique(tiles).tolist():
+            selected = tiles == t
+            values[selected] = getattr(self.graph.tile(t), self.name)[nodes[selected] - self.graph.node_start[t]]
+        return values
+
+
+def _tile_weights(tile, weight):
+    if weight == "length":
+        return tile.length
+    if tile.travel_time is not None:
+        return tile.travel_time
+    return tile.length / (DEFAULT_SPEED_KMH / 3.6)
+
+
+def _hull(longitudes, latitudes):
+    return shapely.multipoints(np.column_stack([longitudes, latitudes])).convex_hull
+
+
+@njit(cache=True, nogil=True)
+def _tiled_astar(indptr, indices, weights, longitudes, latitudes, scale, frontier, orig_node, dest_node, cancel):
+    """
+    A* kernel over a tile subgraph, bounded by the great-circle distance
+    times the smallest weight per meter of the graph. Returns the position
+    of the edge every reached node was reached through (-1 elsewhere) and
+    the frontier nodes popped before the destination. Stops early once
+    `cancel[0]` is set.
+    """
+    n = len(indptr) - 1
+    distance = np.full(n, np.inf)
+    parents = np.full(n, -1, dtype=np.int64)
+    settled = np.zeros(n, dtype=np.bool_)
+    reached = []
+    dest_cos = np.cos(latitudes[dest_node])
+
+    distance[orig_node] = 0.0
+    queue = [(0.0, np.int64(orig_node))]
+    while len(queue) > 0:
+        _, node = heapq.heappop(queue)
+        if settled[node]:
+            continue
+        if node == dest_node or cancel[0]:
+            break
+        settled[node] = True
+        if node >= frontier:
+            reached.append(node)
+            continue
+        for position in range(indptr[node], indptr[node + 1]):
+            target = indices[position]
+            new_distance = distance[node] + weights[position]
+            if new_distance < distance[target]:
+                distance[target] = new_distance
+                parents[target] = position
+                a = (np.sin((latitudes[dest_node] - latitudes[target]) / 2) ** 2
+                     + np.cos(latitudes[target]) * dest_cos
+                     * np.sin((longitudes[dest_node] - longitudes[target]) / 2) ** 2)
+                bound = 2 * scale * np.arcsin(np.sqrt(min(a, 1.0)))
+                heapq.heappush(queue, (new_distance + bound, target))
+    return parents, np.array(reached, dtype=np.int64)
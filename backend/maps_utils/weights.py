@@ -0,0 +1,255 @@
+import threading
+import numpy as np
+from scipy.sparse import csr_matrix
+from maps_utils.hazards import HAZARD_PENALTY, closure_zones
+
+# Speed used for the "time" profile of graphs exported without OSMnx speeds
+DEFAULT_SPEED_KMH = 50.0
+
+# Profiles computed from the graph itself. They never change, the ALT
+# landmarks are computed on them and every overlay derives from one of them.
+BASE_PROFILES = ("length", "time")
+
+
+class WeightProfile:
+    """
+    Immutable snapshot of the edge weights of one profile.
+
+    `values` has one weight per edge of the graph (inf for a closed road)
+    and `matrix` is the csgraph adjacency built from it. A search keeps the
+    snapshot it started with, an update builds a new one.
+    """
+
+    def __init__(self, graph, name, values, base, version=0, matrix=None, edge_ids=None,
+                 hazard_version=0):
+        self.graph = graph
+        self.name = name
+        self.base = base
+        self.version = version
+        # version of the hazards applied on top of the weights, 0 for none
+        self.hazard_version = hazard_version
+        self.values = values
+        self.values.flags.writeable = False
+        if matrix is None:
+            matrix, edge_ids = graph.build_adjacency(values)
+        self.matrix = matrix
+        self.edge_ids = edge_ids
+        self._reverse = None
+        # with hazards: the snapshot they were applied to and the closed
+        # edges with their zones, see `reopened`
+        self.without_hazards = None
+        self.closures = None
+
+    @property
+    def reverse(self):
+        """Transpose of `matrix`: searching it from t gives d(v, t) for every v."""
+        if self._reverse is None:
+            self._reverse = self.matrix.T.tocsr()
+        return self._reverse
+
+    def edge_between(self, u, v):
+        """Id of the cheapest edge from node u to node v."""
+        edges = self.graph.edges_between(u, v)
+        return int(edges[np.argmin(self.values[edges])])
+
+    def updated(self, name, values, edges, version, hazard_version=0):
+        """
+        New snapshot named `name` with `values`, which differ from ours on
+        `edges` only.
+
+        Only the matrix entries of the parallel groups holding these edges
+        are recomputed, the structure of the matrix is shared.
+        """
+        group, starts = self.graph.edge_groups()
+        groups = np.unique(group[edges])
+        data = self.matrix.data.copy()
+        edge_ids = self.edge_ids.copy()
+
+        # most roads have a single edge between two nodes
+        single = starts[groups + 1] - starts[groups] == 1
+        edge_ids[groups[single]] = starts[groups[single]]
+        for g in groups[~single]:
+            edge_ids[g] = starts[g] + np.argmin(values[starts[g]:starts[g + 1]])
+        data[groups] = np.maximum(values[edge_ids[groups]], 1e-9)
+
+        matrix = csr_matrix(
+            (data, self.matrix.indices, self.matrix.indptr), shape=self.matrix.shape
+        )
+        return WeightProfile(
+            self.graph, name, values, self.base, version, matrix=matrix, edge_ids=edge_ids,
+            hazard_version=hazard_version,
+        )
+
+    def reopened(self, nodes):
+        """
+        Snapshot where the closure zones touching `nodes` are penalized by
+        HAZARD_PENALTY instead of closed, self when there are none.
+
+        A route may have to start or end inside a closed zone: the incident
+        is often at the detection itself, and a ground unit may already be
+        there. The other closed zones stay closed.
+        """
+        if self.closures is None:
+            return self
+        closed, edge_zones, node_zones = self.closures
+        zones = node_zones[np.asarray(nodes, dtype=np.int64)]
+        edges = closed[np.isin(edge_zones, zones[zones >= 0])]
+        if len(edges) == 0:
+            return self
+        values = self.values.copy()
+        values[edges] = self.without_hazards.values[edges] * HAZARD_PENALTY
+        return self.updated(self.name, values, edges, self.version, self.hazard_version)
+
+    def stats(self):
+        return {"base": self.base, "version": self.version}
+
+
+class WeightProfiles:
+    """
+    The weight profiles of one graph: "length" (meters), "time" (seconds at
+    free-flow speed) and any number of overlays (traffic, weather, ...).
+
+    An overlay is the free-flow travel time multiplied, edge by edge, by a
+    factor >= 1. Factors below 1 are clamped: the weights never go below
+    the base profile, so the landmark bounds of the base stay valid and ALT
+    keeps returning exact routes on the overlay. Updating a few edges copies
+    one array of weights, the graph itself is never copied, and the new
+    snapshot replaces the old one in a single assignment.
+
+    Hazards (see maps_utils/hazards.py) are factors >= 1 applied on top of
+    every profile: each profile has a second snapshot with the hazards,
+    rebuilt by the writer whenever the profile or the hazards change.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        if graph.travel_time is not None:
+            time = np.asarray(graph.travel_time, dtype=np.float64)
+        else:
+            time = np.asarray(graph.length, dtype=np.float64) / (DEFAULT_SPEED_KMH / 3.6)
+        self._profiles = {
+            "length": WeightProfile(graph, "length", np.array(graph.length, dtype=np.float64), "length"),
+            "time": WeightProfile(graph, "time", time, "time"),
+        }
+        self._hazards = (np.zeros(0, dtype=np.int64), np.zeros(0), 0, None)
+        self._with_hazards = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self._profiles)
+
+    def get(self, name, avoid_hazards=False, open_at=None):
+        """
+        Current snapshot of a profile (KeyError if unknown). With the
+        hazards, the closure zones touching the nodes `open_at` (the ends
+        of the route) are penalized instead of closed.
+        """
+        if avoid_hazards:
+            profile = self._with_hazards.get(name) or self._profiles[name]
+            return profile if open_at is None else profile.reopened(open_at)
+        return self._profiles[name]
+
+    def _apply_hazards(self, profile):
+        """Snapshot of `profile` with the current hazards, None if there are none."""
+        edges, factors, hazard_version, closures = self._hazards
+        if len(edges) == 0:
+            return None
+        values = profile.values.copy()
+        values[edges] *= factors
+        hazardous = profile.updated(profile.name, values, edges, profile.version, hazard_version)
+        hazardous.without_hazards = profile
+        hazardous.closures = closures
+        return hazardous
+
+    def set_hazards(self, edges, factors):
+        """
+        Replace the hazards: multiply the cost of `edges` by `factors` (inf
+        closes the road) in every profile, for the requests avoiding them.
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        factors = np.maximum(np.broadcast_to(np.asarray(factors, dtype=np.float64), edges.shape), 1.0)
+        closed = edges[np.isinf(factors)]
+        closures = (closed, *closure_zones(
+            self.graph.edge_sources()[closed], self.graph.indices[closed], self.graph.number_of_nodes()
+        ))
+        with self._lock:
+            self._hazards = (edges, factors, self._hazards[2] + 1, closures)
+            with_hazards = {}
+            for name, profile in self._profiles.items():
+                hazardous = self._apply_hazards(profile)
+                if hazardous is not None:
+                    with_hazards[name] = hazardous
+            self._with_hazards = with_hazards
+        return self._hazards[2]
+
+    def hazard_stats(self):
+        edges, factors, hazard_version, _ = self._hazards
+        return {
+            "version": hazard_version,
+            "penalized_edges": int(np.isfinite(factors).sum()),
+            "closed_edges": int(np.isinf(factors).sum()),
+        }
+
+    def update(self, name, edges, factors):
+        """
+        Multiply the free-flow time of `edges` by `factors` in overlay `name`.
+
+        The overlay is created on first use. A factor of inf (or nan)
+        closes the road, a factor of 1 restores its free-flow time.
+
+        Returns:
+        --------
+        profile : WeightProfile
+            The new snapshot of the overlay
+        """
+        if name in BASE_PROFILES:
+            raise ValueError(f"The {name} profile is computed from the graph and cannot be updated")
+        edges = np.asarray(edges, dtype=np.int64)
+        factors = np.broadcast_to(np.asarray(factors, dtype=np.float64), edges.shape)
+        if len(edges) and (edges.min() < 0 or edges.max() >= self.graph.number_of_edges()):
+            raise ValueError("Unknown edge id")
+        factors = np.where(np.isnan(factors), np.inf, np.maximum(factors, 1.0))
+
+        # writers are serialized, readers never wait
+        with self._lock:
+            base = self._profiles["time"]
+            current = self._profiles.get(name, base)
+            values = current.values.copy()
+            values[edges] = base.values[edges] * factors
+            self._version += 1
+            profile = current.updated(name, values, edges, self._version)
+            hazardous = self._apply_hazards(profile)
+            if hazardous is not None:
+                self._with_hazards = {**self._with_hazards, name: hazardous}
+            self._profiles = {**self._profiles, name: profile}
+        return profile
+
+    def overlays(self):
+        return [name for name in self._profiles if name not in BASE_PROFILES]
+
+    def overlay_factors(self, name):
+        """
+        Edges of overlay `name` off their free-flow time and their factors,
+        what `update` needs to rebuild the overlay (e.g. on a new graph).
+        """
+        base = self._profiles["time"].values
+        values = self._profiles[name].values
+        edges = np.flatnonzero(values != base)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factors = np.where(np.isinf(values[edges]), np.inf, values[edges] / base[edges])
+        return edges, factors
+
+    def reset(self, name):
+        """Drop an overlay, False if it did not exist."""
+        if name in BASE_PROFILES:
+            raise ValueError(f"The {name} profile is computed from the graph and cannot be reset")
+        with self._lock:
+            if name not in self._profiles:
+                return False
+            self._profiles = {key: value for key, value in self._profiles.items() if key != name}
+            self._with_hazards = {key: value for key, value in self._with_hazards.items() if key != name}
+        return True
+
+    def stats(self):
+        return {name: profile.stats() for name, profile in self._profiles.items()}
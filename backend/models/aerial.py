@@ -0,0 +1,5 @@
+from pydantic import BaseModel, Field
+
+class NoFlyZones(BaseModel):
+    # GeoJSON geometries (Polygon, MultiPolygon...) in lon/lat, empty to clear
+    geometries: list[dict] = Field(max_length=10_000)
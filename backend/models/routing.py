@@ -1,4 +1,5 @@
-from pydantic import BaseModel, field_validator
+from typing import Literal, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 class Coordinates(BaseModel):
     latitude: float
@@ -16,4 +17,82 @@ class Coordinates(BaseModel):
     def validate_longitude(cls, value: float) -> float:
         if not -180 <= value <= 180:
             raise ValueError('Longitude must be between -180 and 180 degrees')
-        return value
\ No newline at end of file
+        return value
+
+class PointArrays(BaseModel):
+    # compact parallel arrays instead of one object per point
+    latitudes: list[float] = Field(max_length=100_000)
+    longitudes: list[float] = Field(max_length=100_000)
+
+    @model_validator(mode='after')
+    def validate_coordinates(self):
+        if len(self.latitudes) != len(self.longitudes):
+            raise ValueError('latitudes and longitudes must have the same length')
+        if any(not -90 <= value <= 90 for value in self.latitudes):
+            raise ValueError('Latitude must be between -90 and 90 degrees')
+        if any(not -180 <= value <= 180 for value in self.longitudes):
+            raise ValueError('Longitude must be between -180 and 180 degrees')
+        return self
+
+class SnapRequest(PointArrays):
+    map_name: Optional[str] = None
+
+class MatrixRequest(BaseModel):
+    origins: PointArrays
+    destinations: PointArrays
+
+    @model_validator(mode='after')
+    def validate_size(self):
+        if len(self.origins.latitudes) == 0 or len(self.destinations.latitudes) == 0:
+            raise ValueError('origins and destinations must not be empty')
+        if len(self.origins.latitudes) > 2_000 or len(self.destinations.latitudes) > 2_000:
+            raise ValueError('At most 2000 origins and 2000 destinations per matrix')
+        return self
+
+# Average speeds used for the ETA when a vehicle does not report its own
+DEFAULT_SPEEDS_KMH = {
+    "ambulance": 60.0,
+    "car": 50.0,
+    "helicopter": 220.0,
+    "drone": 60.0,
+}
+
+class Vehicle(BaseModel):
+    id: str
+    type: Literal["ambulance", "car", "helicopter", "drone"] = "ambulance"
+    coordinates: Coordinates
+    speed_kmh: Optional[float] = Field(default=None, gt=0)
+
+    @property
+    def is_aerial(self) -> bool:
+        return self.type in ("helicopter", "drone")
+
+    @property
+    def speed(self) -> float:
+        """Speed in meters per second."""
+        return (self.speed_kmh or DEFAULT_SPEEDS_KMH[self.type]) / 3.6
+
+class DispatchRequest(BaseModel):
+    incident: Coordinates
+    vehicles: list[Vehicle] = Field(min_length=1, max_length=10_000)
+    # route geometry is only built for the best `top_k` candidates
+    top_k: int = Field(default=3, ge=0, le=50)
+    # weight profile of the ground routes, the ETA of the time profiles
+    # ("time" and its overlays) is their travel time
+    weight: str = "length"
+    # ground routes avoid the roads near fire detections (see /routing/hazards)
+    avoid_hazards: bool = True
+
+class WeightUpdate(BaseModel):
+    # (u, v) OSM node ids, every parallel edge from u to v gets the factor
+    edges: list[tuple[int, int]] = Field(min_length=1, max_length=1_000_000)
+    # multipliers of the free-flow time, null closes the road
+    factors: list[Optional[float]]
+
+    @model_validator(mode='after')
+    def validate_factors(self):
+        if len(self.factors) not in (1, len(self.edges)):
+            raise ValueError('factors must have one value, or one value per edge')
+        if any(factor is not None and factor <= 0 for factor in self.factors):
+            raise ValueError('factors must be positive')
+        return self
@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 from routes.routing import router as routing_router
+from routes.aerial import router as aerial_router
 
 
 main_router = APIRouter()
 
 main_router.include_router(routing_router)
+main_router.include_router(aerial_router)
 
@@ -0,0 +1,82 @@
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from shapely.errors import ShapelyError
+from models.aerial import NoFlyZones
+from models.routing import DEFAULT_SPEEDS_KMH, Coordinates
+from maps_utils.maps_init import MapNotFoundError, get_cost_grid, get_maps, get_registry, get_route_map, set_no_fly_zones
+from routes.routing import request_timeout, run_search
+from routing_utils.aerial_search import flight_path
+
+router = APIRouter(
+    prefix="/aerial",
+    tags=["Aerial"],
+)
+
+@router.post("/")
+async def aerial_routing(
+    start_coordinates: Coordinates,
+    end_coordinates: Coordinates,
+    vehicle_type: Literal["drone", "helicopter"] = "drone",
+    speed_kmh: Optional[float] = Query(default=None, gt=0),
+    timeout: Optional[float] = Depends(request_timeout),
+):
+    speed = (speed_kmh or DEFAULT_SPEEDS_KMH[vehicle_type]) / 3.6
+    return await run_search(
+        compute_flight, start_coordinates, end_coordinates, vehicle_type, speed,
+        timeout=timeout,
+    )
+
+def compute_flight(start_coordinates, end_coordinates, vehicle_type, speed):
+    """
+    Flight path of a drone or helicopter over the cost grid of the map,
+    as a GeoJSON Feature with the distance and the ETA.
+    """
+    # picking the map may snap on a tiled map (tiles read from disk), so it
+    # runs in the pool with the search
+    try:
+        map_data = get_route_map(start_coordinates, end_coordinates)
+    except MapNotFoundError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    grid = get_cost_grid(map_data)
+    try:
+        flight = flight_path(
+            grid,
+            (start_coordinates.longitude, start_coordinates.latitude),
+            (end_coordinates.longitude, end_coordinates.latitude),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if flight is None:
+        raise HTTPException(status_code=404, detail="No flight between the given coordinates")
+
+    return {
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": flight["coordinates"]},
+        "properties": {
+            "map": map_data['name'],
+            "vehicle_type": vehicle_type,
+            "distance_m": round(flight["distance_m"], 1),
+            "eta_s": round(flight["distance_m"] / speed, 1),
+            "direct": flight["direct"],
+        },
+    }
+
+@router.put("/no-fly/{map_name}")
+async def update_no_fly_zones(
+    map_name: str, zones: NoFlyZones, timeout: Optional[float] = Depends(request_timeout)
+):
+    map_data = get_registry().by_name.get(map_name)
+    if map_data is None:
+        raise HTTPException(status_code=404, detail=f"Unknown map {map_name}")
+    try:
+        tiles = await run_search(set_no_fly_zones, map_data, zones.geometries, timeout=timeout)
+    except (ShapelyError, ValueError, TypeError, KeyError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid geometry: {e}")
+    return {"map": map_name, "updated_tiles": tiles}
+
+@router.get("/grids")
+async def list_grids():
+    return {
+        map_data["name"]: map_data["grid"].stats() if map_data["grid"] is not None else None
+        for map_data in get_maps()
+    }
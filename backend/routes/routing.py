@@ -1,15 +1,26 @@
-from fastapi import APIRouter
-from models.routing import Coordinates
-from maps_utils.maps_init import get_pertinent_map
+import resource
+import time
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from models.routing import Coordinates, DispatchRequest, MatrixRequest, SnapRequest, WeightUpdate
+from maps_utils.compact_graph import haversine_m
+from maps_utils.maps_init import MapNotFoundError, get_covering_map, get_map_covering_all, get_maps, get_registry, get_route_map, reload_maps, is_reloading
+from maps_utils.maps_init import get_cost_grid, get_hazard_feed, is_updating_hazards, update_hazards
+from maps_utils.tiled_graph import tile_cache
+from maps_utils.weights import BASE_PROFILES
 
 #routing stuff
-import osmnx as ox
-import networkx as nx
+from routing_utils.cache import route_cache
+from routing_utils.executor import DeadlineExceeded, Overloaded, routing_executor
+from routing_utils.aerial_search import flight_path
+from routing_utils.search import alt_shortest_path, distance_matrix, distances_to, path_to, shortest_path, tree_costs
+
+import numpy as np
 
 # geojson conversion stuff
-import geopandas as gpd
-from shapely.geometry import LineString, Point
-import json
+from routing_utils.serialization import (
+    MEDIA_TYPES, binary_bytes, format_from_accept, geojson_bytes, geojson_dict, polyline_bytes,
+)
 
 #to start the server: uvicorn main:app --reload
 
@@ -19,72 +30,506 @@ router = APIRouter(
     # responses={404: {"description": "Not found"}},
 )
 
-def route_to_geojson(G, route):
+def route_to_geojson(G, route, merge=False):
     """
     Convert a route to GeoJSON format.
     
     Parameters:
     -----------
-    G : networkx.MultiDiGraph
+    G : CompactGraph
         The road network graph
     route : list
-        List of node IDs representing the route
+        List of edge ids representing the route
+    merge : bool
+        Join the edges in a single LineString instead of one per edge
     
     Returns:
     --------
     geojson_dict : dict
         Route in GeoJSON format as a Python dictionary
     """
-    # Extract the edges (road segments) of the route
-    edge_nodes = list(zip(route[:-1], route[1:]))
-    
-    # Get the geometry of each edge
-    lines = []
-    for u, v in edge_nodes:
-        # There might be multiple edges between two nodes, get the one with lowest key
-        edge_data = min(G.get_edge_data(u, v).values(), key=lambda x: x.get('custom_weight', float('inf')))
-        
-        # If the edge has a geometry attribute with LineString coordinates
-        if 'geometry' in edge_data and edge_data['geometry']:
-            # Some edges already have a geometry attribute with coordinates
-            lines.append(edge_data['geometry'])
-        else:
-            # If not, create a straight line between the nodes
-            u_x, u_y = G.nodes[u]['x'], G.nodes[u]['y']
-            v_x, v_y = G.nodes[v]['x'], G.nodes[v]['y']
-            line = LineString([(u_x, u_y), (v_x, v_y)])
-            lines.append(line)
-    
-    # Create a GeoDataFrame with the line segments
-    gdf = gpd.GeoDataFrame({'geometry': lines})
-    
-    # Set the coordinate reference system to WGS84 (standard for web maps)
-    gdf.crs = "EPSG:4326"
-    
-    # Convert to GeoJSON
-    geojson_dict = json.loads(gdf.to_json())
-    
-    return geojson_dict
+    return geojson_dict(G, route, merge)
+
+def serialize_route(G, route, output_format="geojson", merge=False):
+    """
+    Serialize a route straight to the response bytes.
+
+    The default GeoJSON is byte for byte the one FastAPI would produce from
+    `route_to_geojson`, without building the intermediate dict.
+    """
+    if output_format == "polyline":
+        return polyline_bytes(G, route)
+    if output_format == "binary":
+        return binary_bytes(G, route)
+    return geojson_bytes(G, route, merge)
+
+
+def map_weights(map_data):
+    """Weight profiles of a map, 400 for the tiled maps which have none."""
+    if map_data['weights'] is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Map {map_data['name']} is tiled, only point-to-point routing is available",
+        )
+    return map_data['weights']
+
+def get_profile(map_data, weight, avoid_hazards=False, open_at=None):
+    """
+    Current snapshot of a weight profile of a map (400 if unknown). The
+    hazard closures touching the nodes `open_at` are only penalized, so
+    that the ends of a route inside them stay reachable.
+    """
+    weights = map_weights(map_data)
+    try:
+        return weights.get(weight, avoid_hazards, open_at)
+    except KeyError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown weight {weight}, {map_data['name']} has {map_data['weights'].names()}",
+        )
+
+def request_timeout(x_request_timeout: Optional[float] = Header(default=None, gt=0, le=60)):
+    """Per-request deadline in seconds, from the X-Request-Timeout header."""
+    return x_request_timeout
+
+async def run_search(fn, *args, timeout=None):
+    """
+    Run a CPU-bound search in the routing pool, so that the event loop (and
+    every other endpoint) never waits for it.
+    """
+    try:
+        return await routing_executor.run(fn, *args, timeout=timeout)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 
 @router.post("/")
-async def map_routing(start_coordinates: Coordinates, end_coordinates: Coordinates):
-    #get the map the user is in
-    map_data = get_pertinent_map(start_coordinates)
+async def map_routing(
+    start_coordinates: Coordinates,
+    end_coordinates: Coordinates,
+    http_request: Request,
+    algorithm: Literal["auto", "dijkstra", "alt"] = "auto",
+    output_format: Optional[Literal["geojson", "polyline", "binary"]] = Query(default=None, alias="format"),
+    merge: bool = False,
+    weight: str = "length",
+    avoid_hazards: bool = True,
+    timeout: Optional[float] = Depends(request_timeout),
+):
+    # ?format= wins over the Accept header
+    output_format = output_format or format_from_accept(http_request.headers.get("accept"))
+    deadline = time.monotonic() + (timeout or routing_executor.timeout)
+
+    # Snapping reads tiles from disk on the tiled maps, it runs in the pool
+    # too: the event loop only looks the key up, a hit skips search and
+    # serialization
+    resolved = await run_search(
+        resolve_route, start_coordinates, end_coordinates, weight, avoid_hazards, algorithm,
+        timeout=timeout,
+    )
+    cache_key = (*resolved["key"], output_format, merge)
+    cached = route_cache.get(cache_key)
+    if cached is None:
+        content = await run_search(
+            compute_route, resolved["map_data"], resolved["profile"], resolved["landmarks"],
+            resolved["orig_node"], resolved["dest_node"], output_format, merge, resolved["hazards"],
+            timeout=max(deadline - time.monotonic(), 1e-3),
+        )
+        cached = (content, MEDIA_TYPES[output_format])
+        route_cache.put(cache_key, *cached)
+        cache_status = "MISS"
+    else:
+        cache_status = "HIT"
+    return Response(content=cached[0], media_type=cached[1], headers={"X-Cache": cache_status})
+
+def resolve_route(start_coordinates, end_coordinates, weight, avoid_hazards, algorithm):
+    """
+    Everything a route request depends on: its map, snapped ends, weights
+    snapshot and search, and the cache key made of them.
+    """
+    #get the map containing both the user and the destination
+    try:
+        map_data = get_route_map(start_coordinates, end_coordinates)
+    except MapNotFoundError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    map = map_data['map']
+    orig_node = map.nearest_node(start_coordinates.longitude, start_coordinates.latitude)
+    dest_node = map.nearest_node(end_coordinates.longitude, end_coordinates.latitude)
+    if map_data.get('tiled'):
+        # tiled maps only have the base weights, which never change
+        if weight not in BASE_PROFILES:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown weight {weight}, {map_data['name']} has {list(BASE_PROFILES)}",
+            )
+        hazards = map.hazards if avoid_hazards else None
+        profile, profile_key = weight, (weight, 0, hazards.version if hazards is not None else 0)
+    else:
+        hazards = None
+        # the snapshot taken here is used for the whole request, even if the
+        # overlay is updated meanwhile. The hazard zones at the ends are
+        # opened by the search, only on a cache miss
+        profile = get_profile(map_data, weight, avoid_hazards)
+        profile_key = (profile.name, profile.version, profile.hazard_version)
+
+    # "auto" uses the ALT landmarks when the map was preprocessed. Checked
+    # before the cache lookup, so that a hit and a miss give the same answer
+    landmarks = None if map_data.get('tiled') else map_data['landmarks'].get(profile.base)
+    if algorithm == "alt" and landmarks is None:
+        raise HTTPException(status_code=400, detail=f"Map {map_data['name']} has no ALT preprocessing")
+    # the key holds the search actually run, "auto" shares the entries of "alt"
+    if algorithm == "dijkstra" or landmarks is None:
+        algorithm, landmarks = "dijkstra", None
+    else:
+        algorithm = "alt"
+
+    return {
+        "map_data": map_data, "profile": profile, "landmarks": landmarks, "hazards": hazards,
+        "orig_node": orig_node, "dest_node": dest_node,
+        "key": (map_data['name'], map_data['version'], *profile_key, algorithm, orig_node, dest_node),
+    }
+
+def compute_route(map_data, profile, landmarks, orig_node, dest_node, output_format, merge, hazards=None):
+    """
+    Route on a map: `profile` is a WeightProfile snapshot, or the name of a
+    base weight for the tiled maps (searched tile by tile, loading only the
+    tiles the search reaches, avoiding the TileHazards `hazards` if given).
+    The search is ALT when `landmarks` are given, Dijkstra otherwise.
+    """
     map = map_data['map']
+    tiled = map_data.get('tiled', False)
+    print(f"Chosen map: {map_data['name']} ({profile if tiled else profile.name} weights)")
+
+    if tiled:
+        route = map.shortest_path(orig_node, dest_node, profile, hazards)
+    else:
+        # the hazard zones around the ends are penalized instead of closed
+        profile = profile.reopened([orig_node, dest_node])
+        if landmarks is not None:
+            route = alt_shortest_path(profile, landmarks, orig_node, dest_node)
+        else:
+            route = shortest_path(profile, orig_node, dest_node)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No route between the given coordinates")
+
+    return serialize_route(map, route, output_format, merge)
+
+@router.post("/dispatch")
+async def dispatch_candidates(
+    request: DispatchRequest, timeout: Optional[float] = Depends(request_timeout)
+):
+    return await run_search(compute_dispatch, request, timeout=timeout)
+
+def compute_dispatch(request):
+    """
+    Rank the vehicles by ETA to an incident.
 
-    # Use only the length of the road as weight
-    print(f"Chosen map: {map_data['name']}")
-    # for u, v, k, data in map.edges(keys=True, data=True):
-    # # Get the length and use it directly as the weight without modifications
-    #     data['custom_weight'] = data.get('length', 1)
+    Ground vehicles are ranked with a single reverse search from the
+    incident, which gives the road cost from every node at once, so the
+    cost does not grow with the number of vehicles. With a time profile
+    the ETA of the ground vehicles is the travel time of their route, not
+    their distance over their speed. The ground routes avoid the roads near
+    fire detections unless `avoid_hazards` is false, the roads closed
+    around the incident and around the vehicles are only penalized so that
+    a fire stays reachable. Aerial vehicles fly
+    over the cost grid of the map (in a straight line when the air is
+    free, or when they start outside the grid). The route geometry is
+    built only for the best `top_k`.
+    """
+    vehicles = request.vehicles
+    longitudes = np.array([vehicle.coordinates.longitude for vehicle in vehicles])
+    latitudes = np.array([vehicle.coordinates.latitude for vehicle in vehicles])
+    aerial = np.array([vehicle.is_aerial for vehicle in vehicles])
+    try:
+        map_data, covered = get_covering_map(
+            request.incident, longitudes[~aerial], latitudes[~aerial]
+        )
+    except MapNotFoundError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    graph = map_data['map']
+    incident_node = graph.nearest_node(request.incident.longitude, request.incident.latitude)
+    distances = np.full(len(vehicles), np.inf)
+    road_times = np.full(len(vehicles), np.inf)
+    vehicle_nodes = np.full(len(vehicles), -1)
+
+    ground = np.flatnonzero(~aerial)[covered]
+    if len(ground):
+        vehicle_nodes[ground], _ = graph.nearest_nodes(longitudes[ground], latitudes[ground])
+    profile = get_profile(
+        map_data, request.weight, request.avoid_hazards,
+        open_at=np.append(vehicle_nodes[ground], incident_node),
+    )
+    timed = profile.base == "time"
+
+    if len(ground):
+        road_costs, next_hops = distances_to(profile, incident_node)
+        if timed:
+            road_times[ground] = road_costs[vehicle_nodes[ground]]
+            road_costs = tree_costs(profile, next_hops, incident_node, graph.length)
+        distances[ground] = road_costs[vehicle_nodes[ground]]
+    flights = {}
+    if aerial.any():
+        distances[aerial] = haversine_m(
+            longitudes[aerial], latitudes[aerial],
+            request.incident.longitude, request.incident.latitude,
+        )
+        grid = get_cost_grid(map_data)
+        for i in np.flatnonzero(aerial).tolist():
+            try:
+                flights[i] = flight_path(
+                    grid, (longitudes[i], latitudes[i]),
+                    (request.incident.longitude, request.incident.latitude),
+                )
+            except ValueError:
+                continue
+            distances[i] = flights[i]["distance_m"] if flights[i] else np.inf
+
+    speeds = np.array([vehicle.speed for vehicle in vehicles])
+    etas = distances / speeds
+    if timed:
+        etas[ground] = road_times[ground]
+    # unreachable vehicles (inf) end up last
+    ranking = np.lexsort((distances, etas))
+
+    candidates = []
+    for rank, i in enumerate(ranking.tolist()):
+        vehicle = vehicles[i]
+        reachable = bool(np.isfinite(distances[i]))
+        candidate = {
+            "id": vehicle.id,
+            "type": vehicle.type,
+            "rank": rank + 1 if reachable else None,
+            "reachable": reachable,
+            "distance_m": round(float(distances[i]), 1) if reachable else None,
+            "eta_s": round(float(etas[i]), 1) if reachable else None,
+        }
+        if reachable and rank < request.top_k:
+            if vehicle.is_aerial:
+                candidate["route"] = {"type": "LineString", "coordinates": (
+                    flights[i]["coordinates"] if flights.get(i) else [
+                        [vehicle.coordinates.longitude, vehicle.coordinates.latitude],
+                        [request.incident.longitude, request.incident.latitude],
+                    ]
+                )}
+            else:
+                route = path_to(profile, next_hops, int(vehicle_nodes[i]), incident_node)
+                candidate["route"] = route_to_geojson(graph, route)
+        candidates.append(candidate)
+
+    return {"map": map_data['name'], "weight": profile.name, "candidates": candidates}
+
+@router.post("/matrix")
+async def travel_matrix(
+    request: MatrixRequest, http_request: Request, weight: str = "length",
+    timeout: Optional[float] = Depends(request_timeout),
+):
+    binary = "application/octet-stream" in http_request.headers.get("accept", "")
+    return await run_search(compute_matrix, request, binary, weight, timeout=timeout)
+
+def compute_matrix(request, binary=False, weight="length"):
+    """
+    Road cost (meters, or seconds for the time profiles) from every origin
+    to every destination.
+
+    The points are snapped in bulk on the most detailed map covering all
+    of them (422 if there is none) and every origin grows a single search
+    tree. The answer is a dense row-major array: JSON lists with null for
+    the missing paths, or raw little endian float32 (NaN for the missing
+    paths) when the client sends `Accept: application/octet-stream`.
+    """
+    origins, destinations = request.origins, request.destinations
+    longitudes = np.array(origins.longitudes + destinations.longitudes)
+    latitudes = np.array(origins.latitudes + destinations.latitudes)
+    # the distances of points snapped onto another map would look right and be wrong
+    try:
+        map_data = get_map_covering_all(longitudes, latitudes)
+    except MapNotFoundError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    graph = map_data['map']
+    profile = get_profile(map_data, weight)
+
+    nodes, _ = graph.nearest_nodes(longitudes, latitudes)
+    n_origins = len(origins.latitudes)
+    orig_nodes, dest_nodes = nodes[:n_origins], nodes[n_origins:]
+    distances = distance_matrix(profile, orig_nodes, dest_nodes)
+    shape = f"{distances.shape[0]},{distances.shape[1]}"
+
+    if binary:
+        values = np.where(np.isfinite(distances), distances, np.nan).astype("<f4")
+        return Response(
+            content=values.tobytes(),
+            media_type="application/octet-stream",
+            headers={"X-Matrix-Shape": shape, "X-Map": map_data['name'], "X-Weight": profile.name},
+        )
+
+    rows = np.round(distances, 1).tolist()
+    if not np.isfinite(distances).all():
+        rows = [[value if value != float("inf") else None for value in row] for row in rows]
+    return {"map": map_data['name'], "weight": profile.name, "shape": distances.shape, "distances": rows}
+
+@router.post("/snap")
+async def snap_points(request: SnapRequest, timeout: Optional[float] = Depends(request_timeout)):
+    return await run_search(compute_snap, request, timeout=timeout)
+
+def compute_snap(request):
+    """
+    Snap many coordinates (fleet positions, AEDs, clinics...) to graph nodes.
+
+    Every point is snapped on the most detailed map covering it, or on
+    `map_name` when given. The answer holds parallel arrays, null for the
+    points outside every map.
+    """
+    registry = get_registry()
+    longitudes = np.asarray(request.longitudes, dtype=np.float64)
+    latitudes = np.asarray(request.latitudes, dtype=np.float64)
+    if request.map_name is not None:
+        if request.map_name not in registry.by_name:
+            raise HTTPException(status_code=404, detail=f"Unknown map {request.map_name}")
+        assigned = np.full(len(longitudes), registry.maps.index(registry.by_name[request.map_name]))
+    else:
+        assigned = registry.assign(longitudes, latitudes)
+
+    count = len(longitudes)
+    node_ids = np.zeros(count, dtype=np.int64)
+    snapped = np.full((count, 2), np.nan)
+    distances = np.full(count, np.nan)
+    # one vectorized KD-tree query per map
+    for map_index in np.unique(assigned[assigned >= 0]):
+        graph = registry.maps[map_index]["map"]
+        points = np.flatnonzero(assigned == map_index)
+        nodes, distances[points] = graph.nearest_nodes(longitudes[points], latitudes[points])
+        node_ids[points] = graph.node_ids[nodes]
+        snapped[points, 0] = graph.x[nodes]
+        snapped[points, 1] = graph.y[nodes]
+
+    inside = assigned >= 0
+    def _with_nulls(values):
+        return [value if ok else None for value, ok in zip(values.tolist(), inside.tolist())]
+
+    return {
+        "maps": [registry.maps[i]["name"] if i >= 0 else None for i in assigned.tolist()],
+        "node_ids": _with_nulls(node_ids),
+        "latitudes": _with_nulls(snapped[:, 1]),
+        "longitudes": _with_nulls(snapped[:, 0]),
+        "distances": _with_nulls(np.round(distances, 2)),
+    }
+
+@router.get("/maps")
+async def list_maps():
+    return {
+        "reloading": is_reloading(),
+        "executor": routing_executor.stats(),
+        "route_cache": route_cache.stats(),
+        "tile_cache": tile_cache.stats(),
+        # high-water mark of the resident memory of this worker
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "maps": [map_stats(map_data) for map_data in get_maps()],
+    }
+
+def map_stats(map_data):
+    stats = {
+        "name": map_data["name"],
+        "version": map_data["version"],
+        "nodes": map_data["map"].number_of_nodes(),
+        "edges": map_data["map"].number_of_edges(),
+        "bytes": map_data["map"].nbytes,
+    }
+    if map_data.get("tiled"):
+        stats["tiles"] = map_data["map"].stats()
+        return stats
+    stats["weights"] = map_data["weights"].stats()
+    stats["landmarks"] = {
+        base: landmarks.stats() for base, landmarks in map_data["landmarks"].items()
+    } or None
+    return stats
+
+@router.post("/maps/reload", status_code=202)
+async def reload_all_maps():
+    # the new graphs are built in the background and swapped in when ready
+    return {"started": reload_maps(background=True)}
+
+@router.put("/weights/{map_name}/{weight}")
+async def update_weights(
+    map_name: str, weight: str, update: WeightUpdate,
+    timeout: Optional[float] = Depends(request_timeout),
+):
+    return await run_search(compute_weight_update, map_name, weight, update, timeout=timeout)
+
+def compute_weight_update(map_name, weight, update):
+    """
+    Update the traffic/weather factors of some roads in the overlay `weight`.
+
+    Only the given edges are rewritten and the new weights are swapped in at
+    once: the searches already running finish on the previous snapshot, the
+    cached routes of the previous version are never served again.
+    """
+    map_data = get_registry().by_name.get(map_name)
+    if map_data is None:
+        raise HTTPException(status_code=404, detail=f"Unknown map {map_name}")
+    graph = map_data['map']
+    weights = map_weights(map_data)
+
+    pairs = np.array(update.edges, dtype=np.int64).reshape(-1, 2)
+    sources, targets = graph.node_index(pairs[:, 0]), graph.node_index(pairs[:, 1])
+    factors = np.array([np.inf if factor is None else factor for factor in update.factors])
+    factors = np.broadcast_to(factors, len(pairs))
+
+    edges, edge_factors, missing = [], [], 0
+    for u, v, factor in zip(sources.tolist(), targets.tolist(), factors.tolist()):
+        found = graph.edges_between(u, v) if u >= 0 and v >= 0 else ()
+        if len(found) == 0:
+            missing += 1
+        edges.extend(found)
+        edge_factors.extend([factor] * len(found))
+    try:
+        profile = weights.update(weight, edges, edge_factors)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "map": map_name, "weight": weight, "version": profile.version,
+        "updated_edges": len(edges), "missing_edges": missing,
+    }
+
+@router.delete("/weights/{map_name}/{weight}")
+async def reset_weights(map_name: str, weight: str):
+    map_data = get_registry().by_name.get(map_name)
+    if map_data is None:
+        raise HTTPException(status_code=404, detail=f"Unknown map {map_name}")
+    weights = map_weights(map_data)
+    try:
+        removed = weights.reset(weight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Unknown weight {weight}")
+    return {"map": map_name, "weight": weight, "removed": True}
+
+@router.post("/hazards", status_code=202)
+async def upload_hazards(http_request: Request):
+    """
+    Replace the hazard layer with a GeoJSON FeatureCollection of Point
+    detections (e.g. API_test/data/italy_burnt_areas.json, any CRS named in
+    the collection). It is parsed and indexed in the background.
+    """
+    return {"started": update_hazards(await http_request.body(), background=True)}
 
-    # Calculate route with the custom weight (which is just the length)
-    orig_node = ox.nearest_nodes(map, start_coordinates.longitude, start_coordinates.latitude)
-    dest_node = ox.nearest_nodes(map, end_coordinates.longitude, end_coordinates.latitude)
-    route = nx.shortest_path(map, orig_node, dest_node, weight='length')
+@router.get("/hazards")
+async def hazards_status():
+    feed = get_hazard_feed()
+    return {
+        "updating": is_updating_hazards(),
+        "feed": feed.stats() if feed is not None else None,
+        "maps": {
+            map_data["name"]: map_hazard_stats(map_data)
+            for map_data in get_maps()
+        },
+    }
 
-    return route_to_geojson(map, route)
+def map_hazard_stats(map_data):
+    if map_data.get("tiled"):
+        hazards = map_data["map"].hazards
+        return hazards.stats() if hazards is not None else None
+    return map_data["weights"].hazard_stats()
 
 @router.get("/test")
 async def test_cors():
@@ -0,0 +1,255 @@
+import heapq
+import numpy as np
+from numba import njit
+from maps_utils.cost_grid import COARSE_FACTOR
+from routing_utils.executor import cancel_flag, check_cancelled
+
+SQRT2 = np.sqrt(2.0)
+
+
+def flight_path(grid, start, end):
+    """
+    Cheapest flight between two lon/lat points over a CostGrid.
+
+    The straight line is returned as is when it only crosses free air (the
+    common case, no search at all). Otherwise A* runs on the tiles first,
+    then on every finer level restricted to a corridor around the path of
+    the level above (the whole fine grid only if both pyramids fail), and
+    the path is pulled straight wherever the line of sight costs no more.
+
+    Parameters:
+    -----------
+    grid : CostGrid
+        Cost grid of the region
+    start, end : tuple
+        (longitude, latitude) of the two ends of the flight
+
+    Returns:
+    --------
+    flight : dict
+        "coordinates" (lon/lat list), "distance_m" and "direct", None when
+        the end cannot be reached
+    """
+    cost, max_pyramid, min_pyramid, _ = grid.snapshot
+    rows, cols = grid.to_cells([start[0], end[0]], [start[1], end[1]])
+    if (rows < 0).any():
+        raise ValueError("The flight leaves the area covered by the cost grid")
+    if not np.isfinite(cost[rows, cols]).all():
+        raise ValueError("The flight starts or ends in a no-fly zone")
+
+    start_cell, end_cell = (int(rows[0]), int(cols[0])), (int(rows[1]), int(cols[1]))
+    direct = _segment_max_cost(cost, *start_cell, *end_cell) <= 1.0
+    if direct:
+        path = np.array([start_cell, end_cell])
+    else:
+        # the max-pool corridors follow the wide open air, the wider min-pool
+        # ones go through the gaps narrower than a coarse cell (the min-pooled
+        # tiles may see gaps that do not exist, hence the retry without them)
+        path = None
+        attempts = (
+            ((cost,) + max_pyramid, False),
+            ((cost,) + min_pyramid, True),
+            ((cost, min_pyramid[0]), True),
+            ((cost,), False),
+        )
+        for levels, widen in attempts:
+            path = _pyramid_path(levels, start_cell, end_cell, widen)
+            if path is not None:
+                break
+        if path is None:
+            return None
+        path = path[_pull_string(cost, path[:, 0], path[:, 1])]
+    if len(path) == 1:
+        path = np.vstack([path, path])
+
+    # exact ends, cell centers in between
+    longitudes, latitudes = grid.to_lonlat(path[:, 0], path[:, 1])
+    coordinates = np.column_stack([longitudes, latitudes])
+    coordinates[0], coordinates[-1] = start, end
+    steps = np.diff(path, axis=0)
+    distance = float(np.hypot(steps[:, 0], steps[:, 1]).sum() * grid.resolution)
+    return {"coordinates": coordinates.tolist(), "distance_m": distance, "direct": bool(direct)}
+
+
+def _pyramid_path(levels, start_cell, end_cell, widen=False):
+    """
+    A* on the coarsest level, then on every finer level restricted to the
+    cells of the path found on the level above (and their neighbours when
+    `widen`, always on the intermediate levels). `levels` goes from the fine grid
+    to the coarsest one, each COARSE_FACTOR times smaller. None if any of
+    the searches fails.
+    """
+    cost = levels[0]
+    if len(levels) == 1:
+        return _block_path(cost, np.ones(cost.shape, dtype=np.bool_), 1, start_cell, end_cell)
+
+    coarse_start = (start_cell[0] // COARSE_FACTOR, start_cell[1] // COARSE_FACTOR)
+    coarse_end = (end_cell[0] // COARSE_FACTOR, end_cell[1] // COARSE_FACTOR)
+    # the coarse cells of the ends may be blocked by a nearby no-fly zone
+    coarse = levels[1].copy()
+    coarse[coarse_start] = coarse[coarse_end] = 1.0
+    coarse_path = _pyramid_path((coarse,) + levels[2:], coarse_start, coarse_end, widen=True)
+    if coarse_path is None:
+        return None
+
+    corridor = np.zeros(coarse.shape, dtype=np.bool_)
+    reach = (-1, 0, 1) if widen else (0,)
+    for dr in reach:
+        for dc in reach:
+            r = np.clip(coarse_path[:, 0] + dr, 0, coarse.shape[0] - 1)
+            c = np.clip(coarse_path[:, 1] + dc, 0, coarse.shape[1] - 1)
+            corridor[r, c] = True
+    return _block_path(cost, corridor, COARSE_FACTOR, start_cell, end_cell)
+
+
+def _block_path(cost, blocks, block, start_cell, end_cell):
+    """
+    (k, 2) cells of the A* path through the `blocks` (block x block cells
+    each) set in the boolean block mask, None if the end is unreachable.
+    """
+    block_cells = np.argwhere(blocks).astype(np.int64)
+    block_index = np.full(blocks.shape, -1, dtype=np.int64)
+    block_index[block_cells[:, 0], block_cells[:, 1]] = np.arange(len(block_cells))
+    cancel = cancel_flag()
+    parents, start, end = _block_astar(cost, block_index, block_cells, block, *start_cell, *end_cell, cancel)
+    check_cancelled(cancel)
+    if end < 0 or (start != end and parents[end] < 0):
+        return None
+
+    nodes = [end]
+    while nodes[-1] != start:
+        nodes.append(int(parents[nodes[-1]]))
+    nodes = np.array(nodes[::-1], dtype=np.int64)
+    cells, local = block_cells[nodes // (block * block)], nodes % (block * block)
+    return np.column_stack([cells[:, 0] * block + local // block, cells[:, 1] * block + local % block])
+
+
+@njit(cache=True, nogil=True)
+def _block_astar(cost, block_index, block_cells, block, start_row, start_col, end_row, end_col, cancel):
+    """
+    8-connected A* kernel over the cells of some blocks of the grid. The
+    work arrays only hold these cells, so a corridor across a huge grid
+    costs no more than its own size.
+
+    Moving between two cells costs their distance times their mean cost;
+    the octile distance is a consistent heuristic since no cell costs less
+    than 1. Diagonal moves never cut the corner of a blocked cell. Returns
+    the parent node of every reached node (-1 elsewhere) and the nodes of
+    the two ends (-1 when outside the blocks). Stops early once `cancel[0]`
+    is set.
+    """
+    rows, cols = cost.shape
+    area = block * block
+    size = len(block_cells) * area
+    distance = np.full(size, np.inf)
+    parents = np.full(size, -1, dtype=np.int64)
+    settled = np.zeros(size, dtype=np.bool_)
+
+    start = _node(block_index, block, start_row, start_col)
+    end = _node(block_index, block, end_row, end_col)
+    if start < 0 or end < 0:
+        return parents, start, end
+
+    distance[start] = 0.0
+    queue = [(0.0, np.int64(start))]
+    while len(queue) > 0:
+        _, node = heapq.heappop(queue)
+        if settled[node]:
+            continue
+        if node == end or cancel[0]:
+            break
+        settled[node] = True
+        k, local = node // area, node % area
+        row = block_cells[k, 0] * block + local // block
+        col = block_cells[k, 1] * block + local % block
+        for dr in range(-1, 2):
+            for dc in range(-1, 2):
+                r, c = row + dr, col + dc
+                if (dr == 0 and dc == 0) or r < 0 or r >= rows or c < 0 or c >= cols:
+                    continue
+                if not np.isfinite(cost[r, c]):
+                    continue
+                target = _node(block_index, block, r, c)
+                if target < 0:
+                    continue
+                step = 1.0
+                if dr != 0 and dc != 0:
+                    if not (np.isfinite(cost[row, c]) and np.isfinite(cost[r, col])):
+                        continue
+                    step = SQRT2
+                new_distance = distance[node] + step * 0.5 * (cost[row, col] + cost[r, c])
+                if new_distance < distance[target]:
+                    distance[target] = new_distance
+                    parents[target] = node
+                    dy, dx = abs(end_row - r), abs(end_col - c)
+                    bound = max(dx, dy) + (SQRT2 - 1.0) * min(dx, dy)
+                    heapq.heappush(queue, (new_distance + bound, target))
+    return parents, start, end
+
+
+@njit(cache=True, nogil=True)
+def _node(block_index, block, row, col):
+    k = block_index[row // block, col // block]
+    if k < 0:
+        return -1
+    return k * block * block + (row % block) * block + col % block
+
+
+@njit(cache=True, nogil=True)
+def _segment_max_cost(cost, row0, col0, row1, col1):
+    """Highest cost of the cells crossed by a straight line (sampled every half cell)."""
+    steps = int(2 * max(abs(row1 - row0), abs(col1 - col0))) + 1
+    highest = 0.0
+    for i in range(steps + 1):
+        t = i / steps
+        r = int(row0 + 0.5 + t * (row1 - row0))
+        c = int(col0 + 0.5 + t * (col1 - col0))
+        if cost[r, c] > highest:
+            highest = cost[r, c]
+    return highest
+
+
+@njit(cache=True, nogil=True)
+def _pull_string(cost, rows, cols):
+    """
+    Indices of the path cells kept as waypoints: from every waypoint the
+    path jumps as far as a straight line costs no more than the cells it
+    skips. The farthest such cell is found by galloping then bisecting, so
+    long straight stretches cost a few line checks only.
+    """
+    kept = [0]
+    anchor = 0
+    last = len(rows) - 1
+    while anchor < last:
+        good, bad = anchor + 1, last + 1
+        step = 2
+        while anchor + step <= last:
+            if _visible(cost, rows, cols, anchor, anchor + step):
+                good = anchor + step
+                step *= 2
+            else:
+                bad = anchor + step
+                break
+        if bad > last and good < last:
+            if _visible(cost, rows, cols, anchor, last):
+                good = last
+            else:
+                bad = last
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if _visible(cost, rows, cols, anchor, middle):
+                good = middle
+            else:
+                bad = middle
+        kept.append(good)
+        anchor = good
+    return np.array(kept, dtype=np.int64)
+
+
+@njit(cache=True, nogil=True)
+def _visible(cost, rows, cols, i, j):
+    """True if the line from path cell i to path cell j costs no more than the cells it skips."""
+    highest = 0.0
+    for k in range(i, j + 1):
+        highest = max(highest, cost[rows[k], cols[k]])
+    return _segment_max_cost(cost, rows[i], cols[i], rows[j], cols[j]) <= highest
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    LRU cache of serialized routes with a time to live and a memory budget.
+
+    Keys carry the snapped nodes and the version of the graph and of its
+    weights, so a reload never serves a stale route: the old entries simply
+    stop matching (and `clear` frees them at once).
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The cached (content, media_type), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, content, media_type):
+        size = len(content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (content, media_type, time.monotonic() + self.ttl)
+            self._bytes += size
+            # least recently used first
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        content, _, _ = self._entries.pop(key)
+        self._bytes -= len(content)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+route_cache = RouteCache(
+    max_bytes=int(float(os.environ.get("ROUTE_CACHE_MB", 64)) * 2**20),
+    ttl=float(os.environ.get("ROUTE_CACHE_TTL_S", 300)),
+)
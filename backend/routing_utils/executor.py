@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class Overloaded(Exception):
+    """Too many searches already queued, the request is shed."""
+
+
+class DeadlineExceeded(Exception):
+    """The search did not finish (or start) before the request deadline."""
+
+
+# Cancellation flag of the search running in each thread of the pool
+_local = threading.local()
+
+
+def cancel_flag():
+    """
+    Flag of the search running in this thread: a one-element bool array,
+    set when its request gives up, that the numba kernels poll while they
+    run. Outside the pool it is never set.
+    """
+    flag = getattr(_local, "cancel", None)
+    return flag if flag is not None else np.zeros(1, dtype=np.bool_)
+
+
+def check_cancelled(flag):
+    """Abandon a search whose request gave up (DeadlineExceeded)."""
+    if flag[0]:
+        raise DeadlineExceeded("Search cancelled at the request deadline")
+
+
+class RoutingExecutor:
+    """
+    Runs the CPU-bound searches off the asyncio event loop.
+
+    The searches run in a pool of threads sharing the read-only graphs (the
+    heavy parts are scipy's C Dijkstra and the numba kernels, which do not
+    need the GIL). At most `max_pending` searches can be queued or running:
+    beyond that new requests are rejected at once instead of piling up, and
+    a search that cannot finish before its deadline is abandoned (or never
+    started, if it was still waiting in the queue). An abandoned search
+    counts as pending until it stops: the numba kernels (ALT, tiled and
+    aerial A*) stop at their next step through `cancel_flag`, a scipy
+    Dijkstra cannot be interrupted and runs to its end.
+    """
+
+    def __init__(self, workers=None, max_pending=None, timeout=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="routing")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    async def run(self, fn, *args, timeout=None):
+        """Run fn(*args) in the pool and wait for it for at most `timeout` seconds."""
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"{self._pending} searches already in progress")
+            self._pending += 1
+
+        cancel = np.zeros(1, dtype=np.bool_)
+
+        def task():
+            # the request gave up while the search was still queued
+            if time.monotonic() > deadline:
+                raise DeadlineExceeded("Deadline expired before the search started")
+            _local.cancel = cancel
+            try:
+                return fn(*args)
+            finally:
+                _local.cancel = None
+
+        future = self._pool.submit(task)
+        future.add_done_callback(self._done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # a queued search never starts, a running one stops at its next check
+            cancel[0] = True
+            future.cancel()
+            with self._lock:
+                self.expired += 1
+            raise DeadlineExceeded(f"Search did not finish within {timeout}s")
+        except DeadlineExceeded:
+            with self._lock:
+                self.expired += 1
+            raise
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
+
+
+routing_executor = RoutingExecutor(
+    workers=int(os.environ.get("ROUTING_WORKERS", 0)) or None,
+    max_pending=int(os.environ.get("ROUTING_MAX_PENDING", 0)) or None,
+    timeout=float(os.environ.get("ROUTING_TIMEOUT_S", 10)),
+)
@@ -0,0 +1,203 @@
+import heapq
+import numpy as np
+from numba import njit
+from scipy.sparse.csgraph import dijkstra
+from routing_utils.executor import cancel_flag, check_cancelled
+
+
+def shortest_path(profile, orig_node, dest_node):
+    """
+    Shortest path between two nodes of a CompactGraph.
+
+    Parameters:
+    -----------
+    profile : WeightProfile
+        Snapshot of the edge weights used as cost (see maps_utils/weights.py)
+    orig_node, dest_node : int
+        Node indices (not OSM ids) of the start and the end of the route
+
+    Returns:
+    --------
+    edges : list
+        Edge ids of the route in travel order, None if dest is unreachable
+    """
+    if orig_node == dest_node:
+        return []
+
+    distances, predecessors = dijkstra(
+        profile.matrix, directed=True, indices=orig_node, return_predecessors=True
+    )
+    if not np.isfinite(distances[dest_node]):
+        return None
+
+    nodes = [dest_node]
+    while nodes[-1] != orig_node:
+        nodes.append(int(predecessors[nodes[-1]]))
+    nodes.reverse()
+    return [profile.edge_between(u, v) for u, v in zip(nodes[:-1], nodes[1:])]
+
+
+def distance_matrix(profile, orig_nodes, dest_nodes, max_chunk_bytes=64 * 2**20):
+    """
+    N x M matrix of shortest path costs, inf where there is no path.
+
+    Every distinct origin grows one search tree (scipy's C Dijkstra). The
+    origins are processed in chunks so that the intermediate rows (one
+    value per node of the graph) stay under `max_chunk_bytes`, and a
+    cancelled request stops between two chunks.
+    """
+    cancel = cancel_flag()
+    matrix = profile.matrix
+    unique_origins, origin_rows = np.unique(orig_nodes, return_inverse=True)
+    dest_nodes = np.asarray(dest_nodes)
+
+    result = np.empty((len(unique_origins), len(dest_nodes)))
+    chunk = max(1, max_chunk_bytes // (8 * matrix.shape[0]))
+    for start in range(0, len(unique_origins), chunk):
+        check_cancelled(cancel)
+        rows = dijkstra(matrix, directed=True, indices=unique_origins[start:start + chunk])
+        result[start:start + chunk] = rows[:, dest_nodes]
+    return result[origin_rows]
+
+
+def distances_to(profile, dest_node):
+    """
+    One reverse search from `dest_node`: the cost from every node to it.
+
+    Returns:
+    --------
+    distances : numpy.ndarray
+        d(v, dest_node) for every node v, inf if v cannot reach it
+    next_hops : numpy.ndarray
+        Next node from v on its shortest path to dest_node (-9999 if none)
+    """
+    distances, next_hops = dijkstra(
+        profile.reverse, directed=True, indices=dest_node,
+        return_predecessors=True,
+    )
+    return distances, next_hops
+
+
+def path_to(profile, next_hops, orig_node, dest_node):
+    """Edge ids from orig_node to the root of a `distances_to` search."""
+    route = []
+    node = orig_node
+    while node != dest_node:
+        next_node = int(next_hops[node])
+        route.append(profile.edge_between(node, next_node))
+        node = next_node
+    return route
+
+
+def tree_costs(profile, next_hops, dest_node, values):
+    """
+    Sum of `values` (one per edge, e.g. the lengths) along the path of every
+    node to the root of a `distances_to` search, inf for the unreached ones.
+
+    The paths are summed by pointer jumping: every round doubles the number
+    of hops covered, so it takes log(depth) vectorized passes.
+    """
+    graph = profile.graph
+    n = graph.number_of_nodes()
+    reached = next_hops >= 0
+    nodes = np.flatnonzero(reached)
+
+    # cheapest edge (for the profile) of every tree link
+    _, starts = graph.edge_groups()
+    group_keys = graph.edge_sources()[starts[:-1]].astype(np.int64) * n + graph.indices[starts[:-1]]
+    groups = np.searchsorted(group_keys, nodes.astype(np.int64) * n + next_hops[nodes])
+
+    costs = np.full(n, np.inf)
+    costs[dest_node] = 0.0
+    costs[nodes] = values[profile.edge_ids[groups]]
+    pointers = np.full(n, dest_node, dtype=np.int64)
+    pointers[nodes] = next_hops[nodes]
+    pending = nodes
+    while len(pending):
+        costs[pending] += costs[pointers[pending]]
+        pointers[pending] = pointers[pointers[pending]]
+        pending = pending[pointers[pending] != dest_node]
+    return costs
+
+
+def alt_shortest_path(profile, landmarks, orig_node, dest_node):
+    """
+    Same as `shortest_path`, with A* guided by ALT landmark lower bounds.
+
+    The landmarks must be the ones of `profile.base`. The bounds are
+    consistent, so the route has the same cost as the one of plain
+    Dijkstra, but only the nodes around it are settled and the search stops
+    as soon as the destination is reached.
+    """
+    if orig_node == dest_node:
+        return []
+
+    matrix, edge_ids = profile.matrix, profile.edge_ids
+    cancel = cancel_flag()
+    parents = _alt_search(
+        matrix.indptr, matrix.indices, matrix.data,
+        landmarks.from_landmark, landmarks.to_landmark,
+        landmarks.active_landmarks(dest_node), orig_node, dest_node, cancel,
+    )
+    check_cancelled(cancel)
+    if parents[dest_node] < 0:
+        return None
+
+    sources = profile.graph.edge_sources()
+    route = []
+    node = dest_node
+    while node != orig_node:
+        edge = int(edge_ids[parents[node]])
+        route.append(edge)
+        node = int(sources[edge])
+    route.reverse()
+    return route
+
+
+@njit(cache=True, nogil=True)
+def _alt_search(indptr, indices, weights, from_landmark, to_landmark, active, orig_node, dest_node, cancel):
+    """
+    A* kernel, compiled by numba: a pure Python loop would be slower than
+    the plain C Dijkstra of scipy. Returns, for every reached node, the
+    matrix position of the edge it was reached through (-1 elsewhere).
+    Stops early once `cancel[0]` is set.
+    """
+    n = len(indptr) - 1
+    distance = np.full(n, np.inf)
+    parents = np.full(n, -1, dtype=np.int64)
+    settled = np.zeros(n, dtype=np.bool_)
+
+    # bounds of the target, from the landmarks picked for this query
+    l_to_t = np.empty(len(active))
+    t_to_l = np.empty(len(active))
+    for j in range(len(active)):
+        l_to_t[j] = from_landmark[dest_node, active[j]]
+        t_to_l[j] = to_landmark[dest_node, active[j]]
+
+    distance[orig_node] = 0.0
+    queue = [(0.0, np.int64(orig_node))]
+    while len(queue) > 0:
+        _, node = heapq.heappop(queue)
+        if settled[node]:
+            continue
+        if node == dest_node or cancel[0]:
+            break
+        settled[node] = True
+        for position in range(indptr[node], indptr[node + 1]):
+            target = np.int64(indices[position])
+            new_distance = distance[node] + weights[position]
+            if new_distance < distance[target]:
+                distance[target] = new_distance
+                parents[target] = position
+                # triangle inequality lower bound of d(target, dest_node),
+                # inf - inf is nan and never wins a comparison
+                bound = 0.0
+                for j in range(len(active)):
+                    forward = l_to_t[j] - from_landmark[target, active[j]]
+                    if forward > bound:
+                        bound = forward
+                    backward = to_landmark[target, active[j]] - t_to_l[j]
+                    if backward > bound:
+                        bound = backward
+                heapq.heappush(queue, (new_distance + bound, target))
+    return parents
@@ -0,0 +1,101 @@
+import json
+import struct
+import numpy as np
+
+# Same settings as FastAPI's JSONResponse, so the bytes written here are the
+# ones the framework would have produced from the equivalent dict
+_encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+MEDIA_TYPES = {
+    "geojson": "application/json",
+    "polyline": "application/vnd.aira.polyline",
+    "binary": "application/octet-stream",
+}
+
+
+def route_lines(G, route, merge=False):
+    """
+    Coordinates of the route, one (k, 2) lon/lat array per LineString.
+
+    With `merge` the edges are joined into a single line, the vertex shared
+    by two consecutive edges appearing only once.
+    """
+    lines = [G.edge_coords(edge) for edge in route]
+    if not merge or len(lines) < 2:
+        return lines
+    parts = [lines[0]]
+    for line in lines[1:]:
+        same_vertex = np.array_equal(line[0], parts[-1][-1])
+        parts.append(line[1:] if same_vertex else line)
+    return [np.concatenate(parts)]
+
+
+def iter_geojson(G, route, merge=False):
+    """Write the GeoJSON FeatureCollection of a route chunk by chunk."""
+    yield b'{"type":"FeatureCollection","features":['
+    for i, line in enumerate(route_lines(G, route, merge)):
+        if i:
+            yield b","
+        yield b'{"id":"%d","type":"Feature","properties":{},"geometry":{"type":"LineString","coordinates":' % i
+        yield _encode(line.tolist()).encode("utf-8")
+        yield b"}}"
+    yield b"]}"
+
+
+def geojson_bytes(G, route, merge=False):
+    return b"".join(iter_geojson(G, route, merge))
+
+
+def geojson_dict(G, route, merge=False):
+    """The same FeatureCollection as a dict, to embed it in a bigger answer."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "id": str(i),
+                "type": "Feature",
+                "properties": {},
+                "geometry": {"type": "LineString", "coordinates": line.tolist()},
+            }
+            for i, line in enumerate(route_lines(G, route, merge))
+        ],
+    }
+
+
+def polyline_bytes(G, route, precision=5):
+    """Google encoded polyline (lat, lon order) of the merged route."""
+    lines = route_lines(G, route, merge=True)
+    if not lines:
+        return b""
+    coords = np.round(lines[0][:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # zig-zag encoding of the signed deltas
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    chars = bytearray()
+    for value in values:
+        while value >= 0x20:
+            chars.append((0x20 | (value & 0x1F)) + 63)
+            value >>= 5
+        chars.append(value + 63)
+    return bytes(chars)
+
+
+def binary_bytes(G, route):
+    """
+    Compact binary route: uint32 vertex count followed by the merged line
+    as little endian int32 (lon, lat) pairs in 1e-7 degrees (~1 cm).
+    """
+    lines = route_lines(G, route, merge=True)
+    if not lines:
+        return struct.pack("<I", 0)
+    coords = np.round(lines[0] * 1e7).astype("<i4")
+    return struct.pack("<I", len(coords)) + coords.tobytes()
+
+
+def format_from_accept(accept):
+    """Output format requested through the Accept header (geojson by default)."""
+    for name, media_type in MEDIA_TYPES.items():
+        if name != "geojson" and media_type in (accept or ""):
+            return name
+    return "geojson"
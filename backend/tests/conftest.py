@@ -0,0 +1,82 @@
+import os
+import sys
+import networkx as nx
+import numpy as np
+import pytest
+
+# the backend modules import each other from the backend directory (uvicorn main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maps_utils.compact_graph import CompactGraph, haversine_m  # noqa: E402
+
+# Synthetic street grid around Bologna: SIZE x SIZE nodes SPACING degrees apart
+ORIGIN = (11.33, 44.49)
+SIZE = 20
+SPACING = 0.001
+
+
+def street_grid(seed=0, size=SIZE, spacing=SPACING):
+    """
+    OSMnx-like MultiDiGraph of a street grid: mostly two-way roads, some
+    one-way ones, a few missing blocks and some parallel edges, with the
+    "length" (a bit longer than the straight line) and "travel_time" of
+    every edge.
+    """
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph()
+    for row in range(size):
+        for col in range(size):
+            G.add_node(1000 + row * size + col, x=ORIGIN[0] + col * spacing, y=ORIGIN[1] + row * spacing)
+
+    def add_edge(u, v):
+        straight = float(haversine_m(G.nodes[u]["x"], G.nodes[u]["y"], G.nodes[v]["x"], G.nodes[v]["y"]))
+        length = straight * rng.uniform(1.0, 1.4)
+        speed = rng.choice([30, 50, 70]) / 3.6
+        G.add_edge(u, v, length=length, travel_time=length / speed)
+
+    for row in range(size):
+        for col in range(size):
+            u = 1000 + row * size + col
+            for v in ([u + 1] if col + 1 < size else []) + ([u + size] if row + 1 < size else []):
+                kind = rng.random()
+                if kind < 0.05:
+                    continue            # no road
+                if kind < 0.85 or kind >= 0.95:
+                    add_edge(u, v)
+                    add_edge(v, u)
+                else:
+                    add_edge(u, v)      # one-way
+                if kind >= 0.95:
+                    add_edge(u, v)      # parallel road
+    return G
+
+
+@pytest.fixture(scope="session")
+def road_network():
+    return street_grid()
+
+
+@pytest.fixture(scope="session")
+def graph(road_network):
+    graph = CompactGraph.from_networkx(road_network, meta={"name": "Grid"})
+    graph.build_node_index()
+    return graph
+
+
+def node_pairs(graph, count=40, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.integers(graph.number_of_nodes(), size=(count, 2)).tolist()
+
+
+def route_cost(values, route):
+    return float(np.sum(np.asarray(values)[route])) if route else 0.0
+
+
+def assert_connected(graph, route, orig_node, dest_node):
+    """The edges of `route` form a path from orig_node to dest_node."""
+    sources = graph.edge_sources()
+    node = orig_node
+    for edge in route:
+        assert sources[edge] == node
+        node = int(graph.indices[edge])
+    assert node == dest_node
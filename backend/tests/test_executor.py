@@ -0,0 +1,40 @@
+import asyncio
+import time
+import pytest
+from routing_utils.executor import DeadlineExceeded, Overloaded, RoutingExecutor, cancel_flag
+
+
+def spin():
+    """A search that only ends when its request gives up."""
+    cancel = cancel_flag()
+    while not cancel[0]:
+        time.sleep(0.001)
+    raise DeadlineExceeded("cancelled")
+
+
+def test_timed_out_search_is_cancelled():
+    executor = RoutingExecutor(workers=1, max_pending=1)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(executor.run(spin, timeout=0.05))
+    # the running search stops and frees its slot
+    for _ in range(100):
+        if executor.stats()["pending"] == 0:
+            break
+        time.sleep(0.01)
+    assert executor.stats()["pending"] == 0
+    assert asyncio.run(executor.run(sum, [1, 2])) == 3
+
+
+def test_full_executor_rejects():
+    executor = RoutingExecutor(workers=1, max_pending=1)
+
+    async def two_searches():
+        first = asyncio.ensure_future(executor.run(spin, timeout=0.2))
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            await executor.run(sum, [1, 2])
+        with pytest.raises(DeadlineExceeded):
+            await first
+
+    asyncio.run(two_searches())
+    assert executor.stats()["rejected"] == 1
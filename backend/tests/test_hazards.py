@@ -0,0 +1,45 @@
+import networkx as nx
+import numpy as np
+import pytest
+from conftest import ORIGIN
+from maps_utils.compact_graph import CompactGraph
+from maps_utils.hazards import HAZARD_PENALTY, HazardFeed, transformer
+
+
+def detections(*points):
+    return HazardFeed.from_geojson({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": list(p)}, "properties": {}} for p in points
+    ]})
+
+
+@pytest.fixture(scope="module")
+def long_road():
+    """A single straight road 700 m long, going east."""
+    x, y = transformer("EPSG:4326", "EPSG:3035").transform(*ORIGIN)
+    lon, lat = transformer("EPSG:3035", "EPSG:4326").transform(x + 700, y)
+    G = nx.MultiDiGraph()
+    G.add_node(1, x=ORIGIN[0], y=ORIGIN[1])
+    G.add_node(2, x=lon, y=lat)
+    G.add_edge(1, 2, length=700.0, travel_time=50.0)
+    return CompactGraph.from_networkx(G), (x, y)
+
+
+def at(x, y):
+    return transformer("EPSG:3035", "EPSG:4326").transform(x, y)
+
+
+@pytest.mark.parametrize("offset, distance", [(0, 0.0), (100, 100.0), (400, 400.0)])
+def test_distance_to_the_middle_of_a_long_segment(long_road, offset, distance):
+    graph, (x, y) = long_road
+    distances = detections(at(x + 350, y + offset)).edge_distances(graph)
+    assert distances[0] == pytest.approx(distance, abs=1.0)
+
+
+def test_detection_on_a_long_segment_closes_it(long_road):
+    graph, (x, y) = long_road
+    edges, factors = detections(at(x + 350, y)).edge_factors(graph)
+    assert edges.tolist() == [0] and np.isinf(factors).all()
+    edges, factors = detections(at(x + 350, y + 300)).edge_factors(graph)
+    assert edges.tolist() == [0] and factors.tolist() == [HAZARD_PENALTY]
+    edges, _ = detections(at(x + 350, y + 600), at(x - 600, y)).edge_factors(graph)
+    assert len(edges) == 0
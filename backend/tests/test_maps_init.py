@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import shapely
+from conftest import ORIGIN, SIZE, SPACING, street_grid
+from maps_utils import maps_init
+from maps_utils.compact_graph import CompactGraph
+from maps_utils.maps_init import MapNotFoundError, MapRegistry
+from maps_utils.weights import WeightProfiles
+from models.routing import Coordinates
+
+
+def half_map(name, columns):
+    """Map of the grid columns in `columns`, bounded by the box of its nodes."""
+    G = street_grid()
+    G.remove_nodes_from([node for node in list(G.nodes) if (node - 1000) % SIZE not in columns])
+    graph = CompactGraph.from_networkx(G, meta={"name": name})
+    graph.build_node_index()
+    boundary = shapely.box(graph.x.min(), graph.y.min(), graph.x.max(), graph.y.max())
+    return {"name": name, "map": graph, "boundary": boundary}
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return MapRegistry([half_map("West", range(0, 10)), half_map("East", range(10, SIZE))])
+
+
+def point(col, row):
+    return Coordinates(longitude=ORIGIN[0] + col * SPACING, latitude=ORIGIN[1] + row * SPACING)
+
+
+def test_route_map_contains_both_ends(registry):
+    assert registry.find_route_map(point(1, 1), point(8, 15))["name"] == "West"
+    assert registry.find_route_map(point(12, 1), point(18, 15))["name"] == "East"
+
+
+def test_route_map_falls_back_on_a_map_reaching_the_other_end(registry):
+    # the end is just across the border, ~95 m from the last roads of West
+    assert registry.find_route_map(point(1, 5), point(10.2, 5))["name"] == "West"
+    # the start is ~95 m from the first roads of East
+    assert registry.find_route_map(point(8.8, 5), point(18, 5))["name"] == "East"
+
+
+def test_route_map_across_distant_maps(registry):
+    with pytest.raises(MapNotFoundError, match="West.*East"):
+        registry.find_route_map(point(1, 5), point(18, 5), tolerance_m=300)
+    with pytest.raises(MapNotFoundError, match="No map covers"):
+        registry.find_route_map(point(1, 5), point(40, 5))
+
+
+def test_points_map_covers_them_all(registry):
+    whole = MapRegistry([*registry.maps, half_map("Whole", range(SIZE))])
+    points = [point(1, 1), point(8, 15), point(3, 9)]
+    longitudes, latitudes = np.array([[p.longitude, p.latitude] for p in points]).T
+    assert whole.find_covering_all(longitudes, latitudes)["name"] == "West"
+    # the first point is in West, the matrix needs the map of all of them
+    points.append(point(18, 2))
+    longitudes, latitudes = np.array([[p.longitude, p.latitude] for p in points]).T
+    assert whole.find_covering_all(longitudes, latitudes)["name"] == "Whole"
+    with pytest.raises(MapNotFoundError, match="No loaded map covers all the 4 points"):
+        registry.find_covering_all(longitudes, latitudes)
+    with pytest.raises(MapNotFoundError, match="1 of the 5 points are outside every map"):
+        whole.find_covering_all(np.append(longitudes, point(40, 5).longitude), np.append(latitudes, ORIGIN[1]))
+
+
+def test_reload_keeps_the_no_fly_zones_and_the_overlays(monkeypatch):
+    def grid_map(columns):
+        map_data = half_map("Grid", columns)
+        map_data.update(coordinates=ORIGIN, weights=WeightProfiles(map_data["map"]), landmarks={},
+                        no_fly=None, grid=None)
+        return map_data
+
+    def osm_factors(map_data):
+        graph = map_data["map"]
+        edges, factors = map_data["weights"].overlay_factors("traffic")
+        pairs = zip(graph.node_ids[graph.edge_sources()[edges]].tolist(), graph.node_ids[graph.indices[edges]].tolist())
+        return dict(zip(pairs, factors.tolist()))
+
+    old = grid_map(range(SIZE))
+    monkeypatch.setattr(maps_init, "_registry", MapRegistry([old]))
+    monkeypatch.setattr(maps_init, "_hazard_feed", None)
+    # the new export lost the first column of the grid, its edge ids are shifted
+    monkeypatch.setattr(maps_init, "load_maps", lambda: [grid_map(range(1, SIZE))])
+
+    graph = old["map"]
+    columns = (graph.node_ids - 1000) % SIZE
+    inside = np.flatnonzero((columns[graph.edge_sources()] > 1) & (columns[graph.indices] > 1))
+    dropped = np.flatnonzero(columns[graph.edge_sources()] == 0)
+    old["weights"].update("traffic", [inside[0], inside[40], dropped[0]], [np.inf, 3.0, 2.0])
+    zone = shapely.box(*point(4, 4).model_dump().values(), *point(6, 6).model_dump().values())
+    maps_init.set_no_fly_zones(old, [shapely.geometry.mapping(zone)])
+
+    assert maps_init.reload_maps(background=False)
+    new = maps_init.get_registry().by_name["Grid"]
+    assert new is not old and new["no_fly"].equals(old["no_fly"])
+    assert maps_init.get_cost_grid(new).no_fly is not None
+    expected = osm_factors(old)
+    del expected[graph.node_ids[graph.edge_sources()[dropped[0]]], graph.node_ids[graph.indices[dropped[0]]]]
+    assert osm_factors(new) == pytest.approx(expected)
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+import shapely
+from conftest import ORIGIN, SPACING
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from maps_utils import maps_init
+from maps_utils.hazards import HAZARD_PENALTY, HazardFeed
+from maps_utils.maps_init import MapRegistry
+from maps_utils.tiled_graph import TileCache, TiledGraph, export_tiles
+from maps_utils.weights import WeightProfiles
+from routes.routing import router
+from routing_utils.cache import route_cache
+
+
+@pytest.fixture
+def map_data(graph, monkeypatch):
+    """A registry serving the grid alone, without ALT landmarks."""
+    map_data = {
+        "name": "Grid", "coordinates": ORIGIN, "map": graph,
+        "boundary": shapely.box(graph.x.min(), graph.y.min(), graph.x.max(), graph.y.max()),
+        "weights": WeightProfiles(graph), "landmarks": {}, "no_fly": None, "grid": None, "version": 1,
+    }
+    monkeypatch.setattr(maps_init, "_registry", MapRegistry([map_data]))
+    route_cache.clear()
+    yield map_data
+    route_cache.clear()
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def point(col, row):
+    return {"longitude": ORIGIN[0] + col * SPACING, "latitude": ORIGIN[1] + row * SPACING}
+
+
+def test_alt_without_landmarks_is_rejected_even_when_cached(map_data, client):
+    body = {"start_coordinates": point(2, 3), "end_coordinates": point(15, 12)}
+    assert client.post("/routing/", json=body).headers["X-Cache"] == "MISS"
+    assert client.post("/routing/", json=body).headers["X-Cache"] == "HIT"
+    assert client.post("/routing/?algorithm=alt", json=body).status_code == 400
+
+
+def detections(*points):
+    return HazardFeed.from_geojson({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [p["longitude"], p["latitude"]]},
+         "properties": {}} for p in points
+    ]})
+
+
+def test_dispatch_reaches_an_incident_at_a_detection(map_data, client):
+    map_data["weights"].set_hazards(*detections(point(10, 10)).edge_factors(map_data["map"]))
+    vehicles = [{"id": "near", "coordinates": point(10.3, 10)}, {"id": "far", "coordinates": point(18, 2)}]
+    response = client.post("/routing/dispatch", json={"incident": point(10, 10), "vehicles": vehicles})
+    assert response.status_code == 200
+    candidates = {candidate["id"]: candidate for candidate in response.json()["candidates"]}
+    assert all(candidate["reachable"] for candidate in candidates.values())
+    assert candidates["near"]["rank"] == 1
+
+
+def test_only_the_closures_at_the_ends_are_opened(graph):
+    weights = WeightProfiles(graph)
+    weights.set_hazards(*detections(point(10, 10), point(4, 15)).edge_factors(graph))
+    profile = weights.get("length", avoid_hazards=True)
+    closed = profile.closures[0]
+    fire, elsewhere = graph.nearest_node(**point(10, 10)), graph.nearest_node(**point(18, 2))
+
+    assert weights.get("length", True, open_at=[elsewhere]) is profile
+    opened = weights.get("length", True, open_at=[fire, elsewhere])
+    reopened = closed[np.isfinite(opened.values[closed])]
+    # the zone around the first detection is penalized, the one around the second stays closed
+    assert 0 < len(reopened) < len(closed)
+    np.testing.assert_allclose(opened.values[reopened], weights.get("length").values[reopened] * HAZARD_PENALTY)
+    assert np.isinf(profile.values[reopened]).all()
+
+
+def test_route_to_a_detection(map_data, client):
+    map_data["weights"].set_hazards(*detections(point(10, 10)).edge_factors(map_data["map"]))
+    body = {"start_coordinates": point(2, 3), "end_coordinates": point(10, 10)}
+    for cache_status in ("MISS", "HIT"):
+        response = client.post("/routing/?weight=time", json=body)
+        assert response.status_code == 200 and response.headers["X-Cache"] == cache_status
+    assert response.json()["features"]
+
+
+@pytest.fixture
+def tiled_map(graph, tmp_path, monkeypatch):
+    directory = str(tmp_path / "grid.tiles")
+    export_tiles(graph, directory, tile_size=0.005)
+    tiled = TiledGraph.open(directory, cache=TileCache(max_bytes=64 * 2**10))
+    map_data = {
+        "name": "Tiled grid", "coordinates": ORIGIN, "map": tiled,
+        "boundary": shapely.box(graph.x.min(), graph.y.min(), graph.x.max(), graph.y.max()),
+        "weights": None, "landmarks": {}, "no_fly": None, "grid": None, "version": 1, "tiled": True,
+    }
+    monkeypatch.setattr(maps_init, "_registry", MapRegistry([map_data]))
+    route_cache.clear()
+    yield map_data
+    route_cache.clear()
+
+
+def test_route_on_a_tiled_map_to_a_detection(tiled_map, client):
+    body = {"start_coordinates": point(2, 3), "end_coordinates": point(10, 10)}
+    plain = client.post("/routing/?format=binary", json=body)
+    tiled_map["map"].set_hazards(detections(point(10, 10)))
+    for cache_status in ("MISS", "HIT"):
+        response = client.post("/routing/?format=binary", json=body)
+        assert response.status_code == 200 and response.headers["X-Cache"] == cache_status
+    assert plain.headers["X-Cache"] == "MISS" and response.content != plain.content
@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import networkx as nx
+import numpy as np
+import pytest
+from conftest import assert_connected, node_pairs, route_cost
+from maps_utils.compact_graph import CompactGraph, read_arrays, write_arrays
+from maps_utils.landmarks import Landmarks
+from maps_utils.weights import WeightProfiles
+from routing_utils import executor
+from routing_utils.executor import DeadlineExceeded
+from routing_utils.search import alt_shortest_path, distance_matrix, shortest_path
+
+
+@pytest.fixture(scope="module")
+def weights(graph):
+    return WeightProfiles(graph)
+
+
+@pytest.fixture(scope="module")
+def landmarks(weights):
+    return {base: Landmarks(weights.get(base), count=8) for base in ("length", "time")}
+
+
+def test_save_load_roundtrip(graph, tmp_path):
+    path =graph.save(str(tmp_path / "grid.graph"))
+    loaded = CompactGraph.load(path)
+    for name in ("node_ids", "x", "y", "indptr", "indices", "length", "travel_time", "geom_offsets", "geom_coords"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(graph, name))
+    assert loaded.meta == graph.meta
+
+
+def test_concurrent_writers_never_tear_the_file(tmp_path):
+    path = str(tmp_path / "shared.graph")
+
+    def write(worker):
+        for _ in range(20):
+            write_arrays(path, {"values": (np.full(50_000, worker), "<i8")}, {"worker": worker})
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(write, range(4)))
+    arrays, meta = read_arrays(path)
+    assert (np.asarray(arrays["values"]) == meta["worker"]).all()
+    assert os.listdir(tmp_path) == ["shared.graph"]
+
+
+@pytest.mark.parametrize("weight", ["length", "travel_time"])
+def test_dijkstra_matches_networkx(road_network, graph, weights, weight):
+    profile = weights.get("length" if weight == "length" else "time")
+    for orig_node, dest_node in node_pairs(graph):
+        route = shortest_path(profile, orig_node, dest_node)
+        source, target = int(graph.node_ids[orig_node]), int(graph.node_ids[dest_node])
+        try:
+            expected = nx.shortest_path_length(road_network, source, target, weight=weight)
+        except nx.NetworkXNoPath:
+            assert route is None
+            continue
+        assert_connected(graph, route, orig_node, dest_node)
+        assert route_cost(profile.values, route) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("base", ["length", "time"])
+def test_alt_matches_dijkstra(graph, weights, landmarks, base):
+    profile = weights.get(base)
+    for orig_node, dest_node in node_pairs(graph):
+        expected = shortest_path(profile, orig_node, dest_node)
+        route = alt_shortest_path(profile, landmarks[base], orig_node, dest_node)
+        if expected is None:
+            assert route is None
+            continue
+        assert_connected(graph, route, orig_node, dest_node)
+        assert route_cost(profile.values, route) == pytest.approx(route_cost(profile.values, expected))
+
+
+def test_distance_matrix_matches_dijkstra(graph, weights):
+    profile = weights.get("length")
+    pairs = np.array(node_pairs(graph, count=10))
+    matrix = distance_matrix(profile, pairs[:, 0], pairs[:, 1])
+    for i, orig_node in enumerate(pairs[:, 0].tolist()):
+        for j, dest_node in enumerate(pairs[:, 1].tolist()):
+            route = shortest_path(profile, orig_node, dest_node)
+            expected = np.inf if route is None else route_cost(profile.values, route)
+            assert matrix[i, j] == pytest.approx(expected)
+
+
+def test_closed_edges_are_avoided(graph, landmarks):
+    weights = WeightProfiles(graph)
+    base = weights.get("time")
+    for orig_node, dest_node in node_pairs(graph, count=10, seed=2):
+        route = shortest_path(base, orig_node, dest_node)
+        if not route:
+            continue
+        # close the middle road of the route in an overlay
+        closed = route[len(route) // 2]
+        overlay = weights.update("closures", [closed], [np.inf])
+        detour = shortest_path(overlay, orig_node, dest_node)
+        fast = alt_shortest_path(overlay, landmarks["time"], orig_node, dest_node)
+        if detour is None:
+            assert fast is None
+            continue
+        assert closed not in detour and closed not in fast
+        assert route_cost(overlay.values, fast) == pytest.approx(route_cost(overlay.values, detour))
+        assert route_cost(overlay.values, detour) >= route_cost(base.values, route)
+        weights.update("closures", [closed], [1.0])
+
+
+def test_cancelled_searches_stop(graph, weights, landmarks, monkeypatch):
+    monkeypatch.setattr(executor._local, "cancel", np.ones(1, dtype=np.bool_), raising=False)
+    profile = weights.get("length")
+    orig_node, dest_node = node_pairs(graph, count=1)[0]
+    with pytest.raises(DeadlineExceeded):
+        alt_shortest_path(profile, landmarks["length"], orig_node, dest_node)
+    with pytest.raises(DeadlineExceeded):
+        distance_matrix(profile, [orig_node], [dest_node])
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from conftest import node_pairs, route_cost
+from maps_utils.hazards import HazardFeed
+from maps_utils.tiled_graph import TileCache, TiledGraph, export_tiles
+from maps_utils.weights import WeightProfiles
+from routing_utils.search import shortest_path
+
+
+@pytest.fixture(scope="module")
+def tiled(graph, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tiles") / "grid.tiles")
+    export_tiles(graph, directory, tile_size=0.005)
+    # a budget of a few tiles, so that the searches evict and reload them
+    return TiledGraph.open(directory, cache=TileCache(max_bytes=64 * 2**10))
+
+
+def tiled_values(tiled, name):
+    """A per-edge array of the whole tiled graph, in its global edge ids."""
+    return np.concatenate([getattr(tiled.tile(t), name) for t in range(len(tiled.tile_keys))])
+
+
+def test_tiles_keep_every_node_and_edge(graph, tiled):
+    assert tiled.number_of_nodes() == graph.number_of_nodes()
+    assert tiled.number_of_edges() == graph.number_of_edges()
+    assert len(tiled.tile_keys) > 4
+    assert sorted(tiled.node_ids[np.arange(tiled.number_of_nodes())]) == sorted(graph.node_ids.tolist())
+
+
+@pytest.mark.parametrize("weight", ["length", "time"])
+def test_tiled_matches_monolithic(graph, tiled, weight):
+    profile = WeightProfiles(graph).get(weight)
+    values = tiled_values(tiled, "length" if weight == "length" else "travel_time")
+    # the tiled graph renumbers the nodes, the OSM ids are shared
+    tiled_nodes = {osm_id: node for node, osm_id in enumerate(tiled.node_ids[np.arange(tiled.number_of_nodes())].tolist())}
+    for orig_node, dest_node in node_pairs(graph):
+        expected = shortest_path(profile, orig_node, dest_node)
+        route = tiled.shortest_path(
+            tiled_nodes[int(graph.node_ids[orig_node])], tiled_nodes[int(graph.node_ids[dest_node])], weight
+        )
+        if expected is None:
+            assert route is None
+            continue
+        assert route_cost(values, route) == pytest.approx(route_cost(profile.values, expected))
+
+
+def test_tiled_snapping_matches_monolithic(graph, tiled):
+    rng = np.random.default_rng(3)
+    longitudes = rng.uniform(graph.x.min(), graph.x.max(), 50)
+    latitudes = rng.uniform(graph.y.min(), graph.y.max(), 50)
+    nodes, distances = graph.nearest_nodes(longitudes, latitudes)
+    tiled_nodes, tiled_distances = tiled.nearest_nodes(longitudes, latitudes)
+    np.testing.assert_allclose(tiled_distances, distances)
+    np.testing.assert_array_equal(tiled.node_ids[tiled_nodes], graph.node_ids[nodes])
+
+
+def test_tiled_avoids_hazards_like_monolithic(graph, tiled):
+    weights = WeightProfiles(graph)
+    fires = [(11.3405, 44.4985), (11.334, 44.504), (11.345, 44.5065)]
+    feed = HazardFeed.from_geojson({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": fire}, "properties": {}} for fire in fires
+    ]})
+    weights.set_hazards(*feed.edge_factors(graph))
+    tiled.set_hazards(feed)
+    # a tiled edge is the monolithic one with the same ends and length
+    sources = np.concatenate([
+        np.repeat(np.arange(tiled.node_start[t], tiled.node_start[t + 1]), np.diff(tiled.tile(t).indptr))
+        for t in range(len(tiled.tile_keys))
+    ])
+    lengths, targets = tiled_values(tiled, "length"), tiled_values(tiled, "indices")
+    osm_ids = tiled.node_ids[np.arange(tiled.number_of_nodes())]
+    monolithic = {
+        (int(graph.node_ids[u]), int(graph.node_ids[v]), length): edge
+        for edge, (u, v, length) in enumerate(zip(graph.edge_sources().tolist(), graph.indices.tolist(), graph.length.tolist()))
+    }
+    tiled_nodes = {osm_id: node for node, osm_id in enumerate(osm_ids.tolist())}
+    for orig_node, dest_node in node_pairs(graph, seed=4):
+        profile = weights.get("length", avoid_hazards=True, open_at=[orig_node, dest_node])
+        expected = shortest_path(profile, orig_node, dest_node)
+        route = tiled.shortest_path(
+            tiled_nodes[int(graph.node_ids[orig_node])], tiled_nodes[int(graph.node_ids[dest_node])],
+            "length", tiled.hazards,
+        )
+        if expected is None:
+            assert route is None
+            continue
+        route = [monolithic[(int(osm_ids[sources[e]]), int(osm_ids[targets[e]]), float(lengths[e]))] for e in route]
+        assert route_cost(profile.values, route) == pytest.approx(route_cost(profile.values, expected))
+    assert np.isinf(weights.get("length", avoid_hazards=True).values).any()